@@ -0,0 +1,188 @@
+# CRUD operations แบบ async (ใช้กับ main_async.py)
+# ฟังก์ชันทั่วไปเขียนเป็น async query ตรงๆ ส่วนที่เกี่ยวกับ token book / signed token / bulk mint
+# เรียกใช้ implementation เดียวกับ crud.py ผ่าน AsyncSession.run_sync เพื่อให้สองโหมดทำงานเหมือนกันทุกอย่าง
+
+import secrets
+import time
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError
+from models import User, Transaction, Token, ArchivedToken, TokenSerial, ApiKey
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import List, Optional
+import crud
+from config import API_KEY_TTL
+from hashing import password_hasher
+from token_signing import SIGNED_TOKEN_PREFIX, parse_book_token_id
+from user_cache import UserSnapshot, user_cache
+
+async def create_user(db: AsyncSession, username: str, password: str, initial_balance: float = 0.0) -> User:
+    # สร้างผู้ใช้ใหม่ (hash รหัสผ่านใน process pool ไม่บล็อก event loop)
+    hashed_password = await password_hasher.hash(password)
+    try:
+        user = User(username=username, hashed_password=hashed_password, balance=Decimal(str(initial_balance)))
+        db.add(user)
+        generation = user_cache.generation(db)
+        await db.commit()
+        await db.refresh(user)
+    except IntegrityError:
+        await db.rollback()
+        raise ValueError('Username already exists')
+    user_cache.put(db, crud.snapshot_user(user), generation)
+    return user
+
+async def authenticate_user(db: AsyncSession, username: str, password: str) -> Optional[User]:
+    user = await get_user_by_username(db, username)
+    if not user:
+        return None
+    if not await password_hasher.verify(password, user.hashed_password):
+        return None
+    return user
+
+async def create_api_key(db: AsyncSession, user_id: int) -> dict:
+    # ออก API key ใหม่ เก็บเฉพาะ sha256 (เหมือน crud.create_api_key)
+    api_key = secrets.token_urlsafe(32)
+    expires_at = int(time.time()) + API_KEY_TTL
+    db.add(ApiKey(key_hash=crud.hash_api_key(api_key), user_id=user_id, expires_at=expires_at))
+    await db.commit()
+    return {"api_key": api_key, "api_key_expires_at": datetime.fromtimestamp(expires_at, timezone.utc)}
+
+async def get_user_id_by_api_key(db: AsyncSession, api_key: str) -> Optional[int]:
+    # ตรวจ API key ด้วย primary key lookup ครั้งเดียว
+    row = (await db.execute(select(ApiKey.user_id, ApiKey.expires_at).where(ApiKey.key_hash == crud.hash_api_key(api_key)))).first()
+    if row is None or row.expires_at < time.time():
+        return None
+    return row.user_id
+
+async def get_user(db: AsyncSession, user_id: int) -> User:
+
+    # ดึงข้อมูลผู้ใช้ตาม ID
+    return (await db.execute(select(User).where(User.id == user_id))).scalar_one_or_none()
+
+async def get_user_profile(db: AsyncSession, user_id: int) -> Optional[UserSnapshot]:
+
+    # ดึงข้อมูลผู้ใช้ผ่าน user_cache (เหมือน crud.get_user_profile)
+    user = user_cache.get(user_id)
+    if user is None:
+        generation = user_cache.generation(db)
+        row = (await db.execute(select(*crud.USER_SNAPSHOT_COLUMNS).where(User.id == user_id))).first()
+        if row is None:
+            return None
+        user = UserSnapshot(*row)
+        user_cache.put(db, user, generation)
+    return user
+
+async def get_user_by_username(db: AsyncSession, username: str) -> User:
+
+    # ดึงข้อมูลผู้ใช้ตามชื่อผู้ใช้
+    return (await db.execute(select(User).where(User.username == username))).scalar_one_or_none()
+
+async def get_all_users(db: AsyncSession, skip: int = 0, limit: int = 100):
+
+    # ดึงข้อมูลผู้ใช้ทั้งหมด
+    return (await db.execute(select(User).offset(skip).limit(limit))).scalars().all()
+
+async def get_users_transactions(db: AsyncSession, user_id: int, skip: int = 0, limit: int = 50):
+
+    # ดึงข้อมูลธุรกรรมของผู้ใช้ จากใหม่ไปเก่า
+    query = select(Transaction).where(Transaction.user_id == user_id).order_by(Transaction.timestamp.desc(), Transaction.id.desc()).offset(skip).limit(limit)
+    return (await db.execute(query)).scalars().all()
+
+async def get_users_transactions_page(db: AsyncSession, user_id: int, limit: int = 50, cursor: Optional[str] = None):
+
+    # ดึงธุรกรรมหนึ่งหน้าแบบ keyset (query เดียวกับ crud.get_users_transactions_page)
+    transactions = (await db.execute(crud.transactions_page_query(user_id, limit, cursor))).scalars().all()
+    return transactions, crud.transactions_next_cursor(transactions, limit)
+
+async def get_token(db: AsyncSession, token_id: str) -> Token:
+
+    # ดึงข้อมูลโทเค็นจากโทเค็น ID
+    return (await db.execute(select(Token).where(Token.token_id == token_id))).scalar_one_or_none()
+
+async def get_archived_token(db: AsyncSession, token_id: str) -> ArchivedToken:
+
+    # token ที่ใช้แล้วและถูกย้ายไป TokensArchive
+    return (await db.execute(select(ArchivedToken).where(ArchivedToken.token_id == token_id))).scalar_one_or_none()
+
+async def get_serial_watermark(db: AsyncSession) -> int:
+
+    # serial ตัวถัดไปที่จะออก
+    next_serial = (await db.execute(select(TokenSerial.next_serial).where(TokenSerial.id == 1))).scalar_one_or_none()
+    return next_serial or 0
+
+async def verify_and_use_token(db: AsyncSession, token_id: str) -> dict:
+    # conditional UPDATE เดียวกับ crud.verify_and_use_token (สำเร็จเฉพาะ token ที่ยังไม่ถูกใช้)
+    if crud.signed_token_expired(token_id):
+        return {"valid": False, "message": 'Token expired'}
+    if parse_book_token_id(token_id) is None:
+        spent_by = (await db.execute(
+            update(Token)
+            .where(Token.token_id == token_id, Token.used == False)
+            .values(used=True, used_at=datetime.now(timezone.utc))
+            .returning(Token.user_id)
+            .execution_options(synchronize_session=False)
+        )).scalar_one_or_none()
+        if spent_by is not None:
+            await db.run_sync(crud.record_usage, {spent_by: {"tokens_used": 1}})
+            await db.commit()
+            return {"valid": True, "user_id": spent_by, "token_id": token_id}
+        await db.commit()
+
+        token = await get_token(db, token_id) or await get_archived_token(db, token_id)
+        if token:
+            return {"valid": False, "message": 'Token already used', "used_at": token.used_at}
+        if not token_id.startswith(SIGNED_TOKEN_PREFIX + "."):
+            return {"valid": False, "message": 'Token not found'}
+
+    # token ใน TokenBook หรือ signed token ที่ออกในโหมด book
+    return (await verify_and_use_tokens(db, [token_id]))[0]
+
+async def verify_and_use_tokens(db: AsyncSession, token_ids: List[str], atomic: bool = False) -> List[dict]:
+    # ใช้โทเค็นหลายใบใน transaction เดียว
+    results = await db.run_sync(crud.spend_tokens, token_ids, atomic)
+    await db.commit()
+    return results
+
+async def get_user_token(db: AsyncSession, user_id: int, unused_only: bool = False) -> List[Token]:
+
+    # ดึงข้อมูลโทเค็นของผู้ใช้ (รวม token จาก TokenBook)
+    return await db.run_sync(crud.get_user_token, user_id, unused_only)
+
+async def get_user_tokens_page(db: AsyncSession, user_id: int, unused_only: bool = False, limit: int = 100, cursor: Optional[str] = None):
+
+    # ดึง token หนึ่งหน้าแบบ keyset (รวม token จาก TokenBook)
+    return await db.run_sync(crud.get_user_tokens_page, user_id, unused_only, limit, cursor)
+
+async def update_balance(db: AsyncSession, user_id: int, amount: float, transaction_type: str, description: str = None) -> UserSnapshot:
+
+    # ใช้ crud.apply_balance_update ตัวเดียวกับโหมด sync (เช็คผู้ใช้ผ่าน user_cache, conditional UPDATE ... RETURNING ยอดใหม่)
+    try:
+        user = await db.run_sync(crud.apply_balance_update, user_id, amount, transaction_type, description)
+    except ValueError:
+        await db.rollback()
+        raise
+    await db.commit()
+    return user
+
+async def topup(db: AsyncSession, user_id: int, amount: float) -> UserSnapshot:
+
+    # เติมเงินเข้าบัญชีผู้ใช้
+    if amount <= 0:
+        raise ValueError('Top-up amount must be positive')
+    return await update_balance(db, user_id, amount, "topup", f"Top-up {amount} Baht")
+
+async def purchase(db: AsyncSession, user_id: int, quantity: int, price_per_token: float, signed: bool = False) -> dict:
+    # ใช้ crud.apply_purchase ตัวเดียวกับโหมด sync: หัก balance แบบ conditional UPDATE แล้วสร้าง token
+    try:
+        result = await db.run_sync(crud.apply_purchase, user_id, quantity, price_per_token, signed)
+        await db.commit()
+        return result
+    except Exception as e:
+        await db.rollback()
+        raise e
+
+async def get_usage(db: AsyncSession, user_id: int = crud.GLOBAL_USAGE_USER_ID, hours: int = 24, days: int = 30) -> dict:
+
+    # ยอดใช้งานจาก UsageRollups (เหมือน crud.get_usage)
+    return await db.run_sync(crud.get_usage, user_id, hours, days)
@@ -0,0 +1,30 @@
+# Async engine/session สำหรับ Bank แบบ async (main_async.py)
+# ใช้ไฟล์ฐานข้อมูลเดียวกับ database.py และตั้ง pragma ชุดเดียวกัน
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from models import Base, create_missing_indexes
+from database import DATABASE_URL, set_sqlite_pragma
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW
+
+ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite://", "sqlite+aiosqlite://", 1)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    echo=False
+)
+event.listen(async_engine.sync_engine, "connect", set_sqlite_pragma)
+
+# expire_on_commit=False: object ที่ส่งกลับไป serialize หลัง commit ต้องไม่ lazy-load (async ทำไม่ได้)
+asyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+async def init_db():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
+
+async def get_async_db():
+    async with asyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,69 @@
+# สร้าง UsageRollups ใหม่จากข้อมูลเดิม (ฐานข้อมูลที่มีอยู่ก่อนมี rollup หรือหลังปิด BANK_USAGE_ROLLUPS ไปช่วงหนึ่ง)
+#
+# วิธีใช้: หยุด Bank ก่อน แล้วรัน BANK_USAGE_ROLLUPS=1 python backfill_usage.py (แล้วเริ่ม Bank ด้วย BANK_USAGE_ROLLUPS=1)
+#   script นี้ลบ rollup เดิมทั้งหมดแล้วคำนวณใหม่ใน transaction เดียว
+#   (ถ้า Bank ยังรับรายการอยู่ระหว่างนั้น ยอดของรายการเหล่านั้นจะถูกนับซ้ำหรือหายไป)
+#
+# token ที่ถูกย้ายไป TokensArchive (token_archive.py) นับรวมด้วย
+# หมายเหตุ: TokenBook ไม่ได้เก็บเวลาที่ใช้ของแต่ละ slot จึงนับ token ที่ใช้แล้วทั้งเล่มไว้ที่ชั่วโมงของ last_used_at
+
+from datetime import datetime, timezone
+from sqlalchemy import case, delete, func
+from database import sessionLocal, init_db
+from models import Transaction, Token, ArchivedToken, TokenBook, UsageRollup
+import crud
+
+HOUR_FORMAT = "%Y-%m-%d %H:00:00"
+
+
+def add(usage, user_id, hour, **delta):
+    bucket = usage.setdefault(hour, {}).setdefault(user_id, {})
+    for field, value in delta.items():
+        bucket[field] = bucket.get(field, 0) + (value or 0)
+
+
+def main():
+    if not crud.USAGE_ROLLUPS_ENABLED:
+        raise SystemExit("Usage rollups are disabled: run with BANK_USAGE_ROLLUPS=1")
+    init_db()
+    db = sessionLocal()
+    usage = {}   # ชั่วโมง -> user_id -> ยอด
+    try:
+        hour = func.strftime(HOUR_FORMAT, Transaction.timestamp)
+        for user_id, at, topped_up, spent in db.query(
+                Transaction.user_id, hour,
+                func.sum(case((Transaction.amount > 0, Transaction.amount), else_=0)),
+                func.sum(case((Transaction.amount < 0, -Transaction.amount), else_=0))).group_by(Transaction.user_id, hour):
+            add(usage, user_id, at, topped_up=topped_up, spent=spent)
+
+        for model in (Token, ArchivedToken):
+            hour = func.strftime(HOUR_FORMAT, model.created_at)
+            for user_id, at, bought in db.query(model.user_id, hour, func.count()).group_by(model.user_id, hour):
+                add(usage, user_id, at, tokens_bought=bought)
+            hour = func.strftime(HOUR_FORMAT, model.used_at)
+            for user_id, at, used in db.query(model.user_id, hour, func.count()).filter(model.used == True).group_by(model.user_id, hour):
+                add(usage, user_id, at, tokens_used=used)
+
+        hour = func.strftime(HOUR_FORMAT, TokenBook.created_at)
+        for user_id, at, bought in db.query(TokenBook.user_id, hour, func.sum(TokenBook.count)).group_by(TokenBook.user_id, hour):
+            add(usage, user_id, at, tokens_bought=bought)
+        hour = func.strftime(HOUR_FORMAT, TokenBook.last_used_at)
+        for user_id, at, used in (db.query(TokenBook.user_id, hour, func.sum(TokenBook.used_count))
+                                  .filter(TokenBook.used_count > 0).group_by(TokenBook.user_id, hour)):
+            add(usage, user_id, at, tokens_used=used)
+
+        db.execute(delete(UsageRollup))
+        for at, by_user in usage.items():
+            crud.record_usage(db, by_user, at=datetime.strptime(at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc))
+        db.commit()
+        overall = crud.get_usage(db, hours=0, days=0)["total"]
+    finally:
+        db.close()
+
+    print(f"Rebuilt usage rollups for {len(usage)} hours of activity")
+    print(f"Total: spent {overall['spent']} Baht, topped up {overall['topped_up']} Baht, "
+          f"{overall['tokens_bought']} tokens bought, {overall['tokens_used']} tokens used")
+
+
+if __name__ == "__main__":
+    main()
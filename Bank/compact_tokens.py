@@ -0,0 +1,52 @@
+# ย้าย token ที่ใช้แล้วไป TokensArchive รอบเดียวจนหมด (งานเดียวกับที่ Bank ทำเองเป็นรอบ ๆ ดู token_archive.py) แล้วแสดงขนาดตาราง/ไฟล์
+#
+# วิธีใช้:
+#   python compact_tokens.py                              -> ย้าย token ที่ใช้แล้วเกิน BANK_TOKEN_ARCHIVE_AGE วินาที
+#   python compact_tokens.py --age 0                      -> ย้าย token ที่ใช้แล้วทั้งหมด
+#   python compact_tokens.py --enable-incremental-vacuum  -> ฐานข้อมูลที่สร้างก่อนมี auto_vacuum=INCREMENTAL:
+#       VACUUM ทั้งไฟล์ครั้งเดียว (หยุด Bank ก่อน ใช้เวลาและพื้นที่ดิสก์ชั่วคราวเท่าขนาดไฟล์) หลังจากนั้น Bank คืนพื้นที่ได้เองทีละน้อย
+
+import argparse
+from database import engine, init_db, sessionLocal
+from config import TOKEN_ARCHIVE_AGE, TOKEN_ARCHIVE_BATCH_SIZE, TOKEN_ARCHIVE_PAUSE_MS, TOKEN_ARCHIVE_VACUUM_PAGES
+from token_archive import TokenCompactor
+
+
+def enable_incremental_vacuum():
+    with engine.connect() as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            print("auto_vacuum is already INCREMENTAL")
+            return
+        connection.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+        print("Running VACUUM to switch auto_vacuum to INCREMENTAL ...")
+        connection.exec_driver_sql("VACUUM")
+        print(f"auto_vacuum = {connection.exec_driver_sql('PRAGMA auto_vacuum').scalar()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move spent tokens into TokensArchive and report table/file sizes")
+    parser.add_argument("--age", type=float, default=TOKEN_ARCHIVE_AGE, help="archive tokens used more than this many seconds ago")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true", help="one-time VACUUM of an existing database")
+    args = parser.parse_args()
+
+    init_db()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+
+    # ทำทุก batch จนหมดในรอบเดียว (ไม่จำกัดจำนวน batch ต่อรอบเหมือนตอนรันใน Bank)
+    compactor = TokenCompactor(sessionLocal, age=args.age, interval=0, batch_size=TOKEN_ARCHIVE_BATCH_SIZE,
+                               max_batches=float("inf"), pause_ms=TOKEN_ARCHIVE_PAUSE_MS, vacuum_pages=TOKEN_ARCHIVE_VACUUM_PAGES)
+    run = compactor.run_once()
+    storage = compactor.storage
+
+    print(f"Archived {run['archived']} tokens in {run['batches']} batches "
+          f"({run['duration_ms']:.0f} ms, longest batch {run['longest_batch_ms']:.1f} ms)")
+    print(f"Tokens: {storage['tokens_rows']} rows, TokensArchive: ~{storage['archive_rows_approx']} rows")
+    print(f"bank.db: {storage['db_bytes'] / 2 ** 20:.1f} MB, WAL: {storage['wal_bytes'] / 2 ** 20:.1f} MB, "
+          f"free pages: {storage['freelist_pages']} (returned {run['vacuumed_pages']}), auto_vacuum: {storage['auto_vacuum']}")
+    if storage["auto_vacuum"] != "incremental":
+        print("Free pages are only reused, not returned to the OS: run with --enable-incremental-vacuum once.")
+
+
+if __name__ == "__main__":
+    main()
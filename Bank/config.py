@@ -0,0 +1,103 @@
+# ค่าตั้งค่าของ Bank (อ่านจาก environment ได้ ถ้าไม่ตั้งจะใช้ค่า default)
+
+import os
+
+TOKEN_PRICE = float(os.getenv("BANK_TOKEN_PRICE", "0.1"))  # Baht per request
+
+# จำนวน token สูงสุดต่อการซื้อหนึ่งครั้ง (/purchase/)
+MAX_PURCHASE_QUANTITY = int(os.getenv("BANK_MAX_PURCHASE_QUANTITY", "100"))
+# ซื้อตั้งแต่จำนวนนี้ขึ้นไปใช้ bulk insert (executemany ไม่ผ่าน ORM identity map)
+BULK_MINT_THRESHOLD = int(os.getenv("BANK_BULK_MINT_THRESHOLD", "50"))
+
+# รูปแบบการเก็บ token ที่ซื้อใหม่
+# row: หนึ่งแถวต่อหนึ่ง token ในตาราง Tokens (แบบเดิม)
+# book: หนึ่งแถวต่อการซื้อหนึ่งครั้งในตาราง TokenBooks + bitmap ของ slot ที่ใช้แล้ว
+# token แบบ row ที่มีอยู่แล้วยัง verify/แสดงผลได้ตามปกติทั้งสองโหมด
+TOKEN_STORAGE = os.getenv("BANK_TOKEN_STORAGE", "row")
+
+# จำนวน token สูงสุดต่อหนึ่งคำขอ /verify/batch
+VERIFY_BATCH_MAX_SIZE = int(os.getenv("BANK_VERIFY_BATCH_MAX_SIZE", "500"))
+
+# --- Signed payment tokens (ตรวจสอบแบบ offline ที่ Gateway) ---
+# ต้องตั้งค่าเดียวกับ PAYMENT_TOKEN_SECRET ของ Gateway ถ้าว่างไว้จะซื้อ signed token ไม่ได้
+TOKEN_SIGNING_SECRET = os.getenv("BANK_TOKEN_SECRET", "")
+SIGNED_TOKEN_TTL = int(os.getenv("BANK_SIGNED_TOKEN_TTL", str(24 * 60 * 60)))  # วินาที
+
+# --- SQLite connection pool + pragmas ---
+DB_POOL_SIZE = int(os.getenv("BANK_DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("BANK_DB_MAX_OVERFLOW", "10"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("BANK_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_SYNCHRONOUS = os.getenv("BANK_SQLITE_SYNCHRONOUS", "NORMAL")    # NORMAL ปลอดภัยกับ WAL (อาจเสีย commit ล่าสุดถ้าไฟดับ)
+SQLITE_MMAP_SIZE = int(os.getenv("BANK_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("BANK_SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+# --- Group commit writer (รวม topup/purchase/verify หลายคำขอเป็น transaction เดียว) ---
+GROUP_COMMIT_ENABLED = os.getenv("BANK_GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("BANK_GROUP_COMMIT_MAX_BATCH", "128"))
+GROUP_COMMIT_MAX_WAIT_MS = float(os.getenv("BANK_GROUP_COMMIT_MAX_WAIT_MS", "2"))   # รอรวม batch นานสุดเท่านี้
+GROUP_COMMIT_TIMEOUT = float(os.getenv("BANK_GROUP_COMMIT_TIMEOUT", "30"))          # caller รอผลนานสุด (วินาที)
+
+# --- Password hashing (argon2 ใน process pool แยกจาก request) ---
+# ค่า default เท่ากับของ passlib; hash เดิมยัง verify ได้เสมอเพราะพารามิเตอร์ถูกเก็บไว้ใน hash
+ARGON2_TIME_COST = int(os.getenv("BANK_ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("BANK_ARGON2_MEMORY_COST", "65536"))   # KiB
+ARGON2_PARALLELISM = int(os.getenv("BANK_ARGON2_PARALLELISM", "4"))
+HASH_WORKERS = int(os.getenv("BANK_HASH_WORKERS", "2"))
+HASH_MAX_QUEUE = int(os.getenv("BANK_HASH_MAX_QUEUE", "64"))      # เกินนี้ตอบ 503 ทันที
+HASH_RETRY_AFTER = int(os.getenv("BANK_HASH_RETRY_AFTER", "1"))   # วินาที
+
+# --- API key (ออกให้ตอน /login/ ตรวจด้วย sha256 lookup ไม่ต้อง hash รหัสผ่านซ้ำ) ---
+API_KEY_TTL = int(os.getenv("BANK_API_KEY_TTL", str(30 * 24 * 60 * 60)))   # วินาที
+# 1 = topup/purchase/ดูข้อมูลผู้ใช้ ต้องแนบ API key ของผู้ใช้นั้น (X-API-Key หรือ Authorization: Bearer)
+REQUIRE_API_KEY = os.getenv("BANK_REQUIRE_API_KEY", "0") == "1"
+
+# จำนวน token ต่อหน้าเมื่อใช้ cursor โดยไม่ระบุ limit (/users/{user_id}/tokens)
+TOKEN_PAGE_SIZE = int(os.getenv("BANK_TOKEN_PAGE_SIZE", "100"))
+
+# จำนวนแถวต่อ chunk ของ streaming export (/users/{user_id}/tokens/export, /transaction/export)
+EXPORT_CHUNK_SIZE = int(os.getenv("BANK_EXPORT_CHUNK_SIZE", "1000"))
+
+# --- Usage rollups (ยอดใช้งานรายชั่วโมง/รายวัน/ทั้งหมด ต่อผู้ใช้และทั้งระบบ) ---
+# ปิดไว้ก่อน: เปิดแล้วทุก verify/purchase/topup upsert 3 ช่วงเวลา x (ผู้ใช้ + ทั้งระบบ) ใน transaction เดียวกัน
+# (แถวของทั้งระบบถูกทุก request แก้) ปิดอยู่ /usage ตอบ 404 เปิดทีหลังให้รัน backfill_usage.py ก่อน
+USAGE_ROLLUPS_ENABLED = os.getenv("BANK_USAGE_ROLLUPS", "0") == "1"
+USAGE_MAX_HOURS = int(os.getenv("BANK_USAGE_MAX_HOURS", str(7 * 24)))    # จำนวนชั่วโมงย้อนหลังสูงสุดต่อคำขอ /usage
+USAGE_MAX_DAYS = int(os.getenv("BANK_USAGE_MAX_DAYS", "366"))
+
+# --- ที่อยู่ที่ bind ตอนรันด้วย python main.py / python main_async.py (uvicorn ตั้งเองผ่าน --host/--port) ---
+BANK_HOST = os.getenv("BANK_HOST", "143.198.85.26")
+BANK_PORT = int(os.getenv("BANK_PORT", "8000"))
+
+# --- Archive ของ token ที่ใช้แล้ว (token_archive.py) ---
+# ย้าย token ที่ใช้แล้วนานเกิน TOKEN_ARCHIVE_AGE ออกจาก Tokens ไป TokensArchive ทีละ batch เล็ก ๆ (lock เขียนสั้น)
+# แล้ว checkpoint WAL + incremental vacuum ทุกรอบ การ verify token ที่ถูกย้ายไปแล้วยังตอบ 'Token already used' เหมือนเดิม
+TOKEN_ARCHIVE_ENABLED = os.getenv("BANK_TOKEN_ARCHIVE", "1") == "1"
+TOKEN_ARCHIVE_AGE = int(os.getenv("BANK_TOKEN_ARCHIVE_AGE", str(24 * 60 * 60)))     # วินาทีหลังถูกใช้
+TOKEN_ARCHIVE_INTERVAL = float(os.getenv("BANK_TOKEN_ARCHIVE_INTERVAL", "60"))      # วินาทีระหว่างรอบ
+TOKEN_ARCHIVE_BATCH_SIZE = int(os.getenv("BANK_TOKEN_ARCHIVE_BATCH_SIZE", "500"))   # แถวต่อ transaction
+TOKEN_ARCHIVE_MAX_BATCHES = int(os.getenv("BANK_TOKEN_ARCHIVE_MAX_BATCHES", "20"))  # batch สูงสุดต่อรอบ
+TOKEN_ARCHIVE_PAUSE_MS = float(os.getenv("BANK_TOKEN_ARCHIVE_PAUSE_MS", "50"))      # พักระหว่าง batch ให้ request เขียนได้
+TOKEN_ARCHIVE_VACUUM_PAGES = int(os.getenv("BANK_TOKEN_ARCHIVE_VACUUM_PAGES", "1000"))  # หน้าว่างที่คืนให้ OS ต่อรอบ
+# auto_vacuum=INCREMENTAL ตั้งได้เฉพาะฐานข้อมูลใหม่ ฐานข้อมูลเดิมต้องรัน python compact_tokens.py --enable-incremental-vacuum ครั้งเดียว
+SQLITE_INCREMENTAL_VACUUM = os.getenv("BANK_SQLITE_INCREMENTAL_VACUUM", "1") == "1"
+# ขนาดไฟล์ WAL ที่เหลือไว้หลัง checkpoint (ไม่ตั้ง = WAL โตค้างที่ขนาดสูงสุดที่เคยถึง)
+SQLITE_JOURNAL_SIZE_LIMIT = int(os.getenv("BANK_SQLITE_JOURNAL_SIZE_LIMIT", str(64 * 1024 * 1024)))
+
+# --- Read-through cache ของข้อมูลผู้ใช้ (user_cache.py) ---
+# GET /users/{id} และการเช็คผู้ใช้ก่อน topup อ่านจาก cache ใน process, invalidate ทันทีหลัง commit ที่เขียนตาราง Users
+# รันหลาย worker: การเขียนจาก worker อื่นเห็นช้าได้ไม่เกิน TTL
+USER_CACHE_ENABLED = os.getenv("BANK_USER_CACHE", "1") == "1"
+USER_CACHE_MAX_ENTRIES = int(os.getenv("BANK_USER_CACHE_MAX_ENTRIES", "10000"))
+USER_CACHE_TTL = float(os.getenv("BANK_USER_CACHE_TTL", "30"))   # วินาที
+
+# --- Verify จาก index ใน memory + spend log (token_index.py, spend_log.py) ---
+# /verify/ ไม่แตะ SQLite: token ที่ยังไม่ถูกใช้อยู่ใน memory การใช้ token บันทึกลง spend log (fsync เป็น batch) ก่อนตอบ
+# แล้ว replay ลงตาราง Tokens ใน thread แยก ใช้ได้กับ Bank process เดียวเท่านั้น (spend log ถือ lock ไว้)
+TOKEN_INDEX_ENABLED = os.getenv("BANK_TOKEN_INDEX", "0") == "1"
+SPEND_LOG_PATH = os.getenv("BANK_SPEND_LOG", "spend.log")                           # ไฟล์จริงคือ spend.log.000001, ...
+SPEND_LOG_MAX_BATCH = int(os.getenv("BANK_SPEND_LOG_MAX_BATCH", "512"))            # คำขอต่อ fsync สูงสุด
+SPEND_LOG_MAX_WAIT_MS = float(os.getenv("BANK_SPEND_LOG_MAX_WAIT_MS", "0"))        # รอรวม batch (0 = เท่าที่ค้างอยู่)
+SPEND_LOG_TIMEOUT = float(os.getenv("BANK_SPEND_LOG_TIMEOUT", "30"))               # caller รอ fsync นานสุด (วินาที)
+SPEND_LOG_RETRY_AFTER = int(os.getenv("BANK_SPEND_LOG_RETRY_AFTER", "1"))         # Retry-After ของ 503 เมื่อเขียน log ไม่สำเร็จ
+TOKEN_INDEX_REPLAY_INTERVAL = float(os.getenv("BANK_TOKEN_INDEX_REPLAY_INTERVAL", "0.5"))    # วินาทีระหว่างรอบ replay
+TOKEN_INDEX_REPLAY_BATCH_SIZE = int(os.getenv("BANK_TOKEN_INDEX_REPLAY_BATCH_SIZE", "1000"))  # แถวต่อ transaction
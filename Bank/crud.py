@@ -1,33 +1,65 @@
 # CRUD operations ฟังก์ชันสำหรับจัดการข้อมูลธนาคาร
 
+from sqlalchemy import bindparam, insert, select, tuple_, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
-from models import User, Transaction, Token
+from models import User, Transaction, Token, ArchivedToken, TokenSerial, TokenBook, ApiKey, UsageRollup
 from datetime import datetime, timezone
 from decimal import Decimal
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
 import uuid
 from typing import List, Optional
-from passlib.context import CryptContext
+from config import TOKEN_SIGNING_SECRET, SIGNED_TOKEN_TTL, BULK_MINT_THRESHOLD, TOKEN_STORAGE, API_KEY_TTL, USAGE_ROLLUPS_ENABLED
+from hashing import hash_password, check_password
+from token_signing import SIGNED_TOKEN_PREFIX, make_signed_token, parse_signed_token, make_book_token_id, parse_book_token_id
+from user_cache import UserSnapshot, user_cache, mark_written
+
+BOOK_CAS_RETRIES = 5
+
+# คอลัมน์ที่ Tokens กับ TokensArchive มีเหมือนกัน (token_archive.py ย้ายแถวด้วยชุดนี้)
+TOKEN_COLUMNS = ("token_id", "user_id", "price", "created_at", "used", "used_at")
+# คอลัมน์ของ User ที่เก็บใน user_cache (ไม่รวม hashed_password)
+USER_SNAPSHOT_COLUMNS = (User.id, User.username, User.balance, User.created_at)
+
+# session.info: token แบบ row ที่ออกใน transaction นี้ [(user_id, token_ids)] (token_index.py เพิ่มเข้า index หลัง commit)
+MINTED_TOKENS_KEY = "minted_tokens"
+
+# ผลของ token ที่ผ่านแต่ไม่ถูกตัดยอด เพราะใบอื่นในคำขอแบบ all-or-nothing ไม่ผ่าน
+NOT_CHARGED = 'Token not charged: another token in the request was rejected'
+
+GLOBAL_USAGE_USER_ID = 0
+USAGE_FIELDS = ("spent", "topped_up", "tokens_bought", "tokens_used")
 
-pwd_context = CryptContext(schemes=["argon2"], deprecated='auto')
 def get_password(password):
-    return pwd_context.hash(password)
+    return hash_password(password)
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return check_password(plain_password, hashed_password)
 
 def create_user(db: Session, username:str, password: str, initial_balance: float= 0.0) -> User:
     # สร้างผู้ใช้ใหม่
-    hashed_password = get_password(password)
+    return create_user_with_hash(db, username, get_password(password), initial_balance)
+
+def create_user_with_hash(db: Session, username: str, hashed_password: str, initial_balance: float = 0.0) -> User:
+    # สร้างผู้ใช้จากรหัสผ่านที่ hash มาแล้ว (main.py hash ใน process pool ก่อนเรียก)
     try:
         user = User(username=username, hashed_password=hashed_password, balance=Decimal(str(initial_balance)))
         db.add(user)
+        generation = user_cache.generation(db)
         db.commit()
         db.refresh(user)
-        return user
     except IntegrityError:
         db.rollback()
         raise ValueError('Username already exists')
+    # ใส่ผู้ใช้ใหม่ลง cache เลย (GET /users/{id} ครั้งแรกหลังสมัครไม่ต้อง query)
+    user_cache.put(db, snapshot_user(user), generation)
+    return user
 
 def authenticate_user(db: Session, username: str, password: str)-> Optional[User]:
     user = db.query(User).filter(User.username==username).first()
@@ -37,11 +69,45 @@ def authenticate_user(db: Session, username: str, password: str)-> Optional[User
         return None
     return user
 
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+def create_api_key(db: Session, user_id: int) -> dict:
+    # ออก API key ใหม่ให้ผู้ใช้ เก็บเฉพาะ sha256 (key สุ่ม 256 bit จึงไม่ต้องใช้ hash แบบช้า)
+    api_key = secrets.token_urlsafe(32)
+    expires_at = int(time.time()) + API_KEY_TTL
+    db.add(ApiKey(key_hash=hash_api_key(api_key), user_id=user_id, expires_at=expires_at))
+    db.commit()
+    return {"api_key": api_key, "api_key_expires_at": datetime.fromtimestamp(expires_at, timezone.utc)}
+
+def get_user_id_by_api_key(db: Session, api_key: str) -> Optional[int]:
+    # ตรวจ API key ด้วย primary key lookup ครั้งเดียว
+    row = db.execute(select(ApiKey.user_id, ApiKey.expires_at).where(ApiKey.key_hash == hash_api_key(api_key))).first()
+    if row is None or row.expires_at < time.time():
+        return None
+    return row.user_id
+
 def get_user(db: Session, user_id: int) -> User:
 
     # ดึงข้อมูลผู้ใช้ตาม ID
     return db.query(User).filter(User.id==user_id).first()
 
+def snapshot_user(user: User) -> UserSnapshot:
+    return UserSnapshot(user.id, user.username, user.balance, user.created_at)
+
+def get_user_profile(db: Session, user_id: int) -> Optional[UserSnapshot]:
+
+    # ดึงข้อมูลผู้ใช้ผ่าน user_cache (ใช้เมื่อไม่ต้องการ ORM object: GET /users/{id}, เช็คผู้ใช้ก่อน topup)
+    user = user_cache.get(user_id)
+    if user is None:
+        generation = user_cache.generation(db)
+        row = db.execute(select(*USER_SNAPSHOT_COLUMNS).where(User.id == user_id)).first()
+        if row is None:
+            return None
+        user = UserSnapshot(*row)
+        user_cache.put(db, user, generation)
+    return user
+
 def get_user_by_username(db: Session, username:str) -> User:
 
     # ดึงข้อมูลผู้ใช้ตามชื่อผู้ใช้
@@ -62,26 +128,260 @@ def create_transaction(db: Session, user_id:int, amount:float, transaction_type:
 def get_users_transactions(db: Session, user_id:int, skip:int=0, limit: int=50):
 
     # ดึงข้อมูลธุรกรรมของผู้ใช้ จากใหม่ไปเก่า
-    return db.query(Transaction).filter(Transaction.user_id==user_id).order_by(Transaction.timestamp.desc()).offset(skip).limit(limit).all()
+    return db.query(Transaction).filter(Transaction.user_id==user_id).order_by(Transaction.timestamp.desc(), Transaction.id.desc()).offset(skip).limit(limit).all()
+
+def encode_cursor(*position) -> str:
+    # cursor ที่ส่งให้ client: ตำแหน่งของรายการสุดท้ายในหน้า (client ไม่ต้องรู้รูปแบบข้างใน)
+    return base64.urlsafe_b64encode(json.dumps(position, default=str).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise ValueError('Invalid cursor')
+
+def transactions_page_query(user_id: int, limit: int, cursor: Optional[str] = None):
+    # keyset pagination: เริ่มต่อจาก (timestamp, id) ของรายการสุดท้ายหน้าก่อน ใช้ ix_transactions_user_timestamp
+    # ไม่ต้องข้าม OFFSET แถว หน้าลึกแค่ไหนก็ใช้เวลาเท่าเดิม
+    query = select(Transaction).where(Transaction.user_id == user_id)
+    if cursor:
+        try:
+            timestamp, last_id = decode_cursor(cursor)
+            query = query.where(tuple_(Transaction.timestamp, Transaction.id) < (datetime.fromisoformat(timestamp), int(last_id)))
+        except (TypeError, ValueError):
+            raise ValueError('Invalid cursor')
+    return query.order_by(Transaction.timestamp.desc(), Transaction.id.desc()).limit(limit)
+
+def transactions_next_cursor(transactions: List[Transaction], limit: int) -> Optional[str]:
+    if not transactions or len(transactions) < limit:
+        return None
+    return encode_cursor(transactions[-1].timestamp.isoformat(), transactions[-1].id)
+
+def get_users_transactions_page(db: Session, user_id: int, limit: int = 50, cursor: Optional[str] = None):
+
+    # ดึงธุรกรรมหนึ่งหน้าแบบ keyset คืน (รายการ, cursor ของหน้าถัดไป หรือ None ถ้าหมดแล้ว)
+    transactions = db.execute(transactions_page_query(user_id, limit, cursor)).scalars().all()
+    return transactions, transactions_next_cursor(transactions, limit)
 
 def get_token(db: Session, token_id:str) -> Token:
 
     # ดึงข้อมูโทเค็นจากโทเค็น ID
     return db.query(Token).filter(Token.token_id==token_id).first()
 
+def get_archived_token(db: Session, token_id: str) -> ArchivedToken:
+
+    # token ที่ใช้แล้วและถูกย้ายไป TokensArchive (token_archive.py)
+    return db.query(ArchivedToken).filter(ArchivedToken.token_id==token_id).first()
+
+def signed_token_expired(token_id: str) -> bool:
+
+    # signed token (ทั้งโหมด row และ book) ที่เลย expires_at แล้วใช้ไม่ได้ ตรวจแบบเดียวกับ Gateway (offline_tokens.py)
+    if not TOKEN_SIGNING_SECRET or not token_id.startswith(SIGNED_TOKEN_PREFIX + "."):
+        return False
+    parsed = parse_signed_token(TOKEN_SIGNING_SECRET, token_id)
+    return parsed is not None and parsed[3] < time.time()
+
 def verify_and_use_token(db: Session, token_id:str) ->dict:
-    rows_updated = db.query(Token).filter(Token.token_id == token_id, Token.used == False).update({'used': True,'used_at': datetime.now(timezone.utc)})
+    if signed_token_expired(token_id):
+        return {"valid": False, "message": 'Token expired'}
+    if parse_book_token_id(token_id) is not None:
+        # token ใน TokenBook: flip bit ใน bitmap แทนการ UPDATE แถว
+        result = use_book_tokens(db, [token_id]).get(token_id, {"valid": False, "message": 'Token not found'})
+        db.commit()
+        return result
+
+    spent_by = db.execute(
+        update(Token)
+        .where(Token.token_id == token_id, Token.used == False)
+        .values(used=True, used_at=datetime.now(timezone.utc))
+        .returning(Token.user_id)
+        .execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+    if spent_by is not None:
+        record_usage(db, {spent_by: {"tokens_used": 1}})
+        db.commit()
+        return {"valid": True, "user_id": spent_by, "token_id": token_id}
     db.commit()
 
-    if rows_updated == 1:
-        token = get_token(db, token_id)
-        return {"valid": True, "user_id": token.user_id, "token_id": token_id}
+    token = get_token(db, token_id) or get_archived_token(db, token_id)
+    if not token:
+        # signed token ที่ออกในโหมด book ไม่มีแถวใน Tokens
+        result = use_book_tokens(db, [token_id]).get(token_id)
+        if result is not None:
+            db.commit()
+            return result
+        return {"valid": False, "message": 'Token not found'}
     else:
-        token = get_token(db, token_id)
-        if not token:
-            return {"valid": False, "message": 'Token not found'}
+        return {"valid": False, "message": 'Token already used', "used_at": token.used_at}
+
+def verify_and_use_tokens(db: Session, token_ids: List[str], atomic: bool = False) -> List[dict]:
+
+    # ใช้โทเค็นหลายใบใน transaction เดียว (UPDATE + SELECT + commit ครั้งเดียวทั้ง batch)
+    # ผลลัพธ์เรียงตามลำดับ token_ids ที่ส่งมา ถ้ามี token ซ้ำใน batch ใบแรกผ่าน ใบถัดไปได้ 'Token already used'
+    results = spend_tokens(db, token_ids, atomic)
+    db.commit()
+    return results
+
+def spend_token(db: Session, token_id: str) -> dict:
+
+    # ใช้โทเค็นใบเดียว (ไม่ commit เอง ใช้กับ group commit writer)
+    return spend_tokens(db, [token_id])[0]
+
+def spend_tokens(db: Session, token_ids: List[str], atomic: bool = False) -> List[dict]:
+
+    # ส่วนของ verify_and_use_tokens ที่ไม่ commit เอง
+    # atomic: ตัดยอดทุกใบหรือไม่ตัดเลย (ราคา route หลาย token) ใบใดไม่ผ่าน rollback savepoint ทั้งหมด
+    #   (token ซ้ำในคำขอเดียวกัน = ใบที่สองไม่ผ่าน) ใบที่ผ่านได้ NOT_CHARGED แทน
+    if not atomic:
+        return _spend_tokens(db, token_ids)
+    savepoint = db.begin_nested()
+    results = _spend_tokens(db, token_ids)
+    if all(result["valid"] for result in results):
+        savepoint.commit()
+        return results
+    savepoint.rollback()
+    return [result if not result["valid"] else {"valid": False, "message": NOT_CHARGED} for result in results]
+
+def _spend_tokens(db: Session, token_ids: List[str]) -> List[dict]:
+
+    expired = {token_id for token_id in token_ids if signed_token_expired(token_id)}
+    unique_ids = [token_id for token_id in dict.fromkeys(token_ids) if token_id not in expired]
+    used_at = datetime.now(timezone.utc)
+    # ค่าที่อ่านกลับจาก Tokens ได้ (DateTime ของ SQLite ไม่เก็บ timezone) token ซ้ำใน batch จะได้ used_at เหมือนเรียกแยกครั้ง
+    stored_used_at = used_at.replace(tzinfo=None)
+
+    spent = {}
+    if unique_ids:
+        rows = db.execute(
+            update(Token)
+            .where(Token.token_id.in_(unique_ids), Token.used == False)
+            .values(used=True, used_at=used_at)
+            .returning(Token.token_id, Token.user_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        spent = {row.token_id: row.user_id for row in rows}
+        used_by_user = {}
+        for user_id in spent.values():
+            used_by_user[user_id] = used_by_user.get(user_id, 0) + 1
+        record_usage(db, {user_id: {"tokens_used": count} for user_id, count in used_by_user.items()})
+
+    # token ที่ใช้ไม่สำเร็จ: แยกว่าไม่มีอยู่จริง หรือถูกใช้ไปแล้ว
+    rejected_ids = [token_id for token_id in unique_ids if token_id not in spent]
+    previously_used = {}
+    if rejected_ids:
+        previously_used = dict(db.query(Token.token_id, Token.used_at).filter(Token.token_id.in_(rejected_ids)).all())
+        # token ที่ใช้ไปนานแล้วอาจถูกย้ายไป TokensArchive
+        archive_ids = [token_id for token_id in rejected_ids if token_id not in previously_used]
+        if archive_ids:
+            previously_used.update(db.query(ArchivedToken.token_id, ArchivedToken.used_at)
+                                   .filter(ArchivedToken.token_id.in_(archive_ids)).all())
+
+    # ที่เหลือไม่มีแถวใน Tokens: ลองหาใน TokenBook
+    book_results = use_book_tokens(db, [token_id for token_id in rejected_ids if token_id not in previously_used])
+
+    results = []
+    for token_id in token_ids:
+        if token_id in expired:
+            results.append({"valid": False, "message": 'Token expired'})
+        elif token_id in spent:
+            results.append({"valid": True, "user_id": spent.pop(token_id), "token_id": token_id})
+            previously_used[token_id] = stored_used_at
+        elif token_id in book_results:
+            result = book_results[token_id]
+            results.append(result)
+            # token ใน book ไม่มี used_at รายใบ: ใบซ้ำได้ผลเดียวกับ use_book_tokens ตอบ token ที่ใช้แล้ว
+            book_results[token_id] = {"valid": False, "message": 'Token already used'}
+        elif token_id in previously_used:
+            results.append({"valid": False, "message": 'Token already used', "used_at": previously_used[token_id]})
         else:
-            return {"valid": False, "message": 'Token already used', "used_at": token.used_at}
+            results.append({"valid": False, "message": 'Token not found'})
+    return results
+
+def find_book_slot(db: Session, token_id: str):
+
+    # หา (TokenBook, slot) ของ token ID แบบ book หรือ signed token ที่ออกในโหมด book; ไม่พบคืน None
+    parsed = parse_book_token_id(token_id)
+    if parsed is not None:
+        book_id, slot = parsed
+        book = db.get(TokenBook, book_id)
+        if book is not None and 0 <= slot < book.count and hmac.compare_digest(make_book_token_id(book.secret, book.id, slot), token_id):
+            return book, slot
+        return None
+
+    if TOKEN_SIGNING_SECRET:
+        parsed = parse_signed_token(TOKEN_SIGNING_SECRET, token_id)
+        if parsed is not None:
+            user_id, _, serial, expires_at = parsed
+            book = db.query(TokenBook).filter(TokenBook.base_serial <= serial).order_by(TokenBook.base_serial.desc()).first()
+            if book is not None and serial < book.base_serial + book.count and book.user_id == user_id and book.expires_at == expires_at:
+                return book, serial - book.base_serial
+    return None
+
+def use_book_tokens(db: Session, token_ids: List[str]) -> dict:
+
+    # ใช้ token ใน TokenBook (ไม่ commit เอง) คืน dict token_id -> ผลลัพธ์ เฉพาะ token ที่หา book เจอ
+    # อ่าน bitmap -> set bit -> UPDATE แบบ compare-and-swap บน used_count ถ้ามีคนแก้ book เดียวกันก่อน ให้อ่านใหม่
+    by_book = {}
+    for token_id in token_ids:
+        found = find_book_slot(db, token_id)
+        if found is not None:
+            book, slot = found
+            by_book.setdefault(book.id, (book, []))[1].append((token_id, slot))
+
+    used_at = datetime.now(timezone.utc)
+    results = {}
+    for book, slots in by_book.values():
+        for _ in range(BOOK_CAS_RETRIES):
+            bitmap, used_count = db.execute(select(TokenBook.used_bitmap, TokenBook.used_count).where(TokenBook.id == book.id)).one()
+            bitmap = bytearray(bitmap)
+            book_results = {}
+            newly_used = 0
+            for token_id, slot in slots:
+                mask = 1 << (slot & 7)
+                if bitmap[slot >> 3] & mask:
+                    book_results[token_id] = {"valid": False, "message": 'Token already used'}
+                else:
+                    bitmap[slot >> 3] |= mask
+                    newly_used += 1
+                    book_results[token_id] = {"valid": True, "user_id": book.user_id, "token_id": token_id}
+            if newly_used == 0:
+                break
+
+            rows_updated = db.execute(
+                update(TokenBook)
+                .where(TokenBook.id == book.id, TokenBook.used_count == used_count)
+                .values(used_bitmap=bytes(bitmap), used_count=used_count + newly_used, last_used_at=used_at)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if rows_updated == 1:
+                record_usage(db, {book.user_id: {"tokens_used": newly_used}})
+                break
+        else:
+            raise RuntimeError(f"Token book {book.id} is being updated concurrently, please retry")
+        results.update(book_results)
+    return results
+
+def book_token_id(book: TokenBook, slot: int) -> str:
+
+    # token ID ของ slot หนึ่งใน book
+    if book.expires_at is not None:
+        return make_signed_token(TOKEN_SIGNING_SECRET, book.user_id, book.price, book.base_serial + slot, book.expires_at)
+    return make_book_token_id(book.secret, book.id, slot)
+
+def book_token_ids(book: TokenBook) -> List[str]:
+
+    # สร้าง token ID ของทุก slot ใน book
+    return [book_token_id(book, slot) for slot in range(book.count)]
+
+def mint_token_book(db: Session, user_id: int, quantity: int, price: Decimal, signed: bool = False) -> List[str]:
+
+    # สร้าง TokenBook หนึ่งแถวแทน token หลายแถว (ไม่ commit เอง) คืน token ID ทั้งหมด
+    book = TokenBook(user_id=user_id, price=price, base_serial=allocate_serials(db, quantity), count=quantity,
+                     secret=secrets.token_urlsafe(16), used_bitmap=bytes((quantity + 7) // 8), used_count=0,
+                     expires_at=int(time.time()) + SIGNED_TOKEN_TTL if signed else None)
+    db.add(book)
+    db.flush()
+    return book_token_ids(book)
 
 def get_user_token(db: Session, user_id:int, unused_only: bool= False) -> List[Token]:
 
@@ -91,12 +391,101 @@ def get_user_token(db: Session, user_id:int, unused_only: bool= False) -> List[T
 
     if unused_only:
         query = query.filter(Token.used==False)
-    return query.order_by(Token.created_at.desc()).all()
+    tokens = query.order_by(Token.created_at.desc()).all()
+    if not unused_only:
+        # token ที่ใช้แล้วซึ่งถูกย้ายไป TokensArchive ยังเป็นประวัติของผู้ใช้
+        archived = db.query(ArchivedToken).filter(ArchivedToken.user_id==user_id).all()
+        if archived:
+            tokens = sorted(tokens + archived, key=lambda t: t.created_at, reverse=True)
+
+    # token จาก TokenBook: แตกออกเป็นทีละ token (ไม่มี used_at รายใบ)
+    books = db.query(TokenBook).filter(TokenBook.user_id==user_id)
+    if unused_only:
+        books = books.filter(TokenBook.used_count < TokenBook.count)
+    book_tokens = []
+    for book in books.all():
+        for slot, token_id in enumerate(book_token_ids(book)):
+            used = bool(book.used_bitmap[slot >> 3] & (1 << (slot & 7)))
+            if unused_only and used:
+                continue
+            book_tokens.append({"token_id": token_id, "user_id": book.user_id, "price": book.price,
+                                "created_at": book.created_at, "used": used, "used_at": None})
+    if not book_tokens:
+        return tokens
+    return sorted(tokens + book_tokens, key=lambda t: t["created_at"] if isinstance(t, dict) else t.created_at, reverse=True)
+
+def get_user_tokens_page(db: Session, user_id: int, unused_only: bool = False, limit: int = 100, cursor: Optional[str] = None):
+
+    # ดึง token หนึ่งหน้าแบบ keyset (รวม token จาก TokenBook) คืน (รายการ, cursor ของหน้าถัดไป)
+    # ลำดับ: created_at ใหม่ไปเก่า ถ้า created_at เท่ากัน token แบบแถวมาก่อน book
+    # ในกลุ่มแถวเรียง token_id จากมากไปน้อย ในกลุ่ม book เรียง book id จากมากไปน้อย แล้ว slot จากน้อยไปมาก
+    # token แบบแถวอยู่ใน Tokens และ (ที่ใช้แล้วนานแล้ว) TokensArchive ซึ่งมีแต่ token ที่ใช้แล้ว
+    models = [Token] if unused_only else [Token, ArchivedToken]
+    rows = [select(model).where(model.user_id == user_id) for model in models]
+    books = select(TokenBook).where(TokenBook.user_id == user_id)
+    if unused_only:
+        rows = [query.where(Token.used == False) for query in rows]
+        books = books.where(TokenBook.used_count < TokenBook.count)
 
-def update_balance(db: Session, user_id:int, amount:float, transaction_type:str, description:str= None) -> User:
+    # cursor: ["r", created_at, token_id] หรือ ["b", created_at, book_id, slot]
+    position = decode_cursor(cursor) if cursor else None
+    try:
+        if position and position[0] == "r":
+            created_at, last_token_id = datetime.fromisoformat(position[1]), str(position[2])
+            rows = [query.where(tuple_(model.created_at, model.token_id) < (created_at, last_token_id))
+                    for model, query in zip(models, rows)]
+            books = books.where(TokenBook.created_at <= created_at)
+        elif position and position[0] == "b":
+            created_at, last_book_id, last_slot = datetime.fromisoformat(position[1]), int(position[2]), int(position[3])
+            rows = [query.where(model.created_at < created_at) for model, query in zip(models, rows)]
+            books = books.where(tuple_(TokenBook.created_at, TokenBook.id) <= (created_at, last_book_id))
+        elif position:
+            raise ValueError('Invalid cursor')
+    except (IndexError, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+    items = []      # (created_at, source, token_id ของแถว, cursor, token)
+    for model, query in zip(models, rows):
+        for token in db.execute(query.order_by(model.created_at.desc(), model.token_id.desc()).limit(limit)).scalars():
+            items.append((token.created_at, 1, token.token_id, ["r", token.created_at.isoformat(), token.token_id], token))
+
+    # book หนึ่งเล่มมี token ที่เลือกได้อย่างน้อยหนึ่งใบ (ยกเว้นเล่มที่ cursor ชี้อยู่) จึงอ่าน book ไม่เกิน limit + 1 เล่มก็พอ
+    book_items = 0
+    for book in db.execute(books.order_by(TokenBook.created_at.desc(), TokenBook.id.desc()).limit(limit + 1)).scalars():
+        first_slot = last_slot + 1 if position and position[0] == "b" and book.id == last_book_id else 0
+        for slot in range(first_slot, book.count):
+            if book_items >= limit:
+                break
+            used = bool(book.used_bitmap[slot >> 3] & (1 << (slot & 7)))
+            if unused_only and used:
+                continue
+            book_items += 1
+            items.append((book.created_at, 0, "", ["b", book.created_at.isoformat(), book.id, slot],
+                          {"token_id": book_token_id(book, slot), "user_id": book.user_id, "price": book.price,
+                           "created_at": book.created_at, "used": used, "used_at": None}))
+
+    # sort แบบ stable: แถวจากสองตารางเรียงด้วย token_id ส่วน book ยังเป็นลำดับตาม query ข้างบน
+    items.sort(key=lambda item: item[:3], reverse=True)
+    page = items[:limit]
+    next_cursor = encode_cursor(*page[-1][3]) if len(page) == limit else None
+    return [item[4] for item in page], next_cursor
+
+def update_balance(db: Session, user_id:int, amount:float, transaction_type:str, description:str= None) -> UserSnapshot:
 
     # อัพเดทยอดเงินคงเหลือของผู้ใช้และสร้างธุรกรรม (Atomic update ป้องกัน Race Condition)
-    user = get_user(db, user_id)
+    try:
+        user = apply_balance_update(db, user_id, amount, transaction_type, description)
+    except ValueError:
+        db.rollback()
+        raise
+    db.commit()
+    return user
+
+def apply_balance_update(db: Session, user_id:int, amount:float, transaction_type:str, description:str= None) -> UserSnapshot:
+
+    # ส่วนของ update_balance ที่ไม่ commit/rollback เอง (ใช้กับ group commit writer)
+    # ถ้า raise ValueError จะยังไม่มีการเขียนอะไรลงฐานข้อมูล
+    user = get_user_profile(db, user_id)
     if not user:
         raise ValueError(f"User ID {user_id} not found")
 
@@ -104,66 +493,200 @@ def update_balance(db: Session, user_id:int, amount:float, transaction_type:str,
 
     if amount >= 0:
         # เติมเงิน: ไม่ต้องเช็ค balance
-        rows_updated = db.query(User).filter(
-            User.id == user_id
-        ).update({"balance": User.balance + amount}, synchronize_session="fetch")
+        condition = (User.id == user_id,)
     else:
         # ถอนเงิน: เช็คว่ามีเงินพอในคำสั่งเดียว
-        rows_updated = db.query(User).filter(
-            User.id == user_id,
-            User.balance >= abs(amount)
-        ).update({"balance": User.balance + amount}, synchronize_session="fetch")
-
-    if rows_updated == 0:
-        db.rollback()
-        raise ValueError(f"Insufficient balance: {user.balance}, required: {abs(amount)}")
-
+        condition = (User.id == user_id, User.balance >= abs(amount))
+    # RETURNING ได้ยอดหลังรายการนี้พอดี (ไม่ต้อง refresh อีกรอบ)
+    balance = db.execute(
+        update(User).where(*condition).values(balance=User.balance + amount)
+        .returning(User.balance).execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+
+    if balance is None:
+        balance = db.execute(select(User.balance).where(User.id == user_id)).scalar_one()
+        raise ValueError(f"Insufficient balance: {balance}, required: {abs(amount)}")
+
+    mark_written(db, user_id)
     create_transaction(db, user_id, amount, transaction_type, description)
-    db.commit()
-    db.refresh(user)
-    return user
+    record_usage(db, {user_id: {"topped_up": amount} if amount >= 0 else {"spent": -amount}})
+    return user._replace(balance=balance)
 
-def topup(db: Session, user_id:int, amount:float) -> User:
+def topup(db: Session, user_id:int, amount:float) -> UserSnapshot:
 
     # เติมเงินเข้าบัญชีผู้ใช้
     if amount <= 0:
         raise ValueError('Top-up amount must be positive')
     return update_balance(db, user_id, amount, "topup", f"Top-up {amount} Baht")
 
-def purchase(db: Session, user_id:int, quantity:int, price_per_token:float) -> dict:
-    price_per_token = Decimal(str(price_per_token))
-    total_cost = Decimal(quantity) * price_per_token
+def apply_topup(db: Session, user_id:int, amount:float) -> UserSnapshot:
 
-    # ✅ แก้: Atomic update ป้องกัน Race Condition
-    # เช็คและหัก balance ในคำสั่งเดียว จะสำเร็จก็ต่อเมื่อมีเงินพอเท่านั้น
-    rows_updated = db.query(User).filter(
-        User.id == user_id,
-        User.balance >= total_cost
-    ).update({"balance": User.balance - total_cost}, synchronize_session="fetch")
+    # ส่วนของ topup ที่ไม่ commit เอง
+    if amount <= 0:
+        raise ValueError('Top-up amount must be positive')
+    return apply_balance_update(db, user_id, amount, "topup", f"Top-up {amount} Baht")
 
-    if rows_updated == 0:
-        db.rollback()
-        user = get_user(db, user_id)
-        if not user:
-            raise ValueError(f"User ID {user_id} not found")
-        raise ValueError(f"Insufficient balance: {user.balance} Baht, "f"required: {total_cost} Baht")
+def allocate_serials(db: Session, count: int) -> int:
 
-    try:
-        transaction = Transaction(user_id=user_id, amount=-total_cost, type="purchase", description=f"Purchase {quantity} tokens")
-        db.add(transaction)
+    # จอง serial ต่อเนื่องกัน count ตัวสำหรับ signed token คืนค่า serial ตัวแรก (ไม่ commit เอง)
+    db.execute(sqlite_insert(TokenSerial).values(id=1, next_serial=0).on_conflict_do_nothing())
+    next_serial = db.execute(
+        update(TokenSerial)
+        .where(TokenSerial.id == 1)
+        .values(next_serial=TokenSerial.next_serial + count)
+        .returning(TokenSerial.next_serial)
+        .execution_options(synchronize_session=False)
+    ).scalar_one()
+    return next_serial - count
 
-        new_tokens = []
-        for _ in range(quantity):
-            token_id = str(uuid.uuid4())
-            token = Token(token_id=token_id, user_id=user_id, price=price_per_token)
-            db.add(token)
-            new_tokens.append(token_id)
+def get_serial_watermark(db: Session) -> int:
 
-        db.commit()
+    # serial ตัวถัดไปที่จะออก (token ที่ serial ต่ำกว่านี้ออกไปแล้วทั้งหมด)
+    counter = db.query(TokenSerial).filter(TokenSerial.id == 1).first()
+    return counter.next_serial if counter else 0
+
+def mint_tokens_bulk(db: Session, token_ids: List[str], user_id: int, price: Decimal):
 
-        user = get_user(db, user_id)
-        return {"tokens": new_tokens, "total_cost": total_cost, "remaining_balance": user.balance, "quantity": quantity}
+    # เพิ่ม token ทั้งชุดด้วย INSERT เดียวแบบ executemany (Core) ไม่สร้าง ORM object ทีละตัว (ไม่ commit เอง)
+    created_at = datetime.now(timezone.utc)
+    rows = [{"token_id": token_id, "user_id": user_id, "price": price, "created_at": created_at, "used": False}
+            for token_id in token_ids]
+    db.execute(insert(Token), rows)
 
+def purchase(db: Session, user_id:int, quantity:int, price_per_token:float, signed: bool = False) -> dict:
+    try:
+        result = apply_purchase(db, user_id, quantity, price_per_token, signed)
+        db.commit()
+        return result
     except Exception as e:
         db.rollback()
         raise e
+
+def apply_purchase(db: Session, user_id:int, quantity:int, price_per_token:float, signed: bool = False) -> dict:
+
+    # ส่วนของ purchase ที่ไม่ commit/rollback เอง (ใช้กับ group commit writer)
+    # ถ้า raise ValueError จะยังไม่มีการเขียนอะไรลงฐานข้อมูล
+    if signed and not TOKEN_SIGNING_SECRET:
+        raise ValueError('Signed tokens are not enabled on this Bank')
+
+    price_per_token = Decimal(str(price_per_token))
+    total_cost = Decimal(quantity) * price_per_token
+
+    # ✅ แก้: Atomic update ป้องกัน Race Condition
+    # เช็คและหัก balance ในคำสั่งเดียว จะสำเร็จก็ต่อเมื่อมีเงินพอเท่านั้น
+    remaining_balance = db.execute(
+        update(User).where(User.id == user_id, User.balance >= total_cost).values(balance=User.balance - total_cost)
+        .returning(User.balance).execution_options(synchronize_session=False)
+    ).scalar_one_or_none()
+
+    if remaining_balance is None:
+        balance = db.execute(select(User.balance).where(User.id == user_id)).scalar_one_or_none()
+        if balance is None:
+            raise ValueError(f"User ID {user_id} not found")
+        raise ValueError(f"Insufficient balance: {balance} Baht, "f"required: {total_cost} Baht")
+    mark_written(db, user_id)
+
+    transaction = Transaction(user_id=user_id, amount=-total_cost, type="purchase", description=f"Purchase {quantity} tokens")
+    db.add(transaction)
+    record_usage(db, {user_id: {"spent": total_cost, "tokens_bought": quantity}})
+
+    if TOKEN_STORAGE == "book":
+        # โหมด book: การซื้อหนึ่งครั้งเป็น TokenBook แถวเดียว
+        new_tokens = mint_token_book(db, user_id, quantity, price_per_token, signed)
+    else:
+        if signed:
+            base_serial = allocate_serials(db, quantity)
+            expires_at = int(time.time()) + SIGNED_TOKEN_TTL
+            new_tokens = [make_signed_token(TOKEN_SIGNING_SECRET, user_id, price_per_token, base_serial + i, expires_at)
+                          for i in range(quantity)]
+        else:
+            new_tokens = [str(uuid.uuid4()) for _ in range(quantity)]
+
+        if quantity >= BULK_MINT_THRESHOLD:
+            mint_tokens_bulk(db, new_tokens, user_id, price_per_token)
+        else:
+            for token_id in new_tokens:
+                db.add(Token(token_id=token_id, user_id=user_id, price=price_per_token))
+        db.info.setdefault(MINTED_TOKENS_KEY, []).append((user_id, new_tokens))
+
+    return {"tokens": new_tokens, "total_cost": total_cost, "remaining_balance": remaining_balance, "quantity": quantity}
+
+# UPDATE ของการ replay spend log (executemany): ตั้ง used เฉพาะ token ที่ยังไม่ถูกใช้
+SPEND_REPLAY = (update(Token.__table__)
+                .where(Token.__table__.c.token_id == bindparam("spent_token_id"), Token.__table__.c.used == False)
+                .values(used=True, used_at=bindparam("spent_at")))
+
+def apply_logged_spends(db: Session, records: list) -> int:
+
+    # เขียนการใช้ token จาก spend log (token_index.py) ลงตาราง Tokens + UsageRollups (ไม่ commit เอง)
+    # records: (token_id, used_at) ไม่เกิน ~30,000 รายการ (จำนวนตัวแปรต่อคำสั่งของ SQLite)
+    # replay ซ้ำหลัง crash ได้: token ที่ used แล้วไม่ถูกเลือก ยอด tokens_used จึงไม่นับซ้ำ
+    # (token ที่รอ replay มีแต่ token_index เป็นคนเขียน ไม่มีใครเปลี่ยน used ระหว่าง SELECT กับ UPDATE)
+    spent_at = dict(records)
+    unused = db.execute(select(Token.token_id, Token.user_id)
+                        .where(Token.token_id.in_(list(spent_at)), Token.used == False)).all()
+    if not unused:
+        return 0
+    db.execute(SPEND_REPLAY, [{"spent_token_id": token_id, "spent_at": spent_at[token_id]} for token_id, _ in unused])
+
+    # ยอด tokens_used ตามชั่วโมงที่ใช้ token จริง
+    usage = {}
+    for token_id, user_id in unused:
+        hourly = usage.setdefault(spent_at[token_id].replace(minute=0, second=0, microsecond=0), {})
+        hourly.setdefault(user_id, {"tokens_used": 0})["tokens_used"] += 1
+    for hour, per_user in usage.items():
+        record_usage(db, per_user, at=hour)
+    return len(unused)
+
+# สร้าง statement ครั้งเดียว (record_usage อยู่บน hot path ของทุก verify สร้างใหม่ทุกครั้งช้ากว่า ~3 เท่า)
+USAGE_UPSERT = sqlite_insert(UsageRollup)
+USAGE_UPSERT = USAGE_UPSERT.on_conflict_do_update(
+    index_elements=[UsageRollup.user_id, UsageRollup.period, UsageRollup.period_start],
+    set_={field: getattr(UsageRollup, field) + getattr(USAGE_UPSERT.excluded, field) for field in USAGE_FIELDS})
+
+def usage_periods(at: datetime) -> list:
+
+    # ช่วงเวลาที่ยอดหนึ่งรายการถูกนับ: ชั่วโมง, วัน (UTC) และยอดรวมทั้งหมด
+    timestamp = int(at.replace(tzinfo=timezone.utc).timestamp() if at.tzinfo is None else at.timestamp())
+    return [("hour", timestamp - timestamp % 3600), ("day", timestamp - timestamp % 86400), ("total", 0)]
+
+def record_usage(db: Session, usage: dict, at: datetime = None):
+
+    # เพิ่มยอดใน UsageRollups (ไม่ commit เอง เขียนใน transaction เดียวกับรายการจริง)
+    # usage: user_id -> {"spent": ..., "tokens_used": ...} ยอดทั้งระบบ (user_id 0) รวมให้อัตโนมัติ
+    if not USAGE_ROLLUPS_ENABLED or not usage:
+        return
+    periods = usage_periods(at or datetime.now(timezone.utc))
+    overall = dict.fromkeys(USAGE_FIELDS, 0)
+    rows = []
+    for user_id, delta in list(usage.items()) + [(GLOBAL_USAGE_USER_ID, overall)]:
+        values = {field: delta.get(field, 0) for field in USAGE_FIELDS}
+        if user_id != GLOBAL_USAGE_USER_ID:
+            for field in USAGE_FIELDS:
+                overall[field] += values[field]
+        rows.extend({"user_id": user_id, "period": period, "period_start": period_start, **values}
+                    for period, period_start in periods)
+
+    # upsert ทุกแถวในคำสั่งเดียว (executemany) แถวที่มีอยู่แล้วบวกยอดเพิ่ม
+    db.execute(USAGE_UPSERT, rows)
+
+def get_usage(db: Session, user_id: int = GLOBAL_USAGE_USER_ID, hours: int = 24, days: int = 30) -> dict:
+
+    # ยอดใช้งานจาก UsageRollups: อ่านตาม primary key ไม่เกิน hours + days + 1 แถว ไม่ขึ้นกับจำนวนธุรกรรม
+    now = int(time.time())
+    def buckets(period, size, count):
+        since = now - now % size - (count - 1) * size
+        rows = db.execute(select(UsageRollup).where(UsageRollup.user_id == user_id, UsageRollup.period == period,
+                                                    UsageRollup.period_start >= since)
+                          .order_by(UsageRollup.period_start.desc())).scalars().all()
+        return [{"period_start": datetime.fromtimestamp(row.period_start, timezone.utc),
+                 **{field: getattr(row, field) for field in USAGE_FIELDS}} for row in rows]
+
+    total = db.execute(select(UsageRollup).where(UsageRollup.user_id == user_id, UsageRollup.period == "total",
+                                                 UsageRollup.period_start == 0)).scalar_one_or_none()
+    return {
+        "user_id": None if user_id == GLOBAL_USAGE_USER_ID else user_id,
+        "total": {field: getattr(total, field) if total else 0 for field in USAGE_FIELDS},
+        "hourly": buckets("hour", 3600, hours) if hours else [],
+        "daily": buckets("day", 86400, days) if days else [],
+    }
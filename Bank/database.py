@@ -1,20 +1,24 @@
 # แก้ไฟล์ Bank/database.py
 from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool  # ✅ แก้
-from models import Base
+from sqlalchemy.pool import QueuePool
+from models import Base, create_missing_indexes
+from config import (DB_POOL_SIZE, DB_MAX_OVERFLOW, SQLITE_BUSY_TIMEOUT_MS, SQLITE_SYNCHRONOUS,
+                    SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB, SQLITE_INCREMENTAL_VACUUM, SQLITE_JOURNAL_SIZE_LIMIT)
 
 # --- แก้ไขส่วนนี้ ---
 # ใช้โฟลเดอร์ปัจจุบันเลย (จะได้ตรงกับ volume ที่ mount ไว้ใน /app/Bank)
 DATABASE_URL = "sqlite:///bank.db"
 # ------------------
 
-# ✅ แก้: ใช้ NullPool (ไม่ pool connection) เหมาะกับ SQLite + concurrent requests
-# แต่ละ request จะได้ connection ใหม่และคืนทันทีเมื่อเสร็จ ไม่ชนกัน
+# ใช้ connection pool: เปิด connection และตั้ง pragma ครั้งเดียวต่อ connection แล้วใช้ซ้ำ
+# (เดิมใช้ NullPool ซึ่งเปิด connection + รัน PRAGMA ใหม่ทุก request)
 engine = create_engine(
     DATABASE_URL,
     connect_args={"check_same_thread": False},
-    poolclass=NullPool,  # ✅ แก้ตรงนี้
+    poolclass=QueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     echo=False
 )
 
@@ -22,13 +26,28 @@ engine = create_engine(
 @event.listens_for(engine, "connect")
 def set_sqlite_pragma(dbapi_conn, connection_record):
     cursor = dbapi_conn.cursor()
+    if SQLITE_INCREMENTAL_VACUUM:
+        # ต้องมาก่อน journal_mode: มีผลกับไฟล์ใหม่เท่านั้น (ไฟล์เดิมมีผลหลัง VACUUM ดู compact_tokens.py)
+        # ให้ token_archive.py คืนหน้าว่างให้ OS ได้ทีละน้อยด้วย incremental_vacuum
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
     cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")     # รอ write lock แทนการ error ทันที
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute(f"PRAGMA journal_size_limit={SQLITE_JOURNAL_SIZE_LIMIT}")   # ตัดไฟล์ WAL กลับหลัง checkpoint
     cursor.close()
 
 sessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# session ของ group commit writer: ไม่ expire object หลัง commit เพราะส่งผลลัพธ์กลับไปให้ thread อื่นใช้ต่อ
+writerSession = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        Base.metadata.create_all(bind=conn)
+        create_missing_indexes(conn)
 
 def get_db():
     db = sessionLocal()
@@ -0,0 +1,50 @@
+# Streaming export (NDJSON) - ส่ง token / ธุรกรรมของผู้ใช้ทีละ chunk ไม่โหลดทั้งหมดเข้า memory
+# แต่ละ chunk ดึงด้วย keyset pagination (crud.get_*_page) แล้ว serialize เป็น JSON หนึ่งบรรทัดต่อรายการ
+# ใช้ได้ทั้ง main.py (chunk รันใน threadpool) และ main_async.py (chunk เป็น async query)
+
+import asyncio
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from config import EXPORT_CHUNK_SIZE
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def serialize_rows(schema, rows) -> list:
+    return [schema.model_validate(row).model_dump_json() for row in rows]
+
+
+def export_chunk(session_factory, fetch_page, schema, *args, cursor=None):
+    # ดึงหนึ่ง chunk ด้วย session ของตัวเอง (ไม่ถือ connection / read transaction ค้างไว้ระหว่างส่งข้อมูล)
+    db = session_factory()
+    try:
+        rows, next_cursor = fetch_page(db, *args, limit=EXPORT_CHUNK_SIZE, cursor=cursor)
+        return serialize_rows(schema, rows), next_cursor
+    finally:
+        db.close()
+
+
+async def async_export_chunk(session_factory, fetch_page, schema, *args, cursor=None):
+    # เหมือน export_chunk สำหรับ async session (main_async.py)
+    async with session_factory() as db:
+        rows, next_cursor = await fetch_page(db, *args, limit=EXPORT_CHUNK_SIZE, cursor=cursor)
+        return serialize_rows(schema, rows), next_cursor
+
+
+async def stream_ndjson(request: Request, fetch_chunk):
+    # fetch_chunk(cursor) -> (บรรทัด JSON, cursor ถัดไป)
+    # client ตัดการเชื่อมต่อ: หยุดก่อนดึง chunk ถัดไป (starlette ยกเลิก generator นี้ด้วยเมื่อส่งข้อมูลไม่ได้)
+    cursor = None
+    while True:
+        if await request.is_disconnected():
+            return
+        # shield: ถ้าถูกยกเลิกระหว่างดึง chunk ให้ query ที่เริ่มไปแล้วจบและคืน connection ตามปกติ ไม่ถูกตัดกลางคัน
+        lines, cursor = await asyncio.shield(asyncio.ensure_future(fetch_chunk(cursor)))
+        if lines:
+            yield "\n".join(lines) + "\n"
+        if cursor is None:
+            return
+
+
+def ndjson_response(request: Request, fetch_chunk) -> StreamingResponse:
+    return StreamingResponse(stream_ndjson(request, fetch_chunk), media_type=NDJSON_MEDIA_TYPE)
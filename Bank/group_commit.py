@@ -0,0 +1,124 @@
+# Group commit writer - ผู้เขียนฐานข้อมูลคนเดียว (single writer thread)
+# request handler ส่งงานเขียน (topup, purchase, verify) เข้ามาทางคิว
+# writer รวบงานที่รออยู่เป็น batch แล้ว commit ครั้งเดียว (fsync ครั้งเดียว) ต่อ batch
+# แต่ละ caller ได้ผลลัพธ์/ข้อผิดพลาดของงานตัวเองกลับไปเหมือนเรียก crud โดยตรง
+#
+# งานที่ส่งเข้ามาต้องเป็นฟังก์ชัน apply_* / spend_* ใน crud (ไม่ commit/rollback เอง)
+# และถ้า raise ValueError ต้องยังไม่ได้เขียนอะไร จึงรวม batch ต่อได้โดยไม่ต้อง rollback
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommitWriter:
+    def __init__(self, session_factory, max_batch: int, max_wait_ms: float):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+
+        self.batches = 0
+        self.operations = 0
+        self.fallbacks = 0
+        self.last_commit_ms = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # ทำงานที่ค้างในคิวให้เสร็จก่อนแล้วค่อยหยุด
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        self._queue.put((future, fn, args))
+        return future
+
+    def run(self, fn, *args, timeout: float = None):
+        return self.submit(fn, *args).result(timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+
+            # รอรวม batch ไม่เกิน max_wait หรือจนกว่าจะครบ max_batch
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._commit_batch(batch)
+            if stopping:
+                return
+
+    def _commit_batch(self, batch):
+        db = self.session_factory()
+        try:
+            outcomes = []
+            try:
+                for future, fn, args in batch:
+                    try:
+                        result = fn(db, *args)
+                        # flush + expunge: ผลลัพธ์ของแต่ละงานเป็น object ของตัวเอง ไม่ถูกงานถัดไปใน batch แก้ทับ
+                        db.flush()
+                        db.expunge_all()
+                        outcomes.append((future, result, None))
+                    except ValueError as e:
+                        outcomes.append((future, None, e))
+                start = time.perf_counter()
+                db.commit()
+                self.last_commit_ms = (time.perf_counter() - start) * 1000
+            except Exception:
+                # ข้อผิดพลาดที่ไม่คาดคิด: ยกเลิกทั้ง batch แล้วทำทีละงาน ให้กระทบเฉพาะงานที่มีปัญหา
+                db.rollback()
+                self.fallbacks += 1
+                outcomes = [self._commit_one(db, future, fn, args) for future, fn, args in batch]
+
+            self.batches += 1
+            self.operations += len(batch)
+            for future, result, error in outcomes:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+        finally:
+            db.close()
+
+    def _commit_one(self, db, future, fn, args):
+        try:
+            result = fn(db, *args)
+            db.commit()
+            return future, result, None
+        except Exception as e:
+            db.rollback()
+            return future, None, e
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None,
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "operations": self.operations,
+            "avg_batch_size": self.operations / self.batches if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+            "last_commit_ms": self.last_commit_ms,
+        }
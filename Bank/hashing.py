@@ -0,0 +1,88 @@
+# Password hashing - argon2 รันใน process pool แยก ไม่แย่ง CPU/GIL กับการรับ request ของ Bank
+# ค่า cost ของ argon2 ตั้งได้ผ่าน config (ต้องตั้งเหมือนกันทุก process เพราะ worker import module นี้ใหม่)
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+from config import ARGON2_TIME_COST, ARGON2_MEMORY_COST, ARGON2_PARALLELISM, HASH_WORKERS, HASH_MAX_QUEUE
+
+pwd_context = CryptContext(schemes=["argon2"], deprecated='auto',
+                           argon2__time_cost=ARGON2_TIME_COST,
+                           argon2__memory_cost=ARGON2_MEMORY_COST,
+                           argon2__parallelism=ARGON2_PARALLELISM)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def check_password(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+class HashQueueFull(Exception):
+    pass
+
+
+class PasswordHasher:
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._pool = None
+        self._latencies = deque(maxlen=1000)   # วินาที ของงานล่าสุด
+
+        self.queue_depth = 0    # งานที่รอ + กำลังรัน
+        self.completed = 0
+        self.rejected = 0
+
+    def start(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(hash_password, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._submit(check_password, plain_password, hashed_password)
+
+    async def _submit(self, fn, *args):
+        if self.queue_depth >= self.max_queue:
+            # คิวเต็ม (เช่นตอนมีการสมัครสมาชิกพร้อมกันจำนวนมาก): ปฏิเสธทันที ไม่ให้ latency โตไม่จำกัด
+            self.rejected += 1
+            raise HashQueueFull('Password hashing queue is full, please retry')
+        self.start()
+        self.queue_depth += 1
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self.queue_depth -= 1
+            self.completed += 1
+            self._latencies.append(time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "latency_ms": {
+                "avg": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                "p50": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+                "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else 0.0,
+                "max": latencies[-1] * 1000 if latencies else 0.0,
+            },
+            "argon2": {"time_cost": ARGON2_TIME_COST, "memory_cost_kib": ARGON2_MEMORY_COST, "parallelism": ARGON2_PARALLELISM},
+        }
+
+
+password_hasher = PasswordHasher(workers=HASH_WORKERS, max_queue=HASH_MAX_QUEUE)
@@ -1,23 +1,73 @@
 # Mock Bank API - Pay-Per-Request
 
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Depends, HTTPException, status
+import os
+import sys
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import models
 import crud
 import schemas
-from database import get_db, init_db
+from database import get_db, init_db, sessionLocal, writerSession
+from config import (TOKEN_PRICE, GROUP_COMMIT_ENABLED, GROUP_COMMIT_MAX_BATCH, GROUP_COMMIT_MAX_WAIT_MS, GROUP_COMMIT_TIMEOUT,
+                    HASH_RETRY_AFTER, REQUIRE_API_KEY, TOKEN_PAGE_SIZE,
+                    USAGE_ROLLUPS_ENABLED, USAGE_MAX_HOURS, USAGE_MAX_DAYS, BANK_HOST, BANK_PORT,
+                    TOKEN_ARCHIVE_ENABLED, TOKEN_ARCHIVE_AGE, TOKEN_ARCHIVE_INTERVAL, TOKEN_ARCHIVE_BATCH_SIZE,
+                    TOKEN_ARCHIVE_MAX_BATCHES, TOKEN_ARCHIVE_PAUSE_MS, TOKEN_ARCHIVE_VACUUM_PAGES,
+                    TOKEN_INDEX_ENABLED, SPEND_LOG_PATH, SPEND_LOG_MAX_BATCH, SPEND_LOG_MAX_WAIT_MS, SPEND_LOG_TIMEOUT,
+                    SPEND_LOG_RETRY_AFTER, TOKEN_INDEX_REPLAY_INTERVAL, TOKEN_INDEX_REPLAY_BATCH_SIZE)
+from group_commit import GroupCommitWriter
+from hashing import password_hasher, HashQueueFull
+from export import export_chunk, ndjson_response
+from token_archive import TokenCompactor
+from token_index import TokenIndex, SpendUnavailable
+from user_cache import user_cache
 
-TOKEN_PRICE = 0.1 # Baht per request
+# metrics.py และ spend_log.py อยู่ที่โฟลเดอร์แม่ (ใช้ร่วมกับ Gateway และ Backend)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import metrics
+from spend_log import SpendLog
+
+# เวลา COMMIT ของทุก Session (รวม fsync ของ WAL) แสดงใน /metrics และเป็น stage db_commit ใน Server-Timing
+DB_COMMIT_LATENCY = metrics.histogram('bank_db_commit_seconds', 'Bank database COMMIT latency')
+metrics.observe_sqlalchemy_commits(Session, DB_COMMIT_LATENCY)
+
+# ย้าย token ที่ใช้แล้วนาน ๆ ไป TokensArchive เป็นรอบ ๆ ใน thread แยก (ปิดด้วย BANK_TOKEN_ARCHIVE=0)
+token_compactor = TokenCompactor(sessionLocal, age=TOKEN_ARCHIVE_AGE, interval=TOKEN_ARCHIVE_INTERVAL,
+                                 batch_size=TOKEN_ARCHIVE_BATCH_SIZE, max_batches=TOKEN_ARCHIVE_MAX_BATCHES,
+                                 pause_ms=TOKEN_ARCHIVE_PAUSE_MS, vacuum_pages=TOKEN_ARCHIVE_VACUUM_PAGES)
+
+# verify จาก index ใน memory + spend log แทน SQLite เมื่อเปิด BANK_TOKEN_INDEX=1 (token ที่ไม่อยู่ใน index ใช้ทางเดิม)
+token_index = TokenIndex(sessionLocal, SpendLog(SPEND_LOG_PATH, max_batch=SPEND_LOG_MAX_BATCH, max_wait_ms=SPEND_LOG_MAX_WAIT_MS),
+                         replay_interval=TOKEN_INDEX_REPLAY_INTERVAL, replay_batch_size=TOKEN_INDEX_REPLAY_BATCH_SIZE)
+
+# งานเขียน topup/purchase/verify ส่งผ่าน writer ตัวเดียวเมื่อเปิด BANK_GROUP_COMMIT=1
+group_writer = GroupCommitWriter(writerSession, max_batch=GROUP_COMMIT_MAX_BATCH, max_wait_ms=GROUP_COMMIT_MAX_WAIT_MS) if GROUP_COMMIT_ENABLED else None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: เริ่มต้นฐานข้อมูล
     init_db()
+    password_hasher.start()
+    if group_writer is not None:
+        group_writer.start()
+    if TOKEN_ARCHIVE_ENABLED:
+        token_compactor.start()
+    if TOKEN_INDEX_ENABLED:
+        token_index.start()
+    lag_monitor = metrics.start_event_loop_lag_monitor('bank')
     print('Mock Bank API is ready!')
     yield
-    # Shutdown (เพิ่ม cleanup ที่นี่ถ้าต้องการ)
+    metrics.stop_event_loop_lag_monitor(lag_monitor)
+    # replay spend log ที่เหลือลง Tokens ให้หมดก่อนปิด
+    token_index.stop()
+    token_compactor.stop()
+    # Shutdown: ให้ writer commit งานที่ค้างอยู่ให้หมดก่อน
+    if group_writer is not None:
+        group_writer.stop()
+    password_hasher.shutdown()
 
 # สร้างแอป FastAPI
 app = FastAPI(title='Mock Bank API', 
@@ -25,43 +75,95 @@ app = FastAPI(title='Mock Bank API',
               version='1.0.0',
               lifespan=lifespan)
 
+# latency ต่อ route + header Server-Timing
+app.add_middleware(metrics.MetricsMiddleware, service='bank')
+
+def authenticated_user_id(x_api_key: Optional[str] = Header(default=None), authorization: Optional[str] = Header(default=None),
+                          db: Session = Depends(get_db)) -> Optional[int]:
+    # API key จาก /login/ (X-API-Key หรือ Authorization: Bearer) ตรวจด้วย sha256 lookup ไม่ต้อง hash รหัสผ่าน
+    api_key = x_api_key
+    if api_key is None and authorization and authorization.lower().startswith('bearer '):
+        api_key = authorization[7:].strip()
+    if api_key is None:
+        if REQUIRE_API_KEY:
+            raise HTTPException(status_code=401, detail='API key required')
+        return None
+    user_id = crud.get_user_id_by_api_key(db, api_key)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail='Invalid or expired API key')
+    return user_id
+
+def check_owner(auth_user_id: Optional[int], user_id: int):
+    # ถ้าแนบ API key มา ต้องเป็นของผู้ใช้เจ้าของบัญชีเท่านั้น
+    if auth_user_id is not None and auth_user_id != user_id:
+        raise HTTPException(status_code=403, detail='API key does not belong to this user')
+
+def check_usage_enabled():
+    # ปิด rollup อยู่ (ค่าเริ่มต้น) ยอดใน UsageRollups ไม่ครบ: ตอบ 404 แทนตัวเลขที่ผิด
+    if not USAGE_ROLLUPS_ENABLED:
+        raise HTTPException(status_code=404, detail='Usage rollups are disabled (set BANK_USAGE_ROLLUPS=1)')
+
+def hash_queue_full(e: HashQueueFull) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(HASH_RETRY_AFTER)})
+
+def spend_unavailable(e: SpendUnavailable) -> HTTPException:
+    # token ที่ claim ไว้ไม่ได้ตอบ valid: client ลองใหม่ได้ (token ที่อาจลงดิสก์แล้วจะได้ 'Token already used')
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(SPEND_LOG_RETRY_AFTER)})
+
 @app.post('/users/', response_model=schemas.UserResponse)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    # สร้างผู้ใช้ใหม่
-    try: 
-        return crud.create_user(db=db, username=user.username, password=user.password, initial_balance=user.initial_balance)
+async def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+    # สร้างผู้ใช้ใหม่ (hash รหัสผ่านใน process pool ส่วนงาน DB รันใน threadpool)
+    try:
+        hashed_password = await password_hasher.hash(user.password)
+        return await run_in_threadpool(crud.create_user_with_hash, db, user.username, hashed_password, user.initial_balance)
+    except HashQueueFull as e:
+        raise hash_queue_full(e)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@app.post('/login/', response_model=schemas.UserResponse)
-def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db)):
-    # ตรวจสอบการเข้าสู่ระบบผู้ใข้
-    user = crud.authenticate_user(db, username=user_credentials.username, password=user_credentials.password)
-    if not user:
-        raise HTTPException(status_code=401, detail='Incorrect username or password')
-    return user
+@app.post('/login/', response_model=schemas.LoginResponse)
+async def login(user_credentials: schemas.UserLogin, db: Session = Depends(get_db)):
+    # ตรวจสอบการเข้าสู่ระบบผู้ใข้ แล้วออก API key สำหรับเรียกครั้งต่อไป
+    user = await run_in_threadpool(crud.get_user_by_username, db, user_credentials.username)
+    try:
+        if not user or not await password_hasher.verify(user_credentials.password, user.hashed_password):
+            raise HTTPException(status_code=401, detail='Incorrect username or password')
+    except HashQueueFull as e:
+        raise hash_queue_full(e)
+    # อ่านข้อมูลผู้ใช้ก่อน create_api_key commit (commit จะ expire object)
+    user_data = schemas.UserResponse.model_validate(user).model_dump()
+    return {**user_data, **await run_in_threadpool(crud.create_api_key, db, user.id)}
 
 @app.get('/users/{user_id}', response_model=schemas.UserResponse)
-def read_user(user_id: int, db: Session = Depends(get_db)):
+def read_user(user_id: int, db: Session = Depends(get_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
     # ดึงข้อมุลผู้ใช้ตาม ID
-    db_user = crud.get_user(db, user_id=user_id)
+    check_owner(auth_user_id, user_id)
+    db_user = crud.get_user_profile(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail='User not found')
     return db_user
 
 @app.post('/topup/', response_model=schemas.TopupResponse)
-def topup_money(topup_data: schemas.TopupRequest, db: Session = Depends(get_db)):
+def topup_money(topup_data: schemas.TopupRequest, db: Session = Depends(get_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
     # เติมเงินเข้าบัญชีผู้ใช้
+    check_owner(auth_user_id, topup_data.user_id)
     try:
+        if group_writer is not None:
+            return group_writer.run(crud.apply_topup, topup_data.user_id, topup_data.amount, timeout=GROUP_COMMIT_TIMEOUT)
         return crud.topup(db, user_id=topup_data.user_id, amount=topup_data.amount)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.post('/purchase/', response_model=schemas.PurchaseTokenResponse)
-def purchase_tokens(purchase_request: schemas.PurchaseTokenRequest, db: Session = Depends(get_db)):
+def purchase_tokens(purchase_request: schemas.PurchaseTokenRequest, db: Session = Depends(get_db),
+                    auth_user_id: Optional[int] = Depends(authenticated_user_id)):
     # ซื้อโทเค็น Pay-Per-Request
+    check_owner(auth_user_id, purchase_request.user_id)
     try:
-        result = crud.purchase(db, user_id=purchase_request.user_id, quantity=purchase_request.quantity, price_per_token=TOKEN_PRICE)
+        if group_writer is not None:
+            return group_writer.run(crud.apply_purchase, purchase_request.user_id, purchase_request.quantity, TOKEN_PRICE,
+                                    purchase_request.signed, timeout=GROUP_COMMIT_TIMEOUT)
+        result = crud.purchase(db, user_id=purchase_request.user_id, quantity=purchase_request.quantity, price_per_token=TOKEN_PRICE, signed=purchase_request.signed)
         return result
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -69,20 +171,138 @@ def purchase_tokens(purchase_request: schemas.PurchaseTokenRequest, db: Session
 @app.post('/verify/', response_model=schemas.VerifyTokenResponse)
 def verify_token(request: schemas.VerifyTokenRequest, db: Session = Depends(get_db)):
     # ตรวจสอบและใช้โทเค็น Pay-Per-Request
+    if TOKEN_INDEX_ENABLED:
+        try:
+            result = token_index.spend([request.token_id], timeout=SPEND_LOG_TIMEOUT)[0]
+        except SpendUnavailable as e:
+            raise spend_unavailable(e)
+        if result is not None:
+            return result
+    if group_writer is not None:
+        return group_writer.run(crud.spend_token, request.token_id, timeout=GROUP_COMMIT_TIMEOUT)
     result = crud.verify_and_use_token(db, request.token_id)
     return result
 
+@app.post('/verify/batch', response_model=schemas.VerifyTokenBatchResponse)
+def verify_tokens_batch(request: schemas.VerifyTokenBatchRequest, db: Session = Depends(get_db)):
+    # ตรวจสอบและใช้โทเค็นหลายใบใน transaction เดียว (ใช้โดย Gateway micro-batching)
+    # atomic: ตัดยอดทุกใบหรือไม่ตัดเลย (Gateway ใช้กับ route ที่ราคาหลาย token) index ตอบครบทุกใบ หรือส่งทุกใบให้ crud
+    results = [None] * len(request.token_ids)
+    if TOKEN_INDEX_ENABLED:
+        try:
+            results = token_index.spend(request.token_ids, timeout=SPEND_LOG_TIMEOUT, atomic=request.atomic)
+        except SpendUnavailable as e:
+            raise spend_unavailable(e)
+    # token ที่ index ไม่รู้จัก ใช้ทางเดิม (ลำดับผลตาม token_ids ในคำขอ)
+    unknown = [token_id for token_id, result in zip(request.token_ids, results) if result is None]
+    if unknown:
+        if group_writer is not None:
+            fallback = iter(group_writer.run(crud.spend_tokens, unknown, request.atomic, timeout=GROUP_COMMIT_TIMEOUT))
+        else:
+            fallback = iter(crud.verify_and_use_tokens(db, unknown, request.atomic))
+        results = [result if result is not None else next(fallback) for result in results]
+    return {"results": results}
+
+@app.get('/tokens/serial-watermark', response_model=schemas.SerialWatermarkResponse)
+def read_serial_watermark(db: Session = Depends(get_db)):
+    # Gateway ใช้ค่านี้ตอน startup: signed token ที่ออกก่อนหน้านี้ต้อง verify ผ่าน Bank
+    return {"next_serial": crud.get_serial_watermark(db)}
+
+@app.get('/stats/writer')
+def writer_stats():
+    # ดูขนาด batch ของ group commit writer
+    if group_writer is None:
+        return {"enabled": False}
+    return {"enabled": True, **group_writer.stats()}
+
+@app.get('/stats/hashing')
+def hashing_stats():
+    # ความยาวคิวและ latency ของการ hash รหัสผ่าน
+    return password_hasher.stats()
+
+@app.get('/stats/user-cache')
+def user_cache_stats():
+    # hit/miss ของ cache ข้อมูลผู้ใช้ (ปิดด้วย BANK_USER_CACHE=0)
+    return user_cache.stats()
+
+@app.get('/stats/token-index')
+def token_index_stats():
+    # ขนาด index, token ที่รอ replay, batch/fsync ของ spend log
+    return {"enabled": TOKEN_INDEX_ENABLED, **token_index.stats()}
+
+@app.get('/stats/tokens')
+def token_storage_stats():
+    # ขนาดตาราง Tokens / archive / ไฟล์ฐานข้อมูล ณ รอบ compaction ล่าสุด
+    return {"enabled": TOKEN_ARCHIVE_ENABLED, **token_compactor.stats()}
+
+@app.get('/metrics')
+def read_metrics():
+    # Prometheus text format (latency ต่อ route, stage, เวลา commit)
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
 @app.get('/users/{user_id}/transaction', response_model=List[schemas.TransactionResponse])
-def read_transactions(user_id: int, skip: int=0, limit: int=50, db: Session = Depends(get_db)):
-    # ดึงข้อมูลธุรกรรมของผู้ใช้
-    return crud.get_users_transactions(db, user_id=user_id, skip=skip, limit=limit)
+def read_transactions(response: Response, user_id: int, skip: int=0, limit: int=50, cursor: Optional[str] = None,
+                      db: Session = Depends(get_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ดึงข้อมูลธุรกรรมของผู้ใช้ หน้าถัดไปส่ง cursor จาก header X-Next-Cursor กลับมา (skip ยังใช้ได้แบบเดิม)
+    check_owner(auth_user_id, user_id)
+    try:
+        if cursor is None and skip > 0:
+            transactions = crud.get_users_transactions(db, user_id=user_id, skip=skip, limit=limit)
+            next_cursor = crud.transactions_next_cursor(transactions, limit)
+        else:
+            transactions, next_cursor = crud.get_users_transactions_page(db, user_id=user_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return transactions
 
 @app.get('/users/{user_id}/tokens', response_model=List[schemas.TokenResponse])
-def read_user_tokens(user_id: int, unused_only: bool = True, db: Session = Depends(get_db)):
-    # ดึงข้อมูลโทเค็นของผู้ใช้
-    return crud.get_user_token(db, user_id=user_id, unused_only=unused_only)
+def read_user_tokens(response: Response, user_id: int, unused_only: bool = True, limit: Optional[int] = Query(default=None, ge=1),
+                     cursor: Optional[str] = None, db: Session = Depends(get_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ดึงข้อมูลโทเค็นของผู้ใช้ (ไม่ระบุ limit/cursor = ทั้งหมดแบบเดิม ระบุแล้วแบ่งหน้าด้วย X-Next-Cursor)
+    check_owner(auth_user_id, user_id)
+    if limit is None and cursor is None:
+        return crud.get_user_token(db, user_id=user_id, unused_only=unused_only)
+    try:
+        tokens, next_cursor = crud.get_user_tokens_page(db, user_id=user_id, unused_only=unused_only, limit=limit or TOKEN_PAGE_SIZE, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return tokens
+
+@app.get('/users/{user_id}/usage', response_model=schemas.UsageResponse)
+def read_user_usage(user_id: int, hours: int = Query(default=24, ge=0, le=USAGE_MAX_HOURS), days: int = Query(default=30, ge=0, le=USAGE_MAX_DAYS),
+                    db: Session = Depends(get_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ยอดใช้งานของผู้ใช้ (รายชั่วโมง / รายวัน / ทั้งหมด) จาก rollup ไม่ scan ตารางธุรกรรม
+    check_owner(auth_user_id, user_id)
+    check_usage_enabled()
+    return crud.get_usage(db, user_id=user_id, hours=hours, days=days)
+
+@app.get('/usage', response_model=schemas.UsageResponse)
+def read_global_usage(hours: int = Query(default=24, ge=0, le=USAGE_MAX_HOURS), days: int = Query(default=30, ge=0, le=USAGE_MAX_DAYS),
+                      db: Session = Depends(get_db)):
+    # ยอดใช้งานรวมทั้งระบบ
+    check_usage_enabled()
+    return crud.get_usage(db, hours=hours, days=days)
+
+@app.get('/users/{user_id}/transaction/export')
+async def export_transactions(request: Request, user_id: int, auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ส่งธุรกรรมทั้งหมดของผู้ใช้เป็น NDJSON ทีละ chunk (memory คงที่ไม่ว่าจะมีกี่แถว)
+    check_owner(auth_user_id, user_id)
+    return ndjson_response(request, lambda cursor: run_in_threadpool(
+        export_chunk, sessionLocal, crud.get_users_transactions_page, schemas.TransactionResponse, user_id, cursor=cursor))
+
+@app.get('/users/{user_id}/tokens/export')
+async def export_user_tokens(request: Request, user_id: int, unused_only: bool = False,
+                             auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ส่ง token ทั้งหมดของผู้ใช้ (รวม TokenBook) เป็น NDJSON ทีละ chunk
+    check_owner(auth_user_id, user_id)
+    return ndjson_response(request, lambda cursor: run_in_threadpool(
+        export_chunk, sessionLocal, crud.get_user_tokens_page, schemas.TokenResponse, user_id, unused_only, cursor=cursor))
 
 # [เพิ่ม] ส่วนนี้เพื่อให้รันไฟล์นี้ได้โดยตรง
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="143.198.85.26", port=8000)
+    uvicorn.run(app, host=BANK_HOST, port=BANK_PORT)
@@ -0,0 +1,281 @@
+# Mock Bank API - Pay-Per-Request (async version)
+# ทุก route เป็น async def ใช้ async SQLAlchemy engine (aiosqlite) ไม่ต้องพึ่ง threadpool ของ uvicorn
+# วิธีรัน: uvicorn main_async:app --port 8000  (API เหมือน main.py ทุกอย่าง ยกเว้น group commit writer)
+
+from contextlib import asynccontextmanager
+import os
+import sys
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import List, Optional
+import async_crud
+import crud
+import schemas
+from async_database import get_async_db, init_db, async_engine, asyncSessionLocal
+from database import sessionLocal
+from config import TOKEN_PRICE, HASH_RETRY_AFTER, REQUIRE_API_KEY, TOKEN_PAGE_SIZE, USAGE_ROLLUPS_ENABLED, USAGE_MAX_HOURS, USAGE_MAX_DAYS, BANK_HOST, BANK_PORT
+from config import (TOKEN_ARCHIVE_ENABLED, TOKEN_ARCHIVE_AGE, TOKEN_ARCHIVE_INTERVAL, TOKEN_ARCHIVE_BATCH_SIZE,
+                    TOKEN_ARCHIVE_MAX_BATCHES, TOKEN_ARCHIVE_PAUSE_MS, TOKEN_ARCHIVE_VACUUM_PAGES)
+from config import (TOKEN_INDEX_ENABLED, SPEND_LOG_PATH, SPEND_LOG_MAX_BATCH, SPEND_LOG_MAX_WAIT_MS, SPEND_LOG_TIMEOUT,
+                    SPEND_LOG_RETRY_AFTER, TOKEN_INDEX_REPLAY_INTERVAL, TOKEN_INDEX_REPLAY_BATCH_SIZE)
+from hashing import password_hasher, HashQueueFull
+from export import async_export_chunk, ndjson_response
+from token_archive import TokenCompactor
+from token_index import TokenIndex, SpendUnavailable
+from user_cache import user_cache
+
+# metrics.py และ spend_log.py อยู่ที่โฟลเดอร์แม่ (ใช้ร่วมกับ Gateway และ Backend)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import metrics
+from spend_log import SpendLog
+
+# เวลา COMMIT ของทุก Session (รวม fsync ของ WAL) แสดงใน /metrics และเป็น stage db_commit ใน Server-Timing
+DB_COMMIT_LATENCY = metrics.histogram('bank_db_commit_seconds', 'Bank database COMMIT latency')
+metrics.observe_sqlalchemy_commits(Session, DB_COMMIT_LATENCY)
+
+# ย้าย token ที่ใช้แล้วนาน ๆ ไป TokensArchive เป็นรอบ ๆ ใน thread แยก (ปิดด้วย BANK_TOKEN_ARCHIVE=0)
+token_compactor = TokenCompactor(sessionLocal, age=TOKEN_ARCHIVE_AGE, interval=TOKEN_ARCHIVE_INTERVAL,
+                                 batch_size=TOKEN_ARCHIVE_BATCH_SIZE, max_batches=TOKEN_ARCHIVE_MAX_BATCHES,
+                                 pause_ms=TOKEN_ARCHIVE_PAUSE_MS, vacuum_pages=TOKEN_ARCHIVE_VACUUM_PAGES)
+
+# verify จาก index ใน memory + spend log (BANK_TOKEN_INDEX=1) replay ลง Tokens ด้วย session แบบ sync ใน thread แยก
+token_index = TokenIndex(sessionLocal, SpendLog(SPEND_LOG_PATH, max_batch=SPEND_LOG_MAX_BATCH, max_wait_ms=SPEND_LOG_MAX_WAIT_MS),
+                         replay_interval=TOKEN_INDEX_REPLAY_INTERVAL, replay_batch_size=TOKEN_INDEX_REPLAY_BATCH_SIZE)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: เริ่มต้นฐานข้อมูล
+    await init_db()
+    password_hasher.start()
+    if TOKEN_ARCHIVE_ENABLED:
+        token_compactor.start()
+    if TOKEN_INDEX_ENABLED:
+        token_index.start()
+    lag_monitor = metrics.start_event_loop_lag_monitor('bank')
+    print('Mock Bank API (async) is ready!')
+    yield
+    metrics.stop_event_loop_lag_monitor(lag_monitor)
+    # replay spend log ที่เหลือลง Tokens ให้หมดก่อนปิด
+    token_index.stop()
+    token_compactor.stop()
+    # Shutdown: ปิด connection pool
+    await async_engine.dispose()
+    password_hasher.shutdown()
+
+# สร้างแอป FastAPI
+app = FastAPI(title='Mock Bank API',
+              description='Payment system with Pay-Per-Request (async)',
+              version='1.0.0',
+              lifespan=lifespan)
+
+# latency ต่อ route + header Server-Timing
+app.add_middleware(metrics.MetricsMiddleware, service='bank')
+
+async def authenticated_user_id(x_api_key: Optional[str] = Header(default=None), authorization: Optional[str] = Header(default=None),
+                                db: AsyncSession = Depends(get_async_db)) -> Optional[int]:
+    # API key จาก /login/ (X-API-Key หรือ Authorization: Bearer) ตรวจด้วย sha256 lookup ไม่ต้อง hash รหัสผ่าน
+    api_key = x_api_key
+    if api_key is None and authorization and authorization.lower().startswith('bearer '):
+        api_key = authorization[7:].strip()
+    if api_key is None:
+        if REQUIRE_API_KEY:
+            raise HTTPException(status_code=401, detail='API key required')
+        return None
+    user_id = await async_crud.get_user_id_by_api_key(db, api_key)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail='Invalid or expired API key')
+    return user_id
+
+def check_owner(auth_user_id: Optional[int], user_id: int):
+    # ถ้าแนบ API key มา ต้องเป็นของผู้ใช้เจ้าของบัญชีเท่านั้น
+    if auth_user_id is not None and auth_user_id != user_id:
+        raise HTTPException(status_code=403, detail='API key does not belong to this user')
+
+def check_usage_enabled():
+    # ปิด rollup อยู่ (ค่าเริ่มต้น) ยอดใน UsageRollups ไม่ครบ: ตอบ 404 แทนตัวเลขที่ผิด
+    if not USAGE_ROLLUPS_ENABLED:
+        raise HTTPException(status_code=404, detail='Usage rollups are disabled (set BANK_USAGE_ROLLUPS=1)')
+
+def hash_queue_full(e: HashQueueFull) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(HASH_RETRY_AFTER)})
+
+def spend_unavailable(e: SpendUnavailable) -> HTTPException:
+    # token ที่ claim ไว้ไม่ได้ตอบ valid: client ลองใหม่ได้ (token ที่อาจลงดิสก์แล้วจะได้ 'Token already used')
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(SPEND_LOG_RETRY_AFTER)})
+
+@app.post('/users/', response_model=schemas.UserResponse)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    # สร้างผู้ใช้ใหม่
+    try:
+        return await async_crud.create_user(db=db, username=user.username, password=user.password, initial_balance=user.initial_balance)
+    except HashQueueFull as e:
+        raise hash_queue_full(e)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post('/login/', response_model=schemas.LoginResponse)
+async def login(user_credentials: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    # ตรวจสอบการเข้าสู่ระบบผู้ใข้ แล้วออก API key สำหรับเรียกครั้งต่อไป
+    try:
+        user = await async_crud.authenticate_user(db, username=user_credentials.username, password=user_credentials.password)
+    except HashQueueFull as e:
+        raise hash_queue_full(e)
+    if not user:
+        raise HTTPException(status_code=401, detail='Incorrect username or password')
+    return {**schemas.UserResponse.model_validate(user).model_dump(), **await async_crud.create_api_key(db, user.id)}
+
+@app.get('/users/{user_id}', response_model=schemas.UserResponse)
+async def read_user(user_id: int, db: AsyncSession = Depends(get_async_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ดึงข้อมุลผู้ใช้ตาม ID
+    check_owner(auth_user_id, user_id)
+    db_user = await async_crud.get_user_profile(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail='User not found')
+    return db_user
+
+@app.post('/topup/', response_model=schemas.TopupResponse)
+async def topup_money(topup_data: schemas.TopupRequest, db: AsyncSession = Depends(get_async_db),
+                      auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # เติมเงินเข้าบัญชีผู้ใช้
+    check_owner(auth_user_id, topup_data.user_id)
+    try:
+        return await async_crud.topup(db, user_id=topup_data.user_id, amount=topup_data.amount)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post('/purchase/', response_model=schemas.PurchaseTokenResponse)
+async def purchase_tokens(purchase_request: schemas.PurchaseTokenRequest, db: AsyncSession = Depends(get_async_db),
+                          auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ซื้อโทเค็น Pay-Per-Request
+    check_owner(auth_user_id, purchase_request.user_id)
+    try:
+        return await async_crud.purchase(db, user_id=purchase_request.user_id, quantity=purchase_request.quantity,
+                                         price_per_token=TOKEN_PRICE, signed=purchase_request.signed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post('/verify/', response_model=schemas.VerifyTokenResponse)
+async def verify_token(request: schemas.VerifyTokenRequest, db: AsyncSession = Depends(get_async_db)):
+    # ตรวจสอบและใช้โทเค็น Pay-Per-Request
+    if TOKEN_INDEX_ENABLED:
+        try:
+            result = (await token_index.spend_async([request.token_id], timeout=SPEND_LOG_TIMEOUT))[0]
+        except SpendUnavailable as e:
+            raise spend_unavailable(e)
+        if result is not None:
+            return result
+    return await async_crud.verify_and_use_token(db, request.token_id)
+
+@app.post('/verify/batch', response_model=schemas.VerifyTokenBatchResponse)
+async def verify_tokens_batch(request: schemas.VerifyTokenBatchRequest, db: AsyncSession = Depends(get_async_db)):
+    # ตรวจสอบและใช้โทเค็นหลายใบใน transaction เดียว (ใช้โดย Gateway micro-batching)
+    # atomic: ตัดยอดทุกใบหรือไม่ตัดเลย (Gateway ใช้กับ route ที่ราคาหลาย token) index ตอบครบทุกใบ หรือส่งทุกใบให้ crud
+    results = [None] * len(request.token_ids)
+    if TOKEN_INDEX_ENABLED:
+        try:
+            results = await token_index.spend_async(request.token_ids, timeout=SPEND_LOG_TIMEOUT, atomic=request.atomic)
+        except SpendUnavailable as e:
+            raise spend_unavailable(e)
+    # token ที่ index ไม่รู้จัก ใช้ทางเดิม (ลำดับผลตาม token_ids ในคำขอ)
+    unknown = [token_id for token_id, result in zip(request.token_ids, results) if result is None]
+    if unknown:
+        fallback = iter(await async_crud.verify_and_use_tokens(db, unknown, request.atomic))
+        results = [result if result is not None else next(fallback) for result in results]
+    return {"results": results}
+
+@app.get('/tokens/serial-watermark', response_model=schemas.SerialWatermarkResponse)
+async def read_serial_watermark(db: AsyncSession = Depends(get_async_db)):
+    # Gateway ใช้ค่านี้ตอน startup: signed token ที่ออกก่อนหน้านี้ต้อง verify ผ่าน Bank
+    return {"next_serial": await async_crud.get_serial_watermark(db)}
+
+@app.get('/stats/hashing')
+async def hashing_stats():
+    # ความยาวคิวและ latency ของการ hash รหัสผ่าน
+    return password_hasher.stats()
+
+@app.get('/stats/user-cache')
+async def user_cache_stats():
+    # hit/miss ของ cache ข้อมูลผู้ใช้ (ปิดด้วย BANK_USER_CACHE=0)
+    return user_cache.stats()
+
+@app.get('/stats/token-index')
+async def token_index_stats():
+    # ขนาด index, token ที่รอ replay, batch/fsync ของ spend log
+    return {"enabled": TOKEN_INDEX_ENABLED, **token_index.stats()}
+
+@app.get('/stats/tokens')
+async def token_storage_stats():
+    # ขนาดตาราง Tokens / archive / ไฟล์ฐานข้อมูล ณ รอบ compaction ล่าสุด
+    return {"enabled": TOKEN_ARCHIVE_ENABLED, **token_compactor.stats()}
+
+@app.get('/metrics')
+async def read_metrics():
+    # Prometheus text format (latency ต่อ route, stage, เวลา commit)
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get('/users/{user_id}/transaction', response_model=List[schemas.TransactionResponse])
+async def read_transactions(response: Response, user_id: int, skip: int=0, limit: int=50, cursor: Optional[str] = None,
+                      db: AsyncSession = Depends(get_async_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ดึงข้อมูลธุรกรรมของผู้ใช้ หน้าถัดไปส่ง cursor จาก header X-Next-Cursor กลับมา (skip ยังใช้ได้แบบเดิม)
+    check_owner(auth_user_id, user_id)
+    try:
+        if cursor is None and skip > 0:
+            transactions = await async_crud.get_users_transactions(db, user_id=user_id, skip=skip, limit=limit)
+            next_cursor = crud.transactions_next_cursor(transactions, limit)
+        else:
+            transactions, next_cursor = await async_crud.get_users_transactions_page(db, user_id=user_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return transactions
+
+@app.get('/users/{user_id}/tokens', response_model=List[schemas.TokenResponse])
+async def read_user_tokens(response: Response, user_id: int, unused_only: bool = True, limit: Optional[int] = Query(default=None, ge=1),
+                     cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ดึงข้อมูลโทเค็นของผู้ใช้ (ไม่ระบุ limit/cursor = ทั้งหมดแบบเดิม ระบุแล้วแบ่งหน้าด้วย X-Next-Cursor)
+    check_owner(auth_user_id, user_id)
+    if limit is None and cursor is None:
+        return await async_crud.get_user_token(db, user_id=user_id, unused_only=unused_only)
+    try:
+        tokens, next_cursor = await async_crud.get_user_tokens_page(db, user_id=user_id, unused_only=unused_only, limit=limit or TOKEN_PAGE_SIZE, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return tokens
+
+@app.get('/users/{user_id}/usage', response_model=schemas.UsageResponse)
+async def read_user_usage(user_id: int, hours: int = Query(default=24, ge=0, le=USAGE_MAX_HOURS), days: int = Query(default=30, ge=0, le=USAGE_MAX_DAYS),
+                    db: AsyncSession = Depends(get_async_db), auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ยอดใช้งานของผู้ใช้ (รายชั่วโมง / รายวัน / ทั้งหมด) จาก rollup ไม่ scan ตารางธุรกรรม
+    check_owner(auth_user_id, user_id)
+    check_usage_enabled()
+    return await async_crud.get_usage(db, user_id=user_id, hours=hours, days=days)
+
+@app.get('/usage', response_model=schemas.UsageResponse)
+async def read_global_usage(hours: int = Query(default=24, ge=0, le=USAGE_MAX_HOURS), days: int = Query(default=30, ge=0, le=USAGE_MAX_DAYS),
+                      db: AsyncSession = Depends(get_async_db)):
+    # ยอดใช้งานรวมทั้งระบบ
+    check_usage_enabled()
+    return await async_crud.get_usage(db, hours=hours, days=days)
+
+@app.get('/users/{user_id}/transaction/export')
+async def export_transactions(request: Request, user_id: int, auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ส่งธุรกรรมทั้งหมดของผู้ใช้เป็น NDJSON ทีละ chunk (memory คงที่ไม่ว่าจะมีกี่แถว)
+    check_owner(auth_user_id, user_id)
+    return ndjson_response(request, lambda cursor: async_export_chunk(
+        asyncSessionLocal, async_crud.get_users_transactions_page, schemas.TransactionResponse, user_id, cursor=cursor))
+
+@app.get('/users/{user_id}/tokens/export')
+async def export_user_tokens(request: Request, user_id: int, unused_only: bool = False,
+                             auth_user_id: Optional[int] = Depends(authenticated_user_id)):
+    # ส่ง token ทั้งหมดของผู้ใช้ (รวม TokenBook) เป็น NDJSON ทีละ chunk
+    check_owner(auth_user_id, user_id)
+    return ndjson_response(request, lambda cursor: async_export_chunk(
+        asyncSessionLocal, async_crud.get_user_tokens_page, schemas.TokenResponse, user_id, unused_only, cursor=cursor))
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=BANK_HOST, port=BANK_PORT)
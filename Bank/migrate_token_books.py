@@ -0,0 +1,40 @@
+# ย้ายการเก็บ token จากตาราง Tokens (หนึ่งแถวต่อ token) ไปเป็น TokenBooks
+#
+# ขั้นตอน:
+#   1) python migrate_token_books.py        -> สร้างตารางใหม่ (TokenBooks, TokenSerials) และแสดงสถานะ
+#   2) ตั้ง BANK_TOKEN_STORAGE=book แล้ว restart Bank -> การซื้อใหม่ทั้งหมดเป็น book
+#   3) token แถวเดิมที่ผู้ใช้ถืออยู่ยัง verify/แสดงผลได้ตามปกติ (ID เดิมเปลี่ยนไม่ได้เพราะ client ถืออยู่)
+#      รัน script นี้ซ้ำเพื่อดูว่าเหลือ token แถวเดิมที่ยังไม่ได้ใช้อีกเท่าไหร่
+#      เมื่อเหลือ 0 ตาราง Tokens จะมีแต่ประวัติ token ที่ใช้แล้วเท่านั้น
+
+from sqlalchemy import func
+from database import sessionLocal, init_db
+from models import Token, TokenBook
+from config import TOKEN_STORAGE
+
+
+def main():
+    init_db()
+    db = sessionLocal()
+    try:
+        legacy_total = db.query(func.count(Token.token_id)).scalar()
+        legacy_unused = db.query(func.count(Token.token_id)).filter(Token.used == False).scalar()
+        books, book_tokens, book_used = db.query(
+            func.count(TokenBook.id), func.coalesce(func.sum(TokenBook.count), 0), func.coalesce(func.sum(TokenBook.used_count), 0)
+        ).one()
+    finally:
+        db.close()
+
+    print(f"BANK_TOKEN_STORAGE = {TOKEN_STORAGE}")
+    print(f"Tokens (legacy rows): {legacy_total} rows, {legacy_unused} unused")
+    print(f"TokenBooks:           {books} books, {book_tokens} tokens, {book_used} used")
+    if TOKEN_STORAGE != "book":
+        print("Set BANK_TOKEN_STORAGE=book and restart the Bank to issue new purchases as token books.")
+    elif legacy_unused:
+        print("Legacy tokens are still outstanding; they keep working until they are spent.")
+    else:
+        print("No unused legacy tokens remain: the Tokens table now only holds spent-token history.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 # Database models - โครงสร้างตารางทั้งหมด
 
-from sqlalchemy import Column, Integer, String, Float, Numeric, DateTime, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, Numeric, DateTime, ForeignKey, Boolean, LargeBinary, Index
 from sqlalchemy.orm import relationship, declarative_base
 from datetime import datetime, timezone
 
@@ -18,6 +18,8 @@ class User(Base):
     # ความสัมพันธ์กับตารางธุรกรรม
     transactions = relationship("Transaction", back_populates="user")
     tokens = relationship("Token", back_populates="user")
+    token_books = relationship("TokenBook", back_populates="user")
+    api_keys = relationship("ApiKey", back_populates="user")
 
     def __repr__(self):
         return f"<User(id={self.id}, username='{self.username}', balance={self.balance})>"
@@ -35,6 +37,9 @@ class Transaction(Base):
     # ความสัมพันธ์กับตารางผู้ใช้
     user = relationship("User", back_populates="transactions")
 
+    # ประวัติธุรกรรมของผู้ใช้ เรียงใหม่ไปเก่า (keyset pagination ใช้ timestamp, id)
+    __table_args__ = (Index('ix_transactions_user_timestamp', 'user_id', 'timestamp', 'id'),)
+
     def __repr__(self):
         return f"<Transaction(id={self.id}, user_id={self.user_id}, amount={self.amount}, type='{self.type}')>"
     
@@ -51,6 +56,97 @@ class Token(Base):
     # ความสัมพันธ์กับตารางผู้ใช้
     user = relationship("User", back_populates="tokens")
 
+    # รายการ token ของผู้ใช้ เรียงใหม่ไปเก่า ทั้งแบบทั้งหมดและเฉพาะที่ยังไม่ใช้
+    # ix_tokens_used_at: ให้ token_archive.py หา token ที่ใช้แล้วเกินอายุได้โดยไม่ scan ทั้งตาราง (partial index เฉพาะที่ใช้แล้ว)
+    __table_args__ = (Index('ix_tokens_user_created', 'user_id', 'created_at', 'token_id'),
+                      Index('ix_tokens_user_used_created', 'user_id', 'used', 'created_at', 'token_id'),
+                      Index('ix_tokens_used_at', 'used_at', sqlite_where=used == True))
+
     def __repr__(self):
         status = "USED" if self.used else "AVAILABLE"
         return f"<Token(id='{self.token_id}', user_id={self.user_id}, status={status})>"
+
+class ArchivedToken(Base):
+    # token ที่ใช้แล้วและเก่าเกินอายุที่กำหนด ย้ายออกจาก Tokens มาไว้ที่นี่ (token_archive.py) ให้ตาราง Tokens เล็กอยู่เสมอ
+    # คอลัมน์เหมือน Tokens ทุกอย่าง + เวลาที่ย้ายมา ทุกแถวที่นี่เป็น token ที่ใช้แล้ว
+    __tablename__ = "TokensArchive"
+    token_id = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey('Users.id'), nullable=False)
+    price = Column(Numeric(precision=12, scale=2), nullable=False)
+    created_at = Column(DateTime)
+    used = Column(Boolean, default=True, nullable=False)
+    used_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (Index('ix_tokens_archive_user_created', 'user_id', 'created_at', 'token_id'),)
+
+    def __repr__(self):
+        return f"<ArchivedToken(id='{self.token_id}', user_id={self.user_id})>"
+
+class TokenSerial(Base):
+    # ตัวนับ serial ของ signed token (มีแถวเดียว id=1)
+    __tablename__ = "TokenSerials"
+    id = Column(Integer, primary_key=True)
+    next_serial = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<TokenSerial(next_serial={self.next_serial})>"
+
+class TokenBook(Base):
+    # ตาราง token book: การซื้อหนึ่งครั้ง = หนึ่งแถว + bitmap ของ slot ที่ใช้แล้ว (1 bit ต่อ token)
+    # token ID ได้มาจาก book ID กับเลข slot (ดู token_signing.py) ไม่มีแถวแยกของแต่ละ token
+    __tablename__ = "TokenBooks"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, ForeignKey('Users.id'), nullable=False, index=True)
+    price = Column(Numeric(precision=12, scale=2), nullable=False)
+    base_serial = Column(Integer, nullable=False, unique=True)   # serial ของ slot 0
+    count = Column(Integer, nullable=False)
+    secret = Column(String, nullable=False)                       # ใช้เซ็น token ID ของ book นี้
+    expires_at = Column(Integer, nullable=True)                   # มีค่าเฉพาะ book ของ signed token
+    used_bitmap = Column(LargeBinary, nullable=False)
+    used_count = Column(Integer, default=0, nullable=False)       # ใช้เป็น version ตอน compare-and-swap ด้วย
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    last_used_at = Column(DateTime, nullable=True)
+
+    # ความสัมพันธ์กับตารางผู้ใช้
+    user = relationship("User", back_populates="token_books")
+
+    __table_args__ = (Index('ix_token_books_user_created', 'user_id', 'created_at', 'id'),)
+
+    def __repr__(self):
+        return f"<TokenBook(id={self.id}, user_id={self.user_id}, used={self.used_count}/{self.count})>"
+
+class ApiKey(Base):
+    # ตาราง API key ที่ออกตอน login เก็บเฉพาะ sha256 ของ key (key จริงส่งให้ผู้ใช้ครั้งเดียว)
+    __tablename__ = "ApiKeys"
+    key_hash = Column(String, primary_key=True)
+    user_id = Column(Integer, ForeignKey('Users.id'), nullable=False, index=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = Column(Integer, nullable=False)                  # unix time
+
+    # ความสัมพันธ์กับตารางผู้ใช้
+    user = relationship("User", back_populates="api_keys")
+
+    def __repr__(self):
+        return f"<ApiKey(user_id={self.user_id}, expires_at={self.expires_at})>"
+
+class UsageRollup(Base):
+    # ยอดสะสมการใช้งาน อัพเดทใน transaction เดียวกับ topup / purchase / verify (ไม่ต้อง scan Transactions/Tokens)
+    # หนึ่งแถวต่อ (ผู้ใช้, ช่วงเวลา) โดย user_id = 0 คือยอดรวมทั้งระบบ
+    __tablename__ = "UsageRollups"
+    user_id = Column(Integer, primary_key=True)
+    period = Column(String, primary_key=True)                     # hour / day / total
+    period_start = Column(Integer, primary_key=True)              # unix time ต้นชั่วโมง/ต้นวัน (UTC) ส่วน total เป็น 0
+    spent = Column(Numeric(precision=12, scale=2), default=0, nullable=False)
+    topped_up = Column(Numeric(precision=12, scale=2), default=0, nullable=False)
+    tokens_bought = Column(Integer, default=0, nullable=False)
+    tokens_used = Column(Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f"<UsageRollup(user_id={self.user_id}, period='{self.period}', period_start={self.period_start})>"
+
+def create_missing_indexes(connection):
+    # create_all ไม่เพิ่ม index ให้ตารางที่มีอยู่แล้ว ฐานข้อมูลเดิมจึงต้องสร้าง index ใหม่เองแบบ checkfirst
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
@@ -2,6 +2,7 @@ from pydantic import BaseModel, Field, field_validator, ConfigDict
 from decimal import Decimal
 from datetime import datetime
 from typing import List, Optional
+from config import MAX_PURCHASE_QUANTITY, VERIFY_BATCH_MAX_SIZE
 
 class UserCreate(BaseModel):
     # ข้อมูลพื้นฐานของผู้ใช้
@@ -30,6 +31,11 @@ class UserResponse(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class LoginResponse(UserResponse):
+    # ข้อมูลผู้ใช้ + API key สำหรับเรียก API ครั้งต่อไป (X-API-Key หรือ Authorization: Bearer)
+    api_key: str
+    api_key_expires_at: datetime
+
 class TransactionResponse(BaseModel):
     # ข้อมูลธุรกรรมที่ส่งกลับ
     id: int
@@ -75,12 +81,13 @@ class PurchaseTokenRequest(BaseModel):
     # คำขอซื้อโทเค็น
     user_id: int = Field(..., gt=0)
     quantity: int = Field(..., gt=0)
+    signed: bool = Field(default=False, description="Issue signed tokens that the Gateway can verify offline")
 
     @field_validator('quantity')
     @classmethod
     def validate_quantity(cls, v: int) -> int:
-        if v > 100:
-            raise ValueError('Cannot purchase more than 100 tokens at once')
+        if v > MAX_PURCHASE_QUANTITY:
+            raise ValueError(f'Cannot purchase more than {MAX_PURCHASE_QUANTITY} tokens at once')
         return v
 
 class PurchaseTokenResponse(BaseModel):
@@ -101,3 +108,34 @@ class VerifyTokenResponse(BaseModel):
     token_id: Optional[str] = None
     message: Optional[str] = None
     used_at: Optional[datetime] = None
+
+class VerifyTokenBatchRequest(BaseModel):
+    # คำขอตรวจสอบโทเค็นหลายใบพร้อมกัน
+    token_ids: List[str] = Field(..., min_length=1, max_length=VERIFY_BATCH_MAX_SIZE, description="Token IDs to verify")
+    atomic: bool = Field(default=False, description="Spend every token or none of them (a route priced at several tokens)")
+
+class VerifyTokenBatchResponse(BaseModel):
+    # ผลการตรวจสอบ เรียงตามลำดับ token_ids ในคำขอ
+    results: List[VerifyTokenResponse]
+
+class SerialWatermarkResponse(BaseModel):
+    # serial ตัวถัดไปของ signed token
+    next_serial: int
+
+class UsageTotals(BaseModel):
+    # ยอดใช้งานสะสม
+    spent: Decimal
+    topped_up: Decimal
+    tokens_bought: int
+    tokens_used: int
+
+class UsageBucket(UsageTotals):
+    # ยอดใช้งานในหนึ่งชั่วโมง/หนึ่งวัน (UTC) ช่วงที่ไม่มีรายการจะไม่ถูกส่งกลับ
+    period_start: datetime
+
+class UsageResponse(BaseModel):
+    # ยอดใช้งานของผู้ใช้ (user_id = None คือทั้งระบบ) เรียงใหม่ไปเก่า
+    user_id: Optional[int] = None
+    total: UsageTotals
+    hourly: List[UsageBucket]
+    daily: List[UsageBucket]
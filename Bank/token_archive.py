@@ -0,0 +1,177 @@
+# Archive ของ token ที่ใช้แล้ว - ให้ตาราง Tokens (และ index ที่ verify ใช้) เล็กอยู่เสมอ
+# token ที่ใช้แล้วนานเกิน TOKEN_ARCHIVE_AGE ถูกย้ายไป TokensArchive ทีละ batch (INSERT ... SELECT + DELETE ใน transaction สั้น ๆ)
+# พักระหว่าง batch ให้ request อื่นได้ write lock แล้วปิดรอบด้วย WAL checkpoint + incremental vacuum
+# verify token ที่ย้ายไปแล้วยังได้ 'Token already used' (crud.spend_tokens หาใน archive ต่อ) และประวัติยังดูได้จาก /users/{id}/tokens
+#
+# TokenCompactor รันใน thread แยก (แบบเดียวกับ GroupCommitWriter) ด้วย session ของ database.py ใช้ได้ทั้ง main.py และ main_async.py
+# รันรอบเดียวด้วยมือ: python compact_tokens.py
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import delete, func, insert, literal, select
+from crud import TOKEN_COLUMNS
+from models import ArchivedToken, Token
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import metrics
+
+TABLE_ROWS = metrics.gauge('bank_table_rows', 'Row count of token tables, measured after each compaction run', ('table',))
+DB_FILE_BYTES = metrics.gauge('bank_db_file_bytes', 'Size of the SQLite database and WAL files', ('file',))
+DB_FREELIST_PAGES = metrics.gauge('bank_db_freelist_pages', 'Unused pages inside the database file')
+TOKENS_ARCHIVED = metrics.counter('bank_tokens_archived_total', 'Used tokens moved from Tokens to TokensArchive')
+ARCHIVE_BATCH_LATENCY = metrics.histogram('bank_token_archive_batch_seconds', 'Duration of one archive batch (write lock held)')
+
+
+def archive_batch(db, cutoff: datetime, batch_size: int) -> int:
+    # ย้าย token ที่ใช้แล้วก่อน cutoff ไม่เกิน batch_size แถว (commit เอง) คืนจำนวนที่ย้าย
+    # คำสั่งแรกเป็น INSERT: transaction ได้ write lock ตั้งแต่ต้น (ไม่ต้องอัพเกรดจาก read snapshot ที่อาจเก่าไปแล้ว)
+    oldest = (select(*(getattr(Token, column) for column in TOKEN_COLUMNS), literal(datetime.now(timezone.utc)))
+              .where(Token.used == True, Token.used_at < cutoff)
+              .order_by(Token.used_at)
+              .limit(batch_size))
+    token_ids = db.execute(
+        insert(ArchivedToken).from_select(TOKEN_COLUMNS + ("archived_at",), oldest).returning(ArchivedToken.token_id)
+    ).scalars().all()
+    if token_ids:
+        db.execute(delete(Token).where(Token.token_id.in_(token_ids)).execution_options(synchronize_session=False))
+    db.commit()
+    return len(token_ids)
+
+
+def database_files(db) -> dict:
+    path = db.get_bind().url.database
+    return {name: os.path.getsize(file) if os.path.exists(file) else 0
+            for name, file in (("db", path), ("wal", path + "-wal"))}
+
+
+class TokenCompactor:
+    def __init__(self, session_factory, age: float, interval: float, batch_size: int, max_batches: int,
+                 pause_ms: float, vacuum_pages: int):
+        self.session_factory = session_factory
+        self.age = age
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.pause = pause_ms / 1000
+        self.vacuum_pages = vacuum_pages
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.runs = 0
+        self.archived = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_run = {}
+        self.storage = {}
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="token-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                # เช่น database is locked นานเกิน busy_timeout: ข้ามไปลองรอบหน้า
+                self.errors += 1
+                self.last_error = repr(e)
+            self._stop.wait(self.interval)
+
+    def run_once(self) -> dict:
+        started = time.perf_counter()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.age)
+        db = self.session_factory()
+        try:
+            archived = batches = 0
+            longest_batch = 0.0
+            while batches < self.max_batches and not self._stop.is_set():
+                batch_started = time.perf_counter()
+                moved = archive_batch(db, cutoff, self.batch_size)
+                elapsed = time.perf_counter() - batch_started
+                ARCHIVE_BATCH_LATENCY.observe(elapsed)
+                longest_batch = max(longest_batch, elapsed)
+                batches += 1
+                archived += moved
+                TOKENS_ARCHIVED.inc(amount=moved)
+                if moved < self.batch_size:
+                    break
+                time.sleep(self.pause)
+
+            vacuumed = self.incremental_vacuum(db)
+            # checkpoint หลัง vacuum ไฟล์หลักถึงจะหดจริง / PASSIVE: ไม่รอ reader/writer คนอื่น ทำเท่าที่ทำได้
+            # (journal_size_limit ตัดไฟล์ WAL ให้เมื่อ WAL เริ่มใหม่)
+            busy, wal_pages, checkpointed = db.connection().exec_driver_sql("PRAGMA wal_checkpoint(PASSIVE)").one()
+            db.commit()
+            self.measure(db)
+        finally:
+            db.close()
+
+        self.runs += 1
+        self.archived += archived
+        self.last_run = {
+            "at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "archived": archived,
+            "batches": batches,
+            "longest_batch_ms": longest_batch * 1000,
+            "duration_ms": (time.perf_counter() - started) * 1000,
+            "wal_pages": wal_pages,
+            "wal_checkpointed_pages": checkpointed,
+            "wal_checkpoint_busy": bool(busy),
+            "vacuumed_pages": vacuumed,
+        }
+        return self.last_run
+
+    def incremental_vacuum(self, db) -> int:
+        # คืนหน้าว่างให้ OS ไม่เกิน vacuum_pages หน้าต่อรอบ (ทำได้เฉพาะฐานข้อมูลที่เป็น auto_vacuum=INCREMENTAL)
+        connection = db.connection()
+        if not self.vacuum_pages or connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            return 0
+        before = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        # sqlite3 module step คำสั่งที่ไม่คืนแถวแค่ครั้งเดียว (= คืนได้หน้าเดียว) executescript step จนจบ
+        db.commit()
+        connection = db.connection()
+        connection.connection.executescript(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+        return before - connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+
+    def measure(self, db):
+        # Tokens เล็กเสมอ (นับได้ทุกรอบ) ส่วน archive ใช้ max(rowid) ประมาณจำนวนแถว ไม่ต้อง scan ทั้งตาราง
+        connection = db.connection()
+        hot_rows = db.execute(select(func.count()).select_from(Token)).scalar()
+        archive_rows = connection.exec_driver_sql('SELECT coalesce(max(rowid), 0) FROM "TokensArchive"').scalar()
+        freelist = connection.exec_driver_sql("PRAGMA freelist_count").scalar()
+        auto_vacuum = connection.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        files = database_files(db)
+
+        TABLE_ROWS.set(hot_rows, "Tokens")
+        TABLE_ROWS.set(archive_rows, "TokensArchive")
+        for name, size in files.items():
+            DB_FILE_BYTES.set(size, name)
+        DB_FREELIST_PAGES.set(freelist)
+        self.storage = {"tokens_rows": hot_rows, "archive_rows_approx": archive_rows,
+                        "db_bytes": files["db"], "wal_bytes": files["wal"], "freelist_pages": freelist,
+                        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum, auto_vacuum)}
+
+    def stats(self) -> dict:
+        return {
+            "age_seconds": self.age,
+            "interval_seconds": self.interval,
+            "batch_size": self.batch_size,
+            "runs": self.runs,
+            "archived": self.archived,
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_run": self.last_run,
+            "storage": self.storage,
+        }
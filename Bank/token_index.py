@@ -0,0 +1,306 @@
+# Verify token จาก index ใน memory แทน SQLite (เปิดด้วย BANK_TOKEN_INDEX=1)
+# startup: replay spend log ที่ค้าง -> โหลด token แบบ row ที่ยังไม่ถูกใช้ทั้งหมดเข้า dict (uuid เก็บเป็น int 128 bit)
+# purchase: token ที่ออกใหม่ถูกเพิ่มหลัง commit (session event, ใช้ได้ทั้ง crud ปกติ / group commit writer / AsyncSession)
+#
+# verify: ดึง token ออกจาก index + เขียน spend log (fsync เป็น batch) แล้วตอบ valid ไม่แตะ SQLite
+#   thread แยก replay log ลงตาราง Tokens ทุก TOKEN_INDEX_REPLAY_INTERVAL วินาที ระหว่างนั้น token อยู่ใน pending
+#   token ที่ไม่อยู่ทั้งใน index และ pending (ใช้ไปแล้วนานแล้ว, ไม่มีอยู่, token book) ตอบ None ให้ caller ใช้ crud แบบเดิม
+#   คำขอ all-or-nothing (atomic) claim เมื่อ index ถือครบทุกใบเท่านั้น ไม่ครบก็ไม่ claim สักใบ (ดู _refuse_atomic)
+# at-most-once: ตอบ valid หลัง fsync เท่านั้น และทุกครั้งที่เริ่มใหม่ replay log ก่อนโหลด index
+#   (token ที่เคยตอบ valid ไม่มีทางกลับมาอยู่ใน index) / replay ซ้ำได้เพราะ UPDATE มีเงื่อนไข used == False
+#   เขียน log ไม่สำเร็จ/รอ fsync เกินเวลา: raise SpendUnavailable (route ตอบ 503) คืน token เข้า index เฉพาะที่รู้แน่ว่าไม่ลงไฟล์
+# ข้อจำกัด: ใช้ได้กับ Bank process เดียว (spend log ถือ lock) และ /users/{id}/tokens เห็น token ที่เพิ่งใช้เป็น unused
+#   ได้ไม่เกินหนึ่งรอบ replay
+
+import asyncio
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+import crud
+from models import Token
+
+# metrics.py และ spend_log.py อยู่ที่โฟลเดอร์แม่ (ใช้ร่วมกับ Gateway)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import metrics
+from spend_log import SpendLog, SpendLogError, format_record, read_segment
+
+INDEXED_TOKENS = metrics.gauge('bank_token_index_tokens', 'Unused tokens held in the in-memory index')
+PENDING_SPENDS = metrics.gauge('bank_token_index_pending', 'Spent tokens logged but not yet replayed into Tokens')
+INDEX_VERIFIES = metrics.counter('bank_token_index_verifies_total', 'Token verifications by the in-memory index', ('result',))
+REPLAYED_SPENDS = metrics.counter('bank_spend_log_replayed_total', 'Spend log records replayed into the Tokens table')
+
+# uuid4 ตามที่ crud.apply_purchase ออก (ตัวพิมพ์เล็กเท่านั้น ให้ตรงกับการเทียบ string ใน SQLite)
+UUID_TOKEN = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+
+
+class SpendUnavailable(Exception):
+    pass
+
+
+def token_key(token_id: str):
+    # uuid เก็บเป็น int (44 byte แทน str 85 byte) token แบบอื่น (signed token ในโหมด row) เก็บเป็น str
+    if len(token_id) == 36 and UUID_TOKEN.fullmatch(token_id):
+        return int(token_id.replace("-", ""), 16)
+    return token_id
+
+
+class TokenIndex:
+    def __init__(self, session_factory, log: SpendLog, replay_interval: float, replay_batch_size: int):
+        self.session_factory = session_factory
+        self.log = log
+        self.replay_interval = replay_interval
+        self.replay_batch_size = replay_batch_size
+        self.loaded = False
+        self._tokens = {}       # key -> user_id (token ที่ยังไม่ถูกใช้)
+        self._pending = {}      # key -> (user_id, used_at) ใช้แล้วแต่ยังไม่ได้ replay ลง Tokens
+        self._user_ids = {}     # ใช้ int ของ user_id ตัวเดียวกันทุก token
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.load_seconds = 0.0
+        self.spent = 0
+        self.rejected = 0
+        self.fallbacks = 0
+        self.failed = 0
+        self.released = 0
+        self.replayed = 0
+        self.replay_errors = 0
+        self.last_replay_error = None
+        self.last_replay_ms = 0.0
+
+    def start(self):
+        if self._thread is None:
+            # replay ของรอบก่อนต้องเสร็จก่อนโหลด index (token ที่ใช้ไปแล้วจะได้ไม่ถูกโหลดเป็น unused)
+            self.log.acquire()
+            event.listen(Session, "after_commit", self._after_commit)
+            event.listen(Session, "after_transaction_end", self._after_transaction_end)
+            self.replay(self.log.segments())
+            self.load()
+            self.log.start()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="spend-log-replay", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # หยุด claim token ใหม่ (ที่เหลือให้ crud ตอบ) เขียนที่ค้างให้หมด แล้ว replay ทั้งหมด (ปิดปกติ = log ว่าง)
+        # ระหว่างนี้ token ใน pending ยังตอบ 'Token already used' จนกว่าจะอยู่ใน Tokens แล้ว
+        if self._thread is not None:
+            with self._lock:
+                self.loaded = False
+            event.remove(Session, "after_commit", self._after_commit)
+            event.remove(Session, "after_transaction_end", self._after_transaction_end)
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.log.stop()
+            self.replay(self.log.segments())
+            self._tokens = {}
+
+    def load(self):
+        started = time.perf_counter()
+        tokens = {}
+        db = self.session_factory()
+        try:
+            query = select(Token.token_id, Token.user_id).where(Token.used == False).execution_options(yield_per=50_000)
+            for token_id, user_id in db.execute(query):
+                tokens[token_key(token_id)] = self._user_ids.setdefault(user_id, user_id)
+        finally:
+            db.close()
+        with self._lock:
+            # รวม token ที่ purchase เพิ่มเข้ามาระหว่างโหลด
+            tokens.update(self._tokens)
+            self._tokens = tokens
+            self.loaded = True
+        self.load_seconds = time.perf_counter() - started
+        INDEXED_TOKENS.set(len(tokens))
+
+    def add(self, user_id: int, token_ids):
+        user_id = self._user_ids.setdefault(user_id, user_id)
+        with self._lock:
+            for token_id in token_ids:
+                self._tokens[token_key(token_id)] = user_id
+        INDEXED_TOKENS.set(len(self._tokens))
+
+    def _claim(self, token_ids, atomic: bool = False):
+        # ผลต่อ token: dict ที่ตอบได้เลย / None = ไม่รู้จัก ให้ caller ใช้ crud
+        # ผลของ token ที่ claim ได้ยังห้ามส่งให้ client จนกว่า future (fsync) เสร็จ
+        results = []
+        records = []
+        claimed = []
+        already_used = 0
+        used_at = datetime.now(timezone.utc)
+        # signed token แบบ row ที่หมดอายุ: ไม่ claim (อยู่ใน index ต่อได้ crud ก็ตอบแบบเดียวกัน)
+        expired = {token_id for token_id in token_ids if crud.signed_token_expired(token_id)}
+        with self._lock:
+            if atomic and not self._claimable(token_ids, expired):
+                return self._refuse_atomic(token_ids, expired), None, []
+            for token_id in token_ids:
+                if token_id in expired:
+                    results.append({"valid": False, "message": 'Token expired'})
+                    continue
+                key = token_key(token_id)
+                user_id = self._tokens.pop(key, None) if self.loaded else None
+                if user_id is not None:
+                    # used_at แบบไม่มี timezone เหมือนค่าที่ crud อ่านกลับจาก Tokens หลัง replay
+                    self._pending[key] = (user_id, used_at.replace(tzinfo=None))
+                    claimed.append((key, user_id))
+                    records.append(format_record(token_id, user_id, used_at.timestamp()))
+                    results.append({"valid": True, "user_id": user_id, "token_id": token_id})
+                elif key in self._pending:
+                    already_used += 1
+                    results.append({"valid": False, "message": 'Token already used', "used_at": self._pending[key][1]})
+                else:
+                    results.append(None)
+        expired_count = sum(token_id in expired for token_id in token_ids)
+        fallbacks = len(results) - len(claimed) - already_used - expired_count
+        self.spent += len(claimed)
+        self.rejected += already_used + expired_count
+        self.fallbacks += fallbacks
+        INDEX_VERIFIES.inc("spent", amount=len(claimed))
+        INDEX_VERIFIES.inc("already_used", amount=already_used)
+        INDEX_VERIFIES.inc("expired", amount=expired_count)
+        INDEX_VERIFIES.inc("fallback", amount=fallbacks)
+        return results, self.log.submit(records) if records else None, claimed
+
+    def _claimable(self, token_ids, expired) -> bool:
+        # (ถือ lock อยู่) claim ได้ครบทุกใบหรือไม่ ใบซ้ำในคำขอนับว่าไม่ได้
+        keys = [token_key(token_id) for token_id in token_ids]
+        return self.loaded and not expired and len(set(keys)) == len(keys) and all(key in self._tokens for key in keys)
+
+    def _refuse_atomic(self, token_ids, expired) -> list:
+        # (ถือ lock อยู่) คำขอแบบ all-or-nothing ที่ index claim ได้ไม่ครบ: ไม่ claim สักใบ
+        # - มีใบที่ตอบได้เลยว่าไม่ผ่าน (หมดอายุ / อยู่ใน pending / ซ้ำ): ตอบทั้งคำขอโดยไม่แตะ crud
+        # - ที่เหลือมีใบที่ index ไม่รู้จัก: ส่งทั้งคำขอให้ crud (savepoint เดียว) ใบที่ index ถืออยู่ต้องออกจาก index ก่อน
+        #   ไม่อย่างนั้น crud ตัดยอดใน Tokens แล้ว index ยังตอบ valid ได้อีก (ออกแล้ว token ที่ไม่ถูกตัดยอดก็ยังใช้ผ่าน crud ได้)
+        results = []
+        seen = set()
+        for token_id in token_ids:
+            key = token_key(token_id)
+            if token_id in expired:
+                results.append({"valid": False, "message": 'Token expired'})
+            elif key in self._pending or key in seen:
+                results.append({"valid": False, "message": 'Token already used'})
+            else:
+                results.append(None)
+            seen.add(key)
+        if any(result is not None for result in results):
+            expired_count = sum(token_id in expired for token_id in token_ids)
+            already_used = sum(result is not None for result in results) - expired_count
+            self.rejected += len(token_ids)
+            INDEX_VERIFIES.inc("already_used", amount=already_used)
+            INDEX_VERIFIES.inc("expired", amount=expired_count)
+            INDEX_VERIFIES.inc("not_charged", amount=len(token_ids) - already_used - expired_count)
+            return [result or {"valid": False, "message": crud.NOT_CHARGED} for result in results]
+
+        for token_id in token_ids:
+            self._tokens.pop(token_key(token_id), None)
+        self.fallbacks += len(token_ids)
+        INDEX_VERIFIES.inc("fallback", amount=len(token_ids))
+        INDEXED_TOKENS.set(len(self._tokens))
+        return results
+
+    def _abandon(self, future, claimed):
+        # คำขอนี้ตอบ 503 (ไม่เคยตอบ valid) แต่ record อาจลงดิสก์แล้ว: token ค้างใน pending (ตอบ 'Token already used')
+        #   ถ้าลงจริง replay จะ mark used แล้วเอาออกจาก pending / ถ้าไม่ลง ค้างจน restart แล้วโหลดเป็น unused ใหม่
+        # คืนเข้า index ได้เฉพาะเมื่อรู้แน่ว่าไม่มี byte ใดลงไฟล์ (รอ fsync เกินเวลา: ตัดสินตอน writer ทำเสร็จ)
+        self.failed += 1
+
+        def settle(future):
+            error = future.exception()
+            if isinstance(error, SpendLogError) and not error.written:
+                with self._lock:
+                    for key, user_id in claimed:
+                        self._pending.pop(key, None)
+                        self._tokens[key] = user_id
+                self.released += len(claimed)
+
+        future.add_done_callback(settle)
+
+    def spend(self, token_ids, timeout: float = None, atomic: bool = False) -> list:
+        results, future, claimed = self._claim(token_ids, atomic)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except (SpendLogError, TimeoutError) as e:
+                self._abandon(future, claimed)
+                raise SpendUnavailable(str(e) or "Timed out waiting for the spend log") from e
+        return results
+
+    async def spend_async(self, token_ids, timeout: float = None, atomic: bool = False) -> list:
+        results, future, claimed = self._claim(token_ids, atomic)
+        if future is not None:
+            try:
+                # shield: timeout ไม่ cancel future ที่ writer thread ถืออยู่
+                await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+            except (SpendLogError, TimeoutError) as e:
+                self._abandon(future, claimed)
+                raise SpendUnavailable(str(e) or "Timed out waiting for the spend log") from e
+        return results
+
+    def _after_commit(self, session):
+        for user_id, token_ids in session.info.pop(crud.MINTED_TOKENS_KEY, ()):
+            self.add(user_id, token_ids)
+
+    def _after_transaction_end(self, session, transaction):
+        # rollback: token ที่ออกใน transaction นี้ไม่มีอยู่จริง
+        if transaction.parent is None:
+            session.info.pop(crud.MINTED_TOKENS_KEY, None)
+
+    def _run(self):
+        while not self._stop.wait(self.replay_interval):
+            try:
+                self.replay(self.log.rotate())
+            except Exception as e:
+                # เช่น database is locked นานเกิน busy_timeout: segment ยังอยู่ ลองใหม่รอบหน้า
+                self.replay_errors += 1
+                self.last_replay_error = repr(e)
+
+    def replay(self, segments):
+        # เขียน segment ที่ปิดแล้วลง Tokens (commit ทีละ replay_batch_size แถว) แล้วลบไฟล์
+        for path in segments:
+            started = time.perf_counter()
+            records = list(read_segment(path))
+            for offset in range(0, len(records), self.replay_batch_size):
+                chunk = records[offset:offset + self.replay_batch_size]
+                db = self.session_factory()
+                try:
+                    crud.apply_logged_spends(db, [(token_id, datetime.fromtimestamp(used_at, timezone.utc))
+                                                  for token_id, _, used_at in chunk])
+                    db.commit()
+                finally:
+                    db.close()
+                # อยู่ใน Tokens แล้ว (used == True) crud ตอบ 'Token already used' ได้เอง
+                with self._lock:
+                    for token_id, _, _ in chunk:
+                        self._pending.pop(token_key(token_id), None)
+            self.log.remove(path)
+            self.replayed += len(records)
+            self.last_replay_ms = (time.perf_counter() - started) * 1000
+            REPLAYED_SPENDS.inc(amount=len(records))
+        PENDING_SPENDS.set(len(self._pending))
+        INDEXED_TOKENS.set(len(self._tokens))
+
+    def stats(self) -> dict:
+        return {
+            "loaded": self.loaded,
+            "tokens": len(self._tokens),
+            "pending": len(self._pending),
+            "load_seconds": self.load_seconds,
+            "spent": self.spent,
+            "rejected": self.rejected,
+            "fallbacks": self.fallbacks,
+            "failed": self.failed,
+            "released": self.released,
+            "replayed": self.replayed,
+            "replay_errors": self.replay_errors,
+            "last_replay_error": self.last_replay_error,
+            "last_replay_ms": self.last_replay_ms,
+            "log": self.log.stats(),
+        }
+
@@ -0,0 +1,60 @@
+# รูปแบบ token ID ที่ไม่ใช่ uuid4
+#
+# Signed payment tokens - โทเค็นที่ Gateway ตรวจสอบเองได้โดยไม่ต้องถาม Bank
+# รูปแบบ: v1.<user_id>.<price_satang>.<serial>.<expires_at>.<signature>
+# signature = HMAC-SHA256(secret, ส่วนหน้าทั้งหมด) ตัดเหลือ 16 bytes แล้ว encode แบบ base64url
+# (Gateway/offline_tokens.py ใช้รูปแบบเดียวกัน ถ้าแก้ที่นี่ต้องแก้ที่นั่นด้วย)
+#
+# Token book IDs - token ที่เก็บเป็น slot ใน TokenBook (ไม่มีแถวของตัวเอง)
+# รูปแบบ: tb.<book_id>.<slot>.<signature> เซ็นด้วย secret ประจำ book กันการเดา ID ของ slot อื่น
+
+import base64
+import hashlib
+import hmac
+from decimal import Decimal
+
+SIGNED_TOKEN_PREFIX = "v1"
+BOOK_TOKEN_PREFIX = "tb"
+SIGNATURE_BYTES = 16
+
+
+def _signature(secret: str, payload: str) -> str:
+    digest = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    return base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+
+
+def make_signed_token(secret: str, user_id: int, price: Decimal, serial: int, expires_at: int) -> str:
+    # price เก็บเป็นสตางค์ (จำนวนเต็ม) จะได้ไม่มีปัญหาทศนิยมตอนเซ็น
+    price_satang = int(Decimal(price) * 100)
+    payload = f"{SIGNED_TOKEN_PREFIX}.{user_id}.{price_satang}.{serial}.{expires_at}"
+    return f"{payload}.{_signature(secret, payload)}"
+
+
+def parse_signed_token(secret: str, token_id: str):
+    # คืนค่า (user_id, price_satang, serial, expires_at) หรือ None ถ้ารูปแบบ/ลายเซ็นไม่ถูกต้อง
+    payload, _, signature = token_id.rpartition(".")
+    parts = payload.split(".")
+    if len(parts) != 5 or parts[0] != SIGNED_TOKEN_PREFIX:
+        return None
+    if not hmac.compare_digest(_signature(secret, payload), signature):
+        return None
+    try:
+        return tuple(int(part) for part in parts[1:])
+    except ValueError:
+        return None
+
+
+def make_book_token_id(book_secret: str, book_id: int, slot: int) -> str:
+    payload = f"{BOOK_TOKEN_PREFIX}.{book_id}.{slot}"
+    return f"{payload}.{_signature(book_secret, payload)}"
+
+
+def parse_book_token_id(token_id: str):
+    # คืนค่า (book_id, slot) หรือ None (ยังไม่ได้ตรวจลายเซ็น ต้องใช้ secret ของ book)
+    parts = token_id.split(".")
+    if len(parts) != 4 or parts[0] != BOOK_TOKEN_PREFIX:
+        return None
+    try:
+        return int(parts[1]), int(parts[2])
+    except ValueError:
+        return None
@@ -0,0 +1,129 @@
+# Read-through cache ของข้อมูลผู้ใช้ (id, username, balance, created_at) ใน process - GET /users/{id} และการเช็คว่ามีผู้ใช้ก่อน topup
+# ไม่ต้อง query SQLite ทุกครั้ง จำกัดจำนวน entry (LRU) และหมดอายุตาม TTL
+#
+# การ invalidate ผูกกับ commit ของ Session (แบบเดียวกับ metrics.observe_sqlalchemy_commits):
+#   crud ที่เขียนตาราง Users เรียก mark_written(db, user_id) -> หลัง commit สำเร็จ entry ของ user นั้นถูกลบ
+#   ใช้ได้ทั้ง crud ปกติ, group commit writer (commit ทีเดียวทั้ง batch) และ AsyncSession (ห่อ Session ไว้)
+#   commit คืนค่าเมื่อไหร่ entry เก่าก็ถูกลบไปแล้ว response ของการเขียนนั้นและ request หลังจากนั้นไม่เห็นยอดเก่า
+# กันค่าเก่าถูกใส่กลับ: reader ที่อ่านจาก snapshot ก่อนมีการ invalidate จะใส่ cache ไม่ได้ (นับเป็น stale_skips)
+#   เทียบ generation ตอนเริ่ม transaction ของ reader กับ generation ปัจจุบัน (ทุกการ invalidate เพิ่ม generation)
+# หมายเหตุ: cache อยู่ใน process ถ้ารัน Bank หลาย worker การเขียนจาก worker อื่นจะเห็นช้าได้ไม่เกิน TTL (ปิดด้วย BANK_USER_CACHE=0)
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from config import USER_CACHE_ENABLED, USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL
+
+# ข้อมูลผู้ใช้ที่ไม่ผูกกับ Session (ใช้กับ response_model ที่ from_attributes ได้เหมือน User)
+UserSnapshot = namedtuple("UserSnapshot", "id username balance created_at")
+
+GENERATION_KEY = "user_cache_generation"
+WRITTEN_KEY = "user_cache_written"
+
+
+class UserCache:
+    def __init__(self, max_entries: int, ttl: float, enabled: bool = True):
+        self.enabled = enabled and max_entries > 0 and ttl > 0
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # user_id -> (expires_at, UserSnapshot)
+        self._lock = threading.Lock()   # main.py เรียกจาก threadpool + group commit writer thread
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.inserts = 0
+        self.stale_skips = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, user_id: int):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[user_id]
+                self.expired += 1
+            self.misses += 1
+            return None
+
+    def generation(self, db) -> int:
+        # เรียกก่อน query: generation ตอนเริ่ม transaction ของ db (snapshot ของ SQLite เริ่มหลังจากนั้นเสมอ)
+        return db.info.get(GENERATION_KEY, self._generation)
+
+    def put(self, db, user: UserSnapshot, generation: int):
+        if not self.enabled or user.id in db.info.get(WRITTEN_KEY, ()):
+            # ค่าที่ session นี้เขียนเองแต่ยังไม่ commit ห้ามใส่ cache
+            return
+        with self._lock:
+            if generation != self._generation:
+                self.stale_skips += 1
+                return
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            self.inserts += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_ids):
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                if self._entries.pop(user_id, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "inserts": self.inserts,
+            "stale_skips": self.stale_skips,
+            "invalidations": self.invalidations,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+user_cache = UserCache(max_entries=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL, enabled=USER_CACHE_ENABLED)
+
+
+def mark_written(db, user_id: int):
+    # เรียกหลังเขียนแถวของ user_id (ยังไม่ commit) -> invalidate หลัง commit สำเร็จ
+    db.info.setdefault(WRITTEN_KEY, set()).add(user_id)
+
+
+def _after_begin(session, transaction, connection):
+    session.info.setdefault(GENERATION_KEY, user_cache._generation)
+
+
+def _after_commit(session):
+    written = session.info.pop(WRITTEN_KEY, None)
+    if written:
+        user_cache.invalidate(written)
+
+
+def _after_transaction_end(session, transaction):
+    # rollback / close: ทิ้งรายการที่เขียนไว้ (ไม่มีอะไรเปลี่ยนใน DB) เริ่ม generation ใหม่ที่ transaction หน้า
+    if transaction.parent is None:
+        session.info.pop(WRITTEN_KEY, None)
+        session.info.pop(GENERATION_KEY, None)
+
+
+event.listen(Session, "after_begin", _after_begin)
+event.listen(Session, "after_commit", _after_commit)
+event.listen(Session, "after_transaction_end", _after_transaction_end)
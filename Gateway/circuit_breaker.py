@@ -0,0 +1,123 @@
+# Circuit breaker + adaptive timeout ต่อ upstream
+# - breaker: ล้มเหลวติดกันครบ failure_threshold ครั้ง -> OPEN (ตอบ 503 ทันทีไม่เรียก upstream) เป็นเวลา open_seconds
+#   จากนั้น HALF_OPEN ปล่อย request ทดลองทีละ half_open_max_calls ถ้าสำเร็จกลับเป็น CLOSED ถ้าล้มเหลวกลับไป OPEN
+# - timeout: p99 ของ latency ล่าสุด x multiplier (อยู่ระหว่าง min_timeout กับ timeout ที่ตั้งไว้)
+#   upstream ที่ปกติเร็วแต่เริ่มช้าจะถูกตัดเร็วขึ้น แทนที่ทุก request จะรอจนครบ timeout เต็ม
+
+import time
+from collections import deque
+import httpx
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class UpstreamUnavailable(httpx.RequestError):
+    # ไม่ได้เรียก upstream เลย (breaker เปิดอยู่ หรือ in-flight เต็ม) caller ควรตอบ 503 + Retry-After
+    def __init__(self, upstream: str, reason: str, retry_after: float):
+        super().__init__(f"{upstream} upstream unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, open_seconds: float, half_open_max_calls: int = 1):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+
+        self.times_opened = 0
+        self.rejected = 0
+        self.last_failure = None
+
+    def allow(self) -> float:
+        # คืน 0 ถ้าเรียก upstream ได้ ไม่งั้นคืนจำนวนวินาทีที่ควรรอ
+        now = time.monotonic()
+        if self.state == OPEN:
+            remaining = self.opened_at + self.open_seconds - now
+            if remaining > 0:
+                self.rejected += 1
+                return remaining
+            self.state = HALF_OPEN
+            self.opened_at = now
+            self._probes = 0
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                # probe ที่ถูกยกเลิกกลางทาง (client ตัดการเชื่อมต่อ) จะไม่รายงานผล ครบ open_seconds แล้วให้ probe ใหม่
+                if now - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return self.opened_at + self.open_seconds - now
+                self.opened_at = now
+                self._probes = 0
+            self._probes += 1
+        return 0.0
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.state = CLOSED
+
+    def record_failure(self, reason: str):
+        self.consecutive_failures += 1
+        self.last_failure = reason
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "open_seconds": self.open_seconds,
+            "retry_in": max(0.0, self.opened_at + self.open_seconds - time.monotonic()) if self.state != CLOSED else 0.0,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "last_failure": self.last_failure,
+        }
+
+
+class AdaptiveTimeout:
+    def __init__(self, max_timeout: float, min_timeout: float, multiplier: float, window: int = 500, min_samples: int = 50):
+        self.max_timeout = max_timeout
+        self.min_timeout = min_timeout
+        self.multiplier = multiplier
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)    # วินาที
+        self._current = max_timeout
+        self._stale = False
+
+    def record(self, seconds: float):
+        # request ที่ timeout ก็บันทึกด้วย (ค่าเท่ากับ timeout ที่ใช้) ไม่งั้น p99 จะค้างอยู่ที่ค่าต่ำตอน upstream ช้าลง
+        self._samples.append(seconds)
+        self._stale = True
+
+    def percentile(self, fraction: float) -> float:
+        if not self._samples:
+            return 0.0
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    @property
+    def current(self) -> float:
+        # คำนวณใหม่เมื่อมี sample ใหม่เท่านั้น (sort 500 ค่าต่อ request ไม่คุ้ม)
+        if self._stale:
+            self._stale = False
+            if len(self._samples) >= self.min_samples:
+                self._current = min(self.max_timeout, max(self.min_timeout, self.percentile(0.99) * self.multiplier))
+        return self._current
+
+    def stats(self) -> dict:
+        return {
+            "timeout": self.current,
+            "max_timeout": self.max_timeout,
+            "min_timeout": self.min_timeout,
+            "samples": len(self._samples),
+            "p50_ms": self.percentile(0.50) * 1000,
+            "p99_ms": self.percentile(0.99) * 1000,
+        }
@@ -0,0 +1,98 @@
+# ค่าตั้งค่าของ Gateway (อ่านจาก environment ได้ ถ้าไม่ตั้งจะใช้ค่า default)
+
+import os
+
+# --- ตั้งค่า URL ของ Bank และ Backend ตรงนี้ ---
+BANK_API_URL = os.getenv("BANK_API_URL", "http://143.198.85.26:8000")        # Mock Bank
+BACKEND_API_URL = os.getenv("BACKEND_API_URL", "http://143.198.85.26:8001")  # Backend Service
+# ------------------------------------------------
+
+# --- Connection pool ต่อ upstream ---
+# Bank: request สั้นๆ แต่ถี่มาก (ทุก paid request ต้อง verify)
+BANK_MAX_CONNECTIONS = int(os.getenv("BANK_MAX_CONNECTIONS", "100"))
+BANK_MAX_KEEPALIVE = int(os.getenv("BANK_MAX_KEEPALIVE", "50"))
+BANK_KEEPALIVE_EXPIRY = float(os.getenv("BANK_KEEPALIVE_EXPIRY", "30"))
+BANK_TIMEOUT = float(os.getenv("BANK_TIMEOUT", "5.0"))
+BANK_CONNECT_TIMEOUT = float(os.getenv("BANK_CONNECT_TIMEOUT", "2.0"))
+BANK_POOL_TIMEOUT = float(os.getenv("BANK_POOL_TIMEOUT", "5.0"))
+
+# Backend: งาน CPU หนัก ใช้เวลานานกว่า
+BACKEND_MAX_CONNECTIONS = int(os.getenv("BACKEND_MAX_CONNECTIONS", "100"))
+BACKEND_MAX_KEEPALIVE = int(os.getenv("BACKEND_MAX_KEEPALIVE", "50"))
+BACKEND_KEEPALIVE_EXPIRY = float(os.getenv("BACKEND_KEEPALIVE_EXPIRY", "30"))
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "10.0"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "2.0"))
+BACKEND_POOL_TIMEOUT = float(os.getenv("BACKEND_POOL_TIMEOUT", "10.0"))
+
+# --- Micro-batching ของ verify token (/verify/batch ที่ Bank) ---
+VERIFY_BATCH_ENABLED = os.getenv("VERIFY_BATCH_ENABLED", "1") == "1"
+VERIFY_BATCH_MAX_SIZE = int(os.getenv("VERIFY_BATCH_MAX_SIZE", "64"))      # ต้องไม่เกิน BANK_VERIFY_BATCH_MAX_SIZE
+VERIFY_BATCH_WINDOW_MS = float(os.getenv("VERIFY_BATCH_WINDOW_MS", "2"))
+
+# --- Signed payment token (ตรวจสอบ offline ที่ Gateway) ---
+# ต้องตรงกับ BANK_TOKEN_SECRET ของ Bank ถ้าว่างไว้จะ verify ทุก token ผ่าน Bank ตามเดิม
+PAYMENT_TOKEN_SECRET = os.getenv("PAYMENT_TOKEN_SECRET", "")
+SPENT_SET_BLOCK_SIZE = int(os.getenv("SPENT_SET_BLOCK_SIZE", "4096"))   # จำนวน serial ต่อ bitmap หนึ่ง block
+SETTLE_BATCH_SIZE = int(os.getenv("SETTLE_BATCH_SIZE", "200"))           # ต้องไม่เกิน BANK_VERIFY_BATCH_MAX_SIZE
+SETTLE_INTERVAL_MS = float(os.getenv("SETTLE_INTERVAL_MS", "50"))
+# token ที่ verify offline ถูกบันทึกลง journal (fsync) ก่อนตอบ ผ่าน แล้ว settle จาก journal (ไฟล์จริงคือ settle.log.000001, ...)
+# journal ถือ lock: รันได้ Gateway process เดียวต่อ journal (uvicorn --workers N ต้องปิด offline verify หรือแยก Gateway)
+SETTLE_JOURNAL_PATH = os.getenv("SETTLE_JOURNAL", "settle.log")
+SETTLE_JOURNAL_TIMEOUT = float(os.getenv("SETTLE_JOURNAL_TIMEOUT", "5"))    # รอ fsync นานสุด (วินาที) เกินแล้วให้ Bank verify แทน
+SETTLE_MAX_PENDING = int(os.getenv("SETTLE_MAX_PENDING", "100000"))        # token ที่ยังไม่ได้ settle เกินนี้ให้ Bank verify แทน
+
+# --- Response cache ของ backend route (การจ่ายเงินยัง verify ทุก request) ---
+# TTL ต่อ route รูปแบบ "path=วินาที,path=วินาที" (0 = ไม่ cache แต่ยังรวม request ที่ซ้ำกันพร้อมกัน)
+CACHE_ROUTE_TTLS = {
+    path.strip(): float(ttl)
+    for path, ttl in (item.split("=") for item in os.getenv("CACHE_ROUTE_TTLS", "/expensive-data=5").split(",") if item.strip())
+}
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# --- Admission control (token bucket ต่อ client IP และต่อผู้ใช้/book ที่ออก payment token) ---
+# limit ต่อ route รูปแบบ "path=ip_rate:ip_burst:token_rate:token_burst,..." (rate เป็น request/วินาที, 0 = ไม่จำกัดด้านนั้น)
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "0") == "1"          # ปิดไว้ก่อนเหมือน feature ใหม่อื่นของ Gateway
+RATE_LIMIT_ROUTES = os.getenv("RATE_LIMIT_ROUTES", "/premium-data=200:400:100:200")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))        # จำนวน key สูงสุดต่อ limiter (LRU)
+# 1 = ใช้ IP แรกใน X-Forwarded-For (เปิดเฉพาะเมื่อ Gateway อยู่หลัง proxy ที่เชื่อถือได้)
+TRUST_FORWARDED_FOR = os.getenv("TRUST_FORWARDED_FOR", "0") == "1"
+
+# --- Token guard (ตรวจรูปแบบ token + negative cache ของ token ที่ Bank ปฏิเสธแล้ว) ---
+TOKEN_PREVALIDATE = os.getenv("TOKEN_PREVALIDATE", "1") == "1"
+NEGATIVE_CACHE_ENABLED = os.getenv("NEGATIVE_CACHE_ENABLED", "1") == "1"
+NEGATIVE_CACHE_MAX_ENTRIES = int(os.getenv("NEGATIVE_CACHE_MAX_ENTRIES", "200000"))
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "600"))    # วินาที
+
+# --- Circuit breaker / adaptive timeout / เพดาน in-flight ต่อ upstream ---
+# ล้มเหลว (connect error, timeout, 5xx) ติดกันครบ threshold -> เปิด breaker ตอบ 503 ทันทีเป็นเวลา OPEN_SECONDS
+# แล้วปล่อย request ทดลอง HALF_OPEN_CALLS ตัว ถ้าผ่านจึงปิด breaker
+CIRCUIT_BREAKER_ENABLED = os.getenv("CIRCUIT_BREAKER_ENABLED", "1") == "1"
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "5"))
+BREAKER_HALF_OPEN_CALLS = int(os.getenv("BREAKER_HALF_OPEN_CALLS", "1"))
+# read timeout = p99 ล่าสุด x MULTIPLIER แต่ไม่ต่ำกว่า *_MIN_TIMEOUT และไม่เกิน BANK_TIMEOUT/BACKEND_TIMEOUT
+ADAPTIVE_TIMEOUT_ENABLED = os.getenv("ADAPTIVE_TIMEOUT_ENABLED", "1") == "1"
+ADAPTIVE_TIMEOUT_MULTIPLIER = float(os.getenv("ADAPTIVE_TIMEOUT_MULTIPLIER", "4"))
+BANK_MIN_TIMEOUT = float(os.getenv("BANK_MIN_TIMEOUT", "0.25"))
+BACKEND_MIN_TIMEOUT = float(os.getenv("BACKEND_MIN_TIMEOUT", "1.0"))
+# request ที่ค้างอยู่ที่ upstream ได้พร้อมกันสูงสุด เกินนี้ตอบ 503 ทันทีแทนการต่อคิวรอ pool (0 = ไม่จำกัด)
+BANK_MAX_IN_FLIGHT = int(os.getenv("BANK_MAX_IN_FLIGHT", "500"))
+BACKEND_MAX_IN_FLIGHT = int(os.getenv("BACKEND_MAX_IN_FLIGHT", "200"))
+
+# --- ที่อยู่ที่ bind ตอนรันด้วย python gateway.py (uvicorn ตั้งเองผ่าน --host/--port) ---
+GATEWAY_HOST = os.getenv("GATEWAY_HOST", "188.166.214.193")
+GATEWAY_PORT = int(os.getenv("GATEWAY_PORT", "8080"))
+
+# --- Route table ของ Gateway (routes.py) ---
+# "prefix=URL|ราคา(token)|timeout|cache_ttl,..." ช่องหลัง URL ว่างได้ (ราคา 1, timeout ตาม upstream)
+# cache_ttl ว่าง: ถ้า path ที่ upstream อยู่ใน CACHE_ROUTE_TTLS ใช้ response cache ไม่งั้น stream body ตรงไม่ buffer
+# ราคามากกว่า 1: client ส่ง token หลายตัวคั่นด้วย comma ใน X-Payment-Token
+GATEWAY_ROUTES = os.getenv("GATEWAY_ROUTES", f"/premium-data={BACKEND_API_URL}/expensive-data|1")
+# ขนาด chunk ที่ส่งต่อ body ที่ stream (รวม chunk 64KB ของ httpx ให้ใหญ่ขึ้น = ส่งน้อยครั้งกว่า, หน่วยความจำต่อ request ไม่เกินนี้)
+GATEWAY_RELAY_CHUNK_SIZE = int(os.getenv("GATEWAY_RELAY_CHUNK_SIZE", str(256 * 1024)))
+
+# --- Speculative fetch (speculation.py): ดึงจาก upstream พร้อมกับ verify การจ่ายเงิน ---
+# ทำเฉพาะ token ที่ผ่านการตรวจเบื้องต้นแล้ว (รูปแบบถูก + ไม่อยู่ใน negative cache) และไม่เกินเพดานจำนวนที่ทำพร้อมกัน
+SPECULATIVE_FETCH_ENABLED = os.getenv("SPECULATIVE_FETCH_ENABLED", "0") == "1"
+SPECULATIVE_MAX_IN_FLIGHT = int(os.getenv("SPECULATIVE_MAX_IN_FLIGHT", "32"))
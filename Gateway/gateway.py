@@ -1,35 +1,221 @@
-from fastapi import FastAPI, HTTPException, Header, Request, status
+from contextlib import asynccontextmanager
+import os
+import sys
+from fastapi import FastAPI, HTTPException, Header, Request, Response, status
+from fastapi.responses import JSONResponse
 import httpx
 import time
 
-# --- ตั้งค่า URL ของ Bank และ Backend ตรงนี้ ---
-BANK_API_URL = "http://143.198.85.26:8000"      # Mock Bank
-BACKEND_API_URL = "http://143.198.85.26:8001"   # Backend Service
-# ------------------------------------------------
-# วิธีรัน: uvicorn gateway:app --host 188.166.214.193 --port 8080
+# metrics.py และ spend_log.py อยู่ที่โฟลเดอร์แม่ (ใช้ร่วมกับ Bank และ Backend) ต้องเพิ่ม path ก่อน import upstream
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import metrics
+import config
+from circuit_breaker import AdaptiveTimeout, CircuitBreaker, UpstreamUnavailable
+from offline_tokens import OfflineTokenVerifier, is_signed_token
+from rate_limiter import AdmissionController, parse_route_limits
+from response_cache import CachedResponse, ResponseCache
+from routes import RouteTable, forward_request_headers, parse_routes, passthrough_response_headers, rewrite_location_headers
+from speculation import SpeculativeFetcher
+from spend_log import SpendLog
+from token_guard import NegativeTokenCache, is_well_formed_token
+from upstream import Upstream
+from verify_batcher import VerifyBatcher
 
-app = FastAPI(title="Gateway", version="1.0.0")
+# วิธีรัน: uvicorn gateway:app --host 188.166.214.193 --port 8080 (หรือ python gateway.py ตาม GATEWAY_HOST/GATEWAY_PORT)
+# (URL ของ Bank/Backend และขนาด pool ตั้งได้ใน config.py หรือผ่าน environment)
+
+
+def make_breaker():
+    if not config.CIRCUIT_BREAKER_ENABLED:
+        return None
+    return CircuitBreaker(failure_threshold=config.BREAKER_FAILURE_THRESHOLD,
+                          open_seconds=config.BREAKER_OPEN_SECONDS,
+                          half_open_max_calls=config.BREAKER_HALF_OPEN_CALLS)
+
+
+def make_adaptive_timeout(max_timeout: float, min_timeout: float):
+    if not config.ADAPTIVE_TIMEOUT_ENABLED:
+        return None
+    return AdaptiveTimeout(max_timeout, min_timeout, config.ADAPTIVE_TIMEOUT_MULTIPLIER)
+
+
+# upstream pool แยกกัน: Bank กับ Backend ไม่แย่ง connection กัน
+bank = Upstream("bank", config.BANK_API_URL,
+                max_connections=config.BANK_MAX_CONNECTIONS,
+                max_keepalive=config.BANK_MAX_KEEPALIVE,
+                keepalive_expiry=config.BANK_KEEPALIVE_EXPIRY,
+                timeout=config.BANK_TIMEOUT,
+                connect_timeout=config.BANK_CONNECT_TIMEOUT,
+                pool_timeout=config.BANK_POOL_TIMEOUT,
+                max_in_flight=config.BANK_MAX_IN_FLIGHT,
+                breaker=make_breaker(),
+                adaptive_timeout=make_adaptive_timeout(config.BANK_TIMEOUT, config.BANK_MIN_TIMEOUT))
+backend = Upstream("backend", config.BACKEND_API_URL,
+                   max_connections=config.BACKEND_MAX_CONNECTIONS,
+                   max_keepalive=config.BACKEND_MAX_KEEPALIVE,
+                   keepalive_expiry=config.BACKEND_KEEPALIVE_EXPIRY,
+                   timeout=config.BACKEND_TIMEOUT,
+                   connect_timeout=config.BACKEND_CONNECT_TIMEOUT,
+                   pool_timeout=config.BACKEND_POOL_TIMEOUT,
+                   max_in_flight=config.BACKEND_MAX_IN_FLIGHT,
+                   breaker=make_breaker(),
+                   adaptive_timeout=make_adaptive_timeout(config.BACKEND_TIMEOUT, config.BACKEND_MIN_TIMEOUT))
+UPSTREAMS = {"bank": bank, "backend": backend}
+
+route_table = RouteTable(parse_routes(config.GATEWAY_ROUTES))
+
+
+def upstream_for(base_url: str) -> Upstream:
+    # route ที่ชี้ไป Backend/Bank ใช้ pool เดิม, URL อื่นได้ pool + breaker ของตัวเอง (ตั้งค่าแบบ Backend)
+    for upstream in UPSTREAMS.values():
+        if upstream.base_url.rstrip("/") == base_url:
+            return upstream
+    name = f"route:{base_url.split('://', 1)[-1]}"
+    UPSTREAMS[name] = Upstream(name, base_url,
+                               max_connections=config.BACKEND_MAX_CONNECTIONS,
+                               max_keepalive=config.BACKEND_MAX_KEEPALIVE,
+                               keepalive_expiry=config.BACKEND_KEEPALIVE_EXPIRY,
+                               timeout=config.BACKEND_TIMEOUT,
+                               connect_timeout=config.BACKEND_CONNECT_TIMEOUT,
+                               pool_timeout=config.BACKEND_POOL_TIMEOUT,
+                               max_in_flight=config.BACKEND_MAX_IN_FLIGHT,
+                               breaker=make_breaker(),
+                               adaptive_timeout=make_adaptive_timeout(config.BACKEND_TIMEOUT, config.BACKEND_MIN_TIMEOUT))
+    return UPSTREAMS[name]
+
+
+ROUTE_UPSTREAMS = {route.prefix: upstream_for(route.base_url) for route in route_table.routes}
+
+verify_batcher = VerifyBatcher(bank, max_size=config.VERIFY_BATCH_MAX_SIZE,
+                               window_ms=config.VERIFY_BATCH_WINDOW_MS)
+
+offline_verifier = OfflineTokenVerifier(bank, secret=config.PAYMENT_TOKEN_SECRET,
+                                        block_size=config.SPENT_SET_BLOCK_SIZE,
+                                        settle_batch_size=config.SETTLE_BATCH_SIZE,
+                                        settle_interval_ms=config.SETTLE_INTERVAL_MS,
+                                        journal=SpendLog(config.SETTLE_JOURNAL_PATH, max_batch=512, max_wait_ms=0, service="gateway"),
+                                        journal_timeout=config.SETTLE_JOURNAL_TIMEOUT,
+                                        max_pending=config.SETTLE_MAX_PENDING)
+
+response_cache = ResponseCache(max_entries=config.RESPONSE_CACHE_MAX_ENTRIES,
+                               max_bytes=config.RESPONSE_CACHE_MAX_BYTES)
+
+negative_cache = NegativeTokenCache(max_entries=config.NEGATIVE_CACHE_MAX_ENTRIES, ttl=config.NEGATIVE_CACHE_TTL)
+
+speculator = SpeculativeFetcher(max_in_flight=config.SPECULATIVE_MAX_IN_FLIGHT)
+
+admission = AdmissionController(parse_route_limits(config.RATE_LIMIT_ROUTES) if config.RATE_LIMIT_ENABLED else {},
+                                max_keys=config.RATE_LIMIT_MAX_KEYS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: เปิด connection pool ของแต่ละ upstream
+    for upstream in UPSTREAMS.values():
+        await upstream.start()
+    await offline_verifier.start()
+    lag_monitor = metrics.start_event_loop_lag_monitor("gateway")
+    yield
+    metrics.stop_event_loop_lag_monitor(lag_monitor)
+    # Shutdown: ส่ง verify/settle ที่ค้างอยู่ให้เสร็จ แล้วปิด connection ทั้งหมด
+    await verify_batcher.aclose()
+    await offline_verifier.aclose()
+    for upstream in UPSTREAMS.values():
+        await upstream.aclose()
+
+
+app = FastAPI(title="Gateway", version="1.0.0", lifespan=lifespan)
+
+
+# ผลของ /verify/batch แบบ atomic สำหรับ token ที่ผ่านแต่ไม่ถูกตัดยอด (ตรงกับ crud.NOT_CHARGED ของ Bank)
+NOT_CHARGED = 'Token not charged: another token in the request was rejected'
+
+
+def precheck_payment_token(token: str):
+    # token ที่รูปแบบผิด หรือ Bank เคยปฏิเสธไปแล้ว: ตอบได้ทันทีไม่ต้องถาม Bank (None = ต้องถาม)
+    if config.TOKEN_PREVALIDATE and not is_well_formed_token(token):
+        negative_cache.malformed += 1
+        return False, "Malformed Token"
+    if config.NEGATIVE_CACHE_ENABLED:
+        message = negative_cache.get(token)
+        if message is not None:
+            return False, message
+    return None
 
 
 async def verify_payment_token(token: str):
+    outcome = precheck_payment_token(token)
+    if outcome is not None:
+        return outcome
+
+    is_valid, message = await check_payment_token(token)
+    if not is_valid and config.NEGATIVE_CACHE_ENABLED:
+        negative_cache.add(token, message)
+    return is_valid, message
+
+
+async def check_payment_token(token: str):
+    # signed token ตรวจสอบที่ Gateway ได้เลย ไม่ต้องรอ Bank
+    if offline_verifier.enabled and is_signed_token(token):
+        outcome = await offline_verifier.verify(token)
+        if outcome is not None:
+            return outcome
+
     # คุยกับบริการธนาคารเพื่อตรวจสอบ token
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{BANK_API_URL}/verify/",
-                json={"token_id": token},
-                timeout=5.0)
+    if config.VERIFY_BATCH_ENABLED:
+        return await verify_batcher.verify(token)
+
+    try:
+        response = await bank.post("/verify/", json={"token_id": token})
+
+        if response.status_code != 200:
+            return False, "Bank Connection Error"
+
+        result = response.json()
+        return result.get("valid"), result.get("message")
 
-            if response.status_code != 200:
-                return False, "Bank Connection Error"
+    except UpstreamUnavailable:
+        raise
+    except httpx.TimeoutException:
+        return False, "Bank Timeout"
+    except httpx.RequestError:
+        return False, "Bank Unreachable"
 
-            result = response.json()
-            return result.get("valid"), result.get("message")
 
-        except httpx.TimeoutException:
-            return False, "Bank Timeout"
-        except httpx.RequestError:
-            return False, "Bank Unreachable"
+async def fetch_buffered(upstream: Upstream, path: str, headers: list, read_timeout) -> CachedResponse:
+    # อ่าน body ทั้งก้อนเป็น bytes ตามที่ upstream ส่งมา (ไม่ decode/parse) สำหรับเก็บใน response cache
+    response = await upstream.stream("GET", path, headers=headers, read_timeout=read_timeout)
+    try:
+        content = b"".join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+    return CachedResponse(response.status_code, content, passthrough_response_headers(response.headers.raw))
+
+
+class RelayResponse(Response):
+    # ส่ง body จาก upstream ต่อทีละ chunk ตามที่ได้รับ (raw bytes) หน่วยความจำคงที่ไม่ว่า response จะใหญ่แค่ไหน
+    # ไม่ใช้ StreamingResponse: บน ASGI spec < 2.4 มันสร้าง task group ฟัง disconnect ทุก request (ช้ากว่าราว 2 เท่า)
+    def __init__(self, upstream_response: httpx.Response, route):
+        self.upstream_response = upstream_response
+        self.status_code = upstream_response.status_code
+        self.background = None
+        self.raw_headers = rewrite_location_headers(passthrough_response_headers(upstream_response.headers.raw), route)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            async for chunk in self.upstream_response.aiter_raw(config.GATEWAY_RELAY_CHUNK_SIZE):
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            await self.upstream_response.aclose()
+
+
+def upstream_unavailable(error: UpstreamUnavailable) -> HTTPException:
+    # breaker เปิดอยู่ / upstream มี request ค้างเต็มเพดาน: 503 ทันที พร้อมบอกว่าควรลองใหม่เมื่อไร
+    return HTTPException(status_code=503,
+                         detail=f"{error.upstream.capitalize()} Service Unavailable: {error.reason}",
+                         headers={"Retry-After": str(max(1, int(error.retry_after + 0.999)))})
 
 
 @app.middleware("http")
@@ -42,29 +228,243 @@ async def add_process_time_header(request: Request, call_next):
     return response
 
 
+def limit_key(path: str) -> str:
+    # limit ของ route proxy นับรวมทุก subpath (/premium-data, /premium-data/, /premium-data/x ใช้ bucket เดียวกัน)
+    # path ที่ตั้ง limit ไว้ตรงตัวได้ก่อน (เช่น endpoint อื่นที่ไม่ใช่ route proxy)
+    if path in admission.routes:
+        return path
+    matched = route_table.match(path)
+    return matched[0].prefix if matched is not None else path
+
+
+class AdmissionControlMiddleware:
+    # ตัด request ที่เกิน limit ก่อนถึง route (ยังไม่ verify token / ไม่เรียก upstream)
+    # เป็น ASGI middleware ตรงๆ: request ที่ผ่านไม่ต้องเสีย task + stream เพิ่มแบบ @app.middleware("http")
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            request = Request(scope)
+            client_ip = request.client.host if request.client else "unknown"
+            if config.TRUST_FORWARDED_FOR and "x-forwarded-for" in request.headers:
+                client_ip = request.headers["x-forwarded-for"].split(",")[0].strip()
+            rejected = admission.check(limit_key(scope["path"]), client_ip, request.headers.get("x-payment-token"))
+            if rejected is not None:
+                message, retry_after = rejected
+                response = JSONResponse(status_code=429, content={"detail": message},
+                                        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))})
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(AdmissionControlMiddleware)
+
+# latency ต่อ route + header Server-Timing (ลงทะเบียนหลังสุด = ครอบ middleware อื่น จึงนับ 429 ด้วย)
+app.add_middleware(metrics.MetricsMiddleware, service="gateway")
+
+
 @app.get("/")
 def home():
     return {"message": "Welcome to 402 Gateway!"}
 
 
-@app.get("/premium-data")
-async def get_premium_data(x_payment_token: str = Header(None, alias="X-Payment-Token")):
+@app.get("/metrics")
+def read_metrics():
+    # Prometheus text format (latency ต่อ route, ต่อ stage และต่อ upstream)
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/stats/upstreams")
+def upstream_stats():
+    # ดูการใช้งาน connection pool ของแต่ละ upstream (in-use, idle, waiters)
+    return {name: upstream.pool_stats() for name, upstream in UPSTREAMS.items()}
+
+
+@app.get("/stats/breakers")
+def breaker_stats():
+    # ดูสถานะ circuit breaker, read timeout ปัจจุบัน (จาก p99) และ in-flight ของแต่ละ upstream
+    return {name: upstream.breaker_stats() for name, upstream in UPSTREAMS.items()}
+
+
+@app.get("/stats/verify-batch")
+def verify_batch_stats():
+    # ดูขนาด batch เฉลี่ยที่ส่งไป Bank
+    return {"enabled": config.VERIFY_BATCH_ENABLED, **verify_batcher.stats()}
+
+
+@app.get("/stats/offline-tokens")
+def offline_token_stats():
+    # ดูจำนวน token ที่ verify offline และสถานะการ settle กับ Bank
+    return offline_verifier.stats()
 
+
+@app.get("/stats/cache")
+def cache_stats():
+    # ดู hit/miss/coalesce ของ response cache (= backend CPU ที่ประหยัดได้)
+    return {"route_ttls": config.CACHE_ROUTE_TTLS, **response_cache.stats()}
+
+
+@app.get("/stats/token-guard")
+def token_guard_stats():
+    # ดู token ที่ตัดได้โดยไม่ถาม Bank (รูปแบบผิด + replay ที่เจอใน negative cache)
+    return {"prevalidate": config.TOKEN_PREVALIDATE, "negative_cache_enabled": config.NEGATIVE_CACHE_ENABLED,
+            **negative_cache.stats()}
+
+
+@app.get("/stats/speculation")
+def speculation_stats():
+    return {"enabled": config.SPECULATIVE_FETCH_ENABLED, **speculator.stats()}
+
+
+@app.get("/stats/admission")
+def admission_stats():
+    # ดูจำนวน request ที่รับ/ปฏิเสธ (429) และจำนวน key ที่ limiter ถืออยู่
+    return {"enabled": config.RATE_LIMIT_ENABLED, **admission.stats()}
+
+
+def payment_tokens(route, x_payment_token: str) -> list:
+    # ราคา route = จำนวน token ที่ต้องแนบมา (คั่นด้วย comma)
     if not x_payment_token:
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
             detail="Missing Payment Token. Please purchase at Bank")
-
-    is_valid, message = await verify_payment_token(x_payment_token)
-    if not is_valid:
+    tokens = [token.strip() for token in x_payment_token.split(",")] if route.price > 1 else [x_payment_token]
+    if len(tokens) != route.price or len(set(tokens)) != len(tokens):
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
-            detail=f"Payment Failed: {message}")
+            detail=f"Payment Failed: this route costs {route.price} distinct tokens")
+    return tokens
 
-    async with httpx.AsyncClient() as client:
-        try:
-            backend_response = await client.get(
-                f"{BACKEND_API_URL}/expensive-data", timeout=10.0)
-            return backend_response.json()
-        except httpx.RequestError:
-            raise HTTPException(status_code=503, detail="Backend Service Unavailable")
\ No newline at end of file
+
+async def spend_payment_tokens(tokens: list) -> list:
+    # route ที่ราคาหลาย token: ตัดยอดทุกใบหรือไม่ตัดเลย (token ที่ผ่านต้องไม่ถูกใช้ไปถ้า request ล้ม)
+    # ตรวจที่ Gateway ก่อนโดยไม่ตัดยอด แล้วส่ง /verify/batch แบบ atomic ครั้งเดียว (ไม่ผ่าน offline verify / micro-batching)
+    reserved = []
+    for token in tokens:
+        outcome = precheck_payment_token(token)
+        if outcome is None and offline_verifier.enabled and is_signed_token(token):
+            outcome = offline_verifier.reserve(token)
+            if outcome is True:
+                reserved.append(token)
+                outcome = None
+        if outcome is not None:
+            for held in reserved:
+                offline_verifier.release(held)
+            return [outcome]
+
+    try:
+        response = await bank.post("/verify/batch", json={"token_ids": tokens, "atomic": True})
+        if response.status_code != 200:
+            return [(False, "Bank Connection Error")]
+        results = response.json()["results"]
+    except UpstreamUnavailable:
+        # ยังไม่ได้ส่งคำขอ (breaker เปิด / คิวเต็ม)
+        for token in reserved:
+            offline_verifier.release(token)
+        raise
+    except httpx.TimeoutException:
+        return [(False, "Bank Timeout")]
+    except httpx.RequestError:
+        return [(False, "Bank Unreachable")]
+
+    # ไม่รู้ผล (timeout/Bank ล่ม): token ที่ reserve ไว้คงเป็นใช้แล้ว / Bank ตอบว่าไม่ได้ตัดยอด: คืนให้ใช้ได้อีก
+    outcomes = [(result.get("valid"), result.get("message")) for result in results]
+    if not all(is_valid for is_valid, _ in outcomes):
+        for token in reserved:
+            offline_verifier.release(token)
+    rejected = [(token, message) for token, (is_valid, message) in zip(tokens, outcomes)
+                if not is_valid and message != NOT_CHARGED]
+    if config.NEGATIVE_CACHE_ENABLED:
+        for token, message in rejected:
+            negative_cache.add(token, message)
+    # แสดงสาเหตุจริงก่อน (ใบที่ไม่ได้ตัดยอดเพราะใบอื่นไม่ผ่านไว้ท้าย)
+    return [(False, message) for _, message in rejected] + outcomes
+
+
+async def charge(tokens: list):
+    try:
+        with metrics.stage("verify"):
+            outcomes = [await verify_payment_token(tokens[0])] if len(tokens) == 1 else await spend_payment_tokens(tokens)
+    except UpstreamUnavailable as error:
+        raise upstream_unavailable(error)
+    for is_valid, message in outcomes:
+        if not is_valid:
+            raise HTTPException(
+                status_code=status.HTTP_402_PAYMENT_REQUIRED,
+                detail=f"Payment Failed: {message}")
+
+
+def worth_speculating(tokens: list) -> bool:
+    # speculate เฉพาะ token ที่มีโอกาสจ่ายผ่าน: token ขยะ/ที่ Bank เคยปฏิเสธ ไม่ได้ทำให้ upstream ต้องทำงานเพิ่ม
+    if not config.SPECULATIVE_FETCH_ENABLED:
+        return False
+    if config.TOKEN_PREVALIDATE and not all(is_well_formed_token(token) for token in tokens):
+        return False
+    return not (config.NEGATIVE_CACHE_ENABLED and any(token in negative_cache for token in tokens))
+
+
+async def close_response(response: httpx.Response):
+    await response.aclose()
+
+
+async def proxy_route(route, request: Request, x_payment_token: str):
+    tokens = payment_tokens(route, x_payment_token) if route.price > 0 else []
+
+    _, path = route_table.match(request.url.path)
+    if request.url.query:
+        path = f"{path}?{request.url.query}"
+    upstream = ROUTE_UPSTREAMS[route.prefix]
+    cache_ttl = route.cache_ttl if route.cache_ttl is not None else config.CACHE_ROUTE_TTLS.get(path.split("?")[0])
+    client_ip = request.client.host if request.client else "unknown"
+    headers = forward_request_headers(request.headers.raw, client_ip, identity=cache_ttl is not None)
+
+    async def fetch():
+        with metrics.stage("backend"):
+            if cache_ttl is not None:
+                return await response_cache.get_or_fetch(
+                    f"{upstream.base_url}{path}", cache_ttl, lambda: fetch_buffered(upstream, path, headers, route.timeout))
+            return await upstream.stream("GET", path, headers=headers, read_timeout=route.timeout)
+
+    try:
+        if not tokens:
+            result = await fetch()
+        elif worth_speculating(tokens):
+            # ผลจาก upstream ถูกส่งให้ client ก็ต่อเมื่อ charge ผ่านแล้วเท่านั้น
+            result = await speculator.run(lambda: charge(tokens), fetch,
+                                          discard=close_response if cache_ttl is None else None)
+        else:
+            await charge(tokens)
+            result = await fetch()
+    except UpstreamUnavailable as error:
+        raise upstream_unavailable(error)
+    except httpx.RequestError:
+        raise HTTPException(status_code=503, detail="Backend Service Unavailable")
+
+    if cache_ttl is not None:
+        response = Response(content=result.content, status_code=result.status_code)
+        # cache เก็บ header ตามที่ upstream ส่งมา (key เป็น URL ของ upstream ใช้ร่วมกันได้หลาย route) แปลง Location ตอนตอบ
+        response.raw_headers.extend(header for header in rewrite_location_headers(result.headers, route)
+                                    if header[0] != b"content-length")
+        return response
+    return RelayResponse(result, route)
+
+
+def make_route_endpoint(route):
+    async def proxy(request: Request, x_payment_token: str = Header(None, alias="X-Payment-Token")):
+        return await proxy_route(route, request, x_payment_token)
+    return proxy
+
+
+# ลงทะเบียนหลัง route อื่นทั้งหมด (prefix "/" จะได้ไม่บัง /stats/*)
+for route in route_table.routes:
+    endpoint = make_route_endpoint(route)
+    app.add_api_route(route.prefix, endpoint, methods=["GET"])
+    if route.prefix != "/":
+        app.add_api_route(route.prefix + "/{subpath:path}", endpoint, methods=["GET"], include_in_schema=False)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=config.GATEWAY_HOST, port=config.GATEWAY_PORT)
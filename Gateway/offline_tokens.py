@@ -0,0 +1,284 @@
+# ตรวจสอบ signed payment token ที่ Gateway เอง (ไม่ต้องถาม Bank บน hot path)
+# รูปแบบ token ต้องตรงกับ Bank/token_signing.py: v1.<user_id>.<price_satang>.<serial>.<expires_at>.<signature>
+#
+# - ลายเซ็น HMAC-SHA256 ตรวจได้ด้วย secret ที่แชร์กับ Bank
+# - token ที่ใช้แล้วเก็บเป็น bitmap แยกตาม block ของ serial (1 bit ต่อ token)
+# - token ที่ใช้แล้วบันทึกลง journal (spend_log.py, fsync เป็น batch) ก่อนตอบผ่าน แล้วส่งกลับไปให้ Bank ตัดยอด (settle)
+#   แบบ async ผ่าน /verify/batch ทีละ segment ของ journal settle เสร็จแล้วลบ segment ทิ้ง
+# - token ที่ serial ต่ำกว่า watermark ตอน startup อาจถูกใช้ไปแล้วก่อน Gateway restart
+#   จึงส่งไป verify ที่ Bank ตามปกติ (caller ได้ None กลับไป) segment ที่ค้างจากรอบก่อนจึงต้อง settle ให้หมดก่อนขอ watermark
+# - route ที่ราคาหลาย token ตัดยอดที่ Bank ทีเดียวทุกใบ (reserve/release) offline verify ใช้กับ token ใบเดียวเท่านั้น
+# - ใช้ได้กับ Gateway process เดียว (journal ถือ lock): uvicorn --workers N ที่เปิด offline verify worker ที่สองจะล้มตอน startup
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import time
+import httpx
+from circuit_breaker import UpstreamUnavailable
+from spend_log import SpendLog, SpendLogError, format_record, read_segment
+from upstream import Upstream
+
+SIGNED_TOKEN_PREFIX = "v1"
+SIGNATURE_BYTES = 16
+
+
+def is_signed_token(token: str) -> bool:
+    return token.startswith(SIGNED_TOKEN_PREFIX + ".")
+
+
+def parse_signed_token(secret: str, token: str):
+    # คืนค่า (user_id, price_satang, serial, expires_at) หรือ None ถ้ารูปแบบ/ลายเซ็นไม่ถูกต้อง
+    payload, _, signature = token.rpartition(".")
+    parts = payload.split(".")
+    if len(parts) != 5 or parts[0] != SIGNED_TOKEN_PREFIX:
+        return None
+
+    digest = hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES]
+    expected = base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+    if not hmac.compare_digest(expected, signature):
+        return None
+
+    try:
+        return tuple(int(part) for part in parts[1:])
+    except ValueError:
+        return None
+
+
+class SpentTokenSet:
+    # bitmap ต่อหนึ่ง block ของ serial; block ที่ token ทุกใบหมดอายุแล้วจะถูกลบทิ้ง
+    def __init__(self, block_size: int):
+        self.block_size = block_size
+        self._blocks = {}   # block index -> [bytearray, expires_at สูงสุดใน block]
+        self.marked = 0
+
+    def mark(self, serial: int, expires_at: int) -> bool:
+        # คืน True ถ้าเพิ่ง mark ครั้งแรก, False ถ้าเคยถูกใช้แล้ว
+        index, slot = divmod(serial, self.block_size)
+        block = self._blocks.get(index)
+        if block is None:
+            block = self._blocks[index] = [bytearray((self.block_size + 7) // 8), expires_at]
+
+        bits = block[0]
+        byte, mask = slot >> 3, 1 << (slot & 7)
+        if bits[byte] & mask:
+            return False
+        bits[byte] |= mask
+        block[1] = max(block[1], expires_at)
+        self.marked += 1
+        return True
+
+    def unmark(self, serial: int):
+        index, slot = divmod(serial, self.block_size)
+        block = self._blocks.get(index)
+        if block is not None and block[0][slot >> 3] & (1 << (slot & 7)):
+            block[0][slot >> 3] &= ~(1 << (slot & 7))
+            self.marked -= 1
+
+    def prune(self, now: float) -> int:
+        expired = [index for index, (_, expires_at) in self._blocks.items() if expires_at < now]
+        for index in expired:
+            del self._blocks[index]
+        return len(expired)
+
+    def stats(self) -> dict:
+        return {
+            "block_size": self.block_size,
+            "blocks": len(self._blocks),
+            "bytes": sum(len(bits) for bits, _ in self._blocks.values()),
+            "marked": self.marked,
+        }
+
+
+class OfflineTokenVerifier:
+    def __init__(self, bank: Upstream, secret: str, block_size: int, settle_batch_size: int, settle_interval_ms: float,
+                 journal: SpendLog, journal_timeout: float, max_pending: int):
+        self.bank = bank
+        self.secret = secret
+        self.spent = SpentTokenSet(block_size)
+        self.settle_batch_size = settle_batch_size
+        self.settle_interval = settle_interval_ms / 1000
+        self.journal = journal
+        self.journal_timeout = journal_timeout
+        self.max_pending = max_pending
+        self.watermark = None   # serial ตัวถัดไปของ Bank ตอน Gateway เริ่มทำงาน
+
+        self.pending = 0            # token ที่ลง journal แล้วแต่ยังไม่ได้ settle
+        self._settled_upto = {}     # segment -> จำนวน token ต้น segment ที่ settle แล้ว (Bank ล่มกลาง segment)
+        self._leftover = []
+        self._tasks = []
+
+        self.verified_offline = 0
+        self.deferred_to_bank = 0
+        self.reserved_for_bank = 0
+        self.overflow_to_bank = 0
+        self.journal_failures = 0
+        self.settled = 0
+        self.settle_conflicts = 0
+        self.settle_failures = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.secret)
+
+    async def start(self):
+        if self.enabled:
+            # ถือ lock ของ journal ก่อน: Gateway process อื่น (เช่น worker ของ uvicorn --workers) ล้มตั้งแต่ startup
+            #   (spent set กับ watermark แยกกันต่อ process = token เดียวผ่าน offline ได้หลายครั้ง)
+            self.journal.acquire()
+            self._leftover = self.journal.segments()
+            self.journal.start()
+            self._tasks = [asyncio.create_task(self._run())]
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.enabled:
+            # เขียนที่ค้างให้หมด แล้ว settle ให้มากที่สุดก่อนปิด (ที่เหลืออยู่ในดิสก์ settle ตอน startup รอบหน้า)
+            await asyncio.to_thread(self.journal.stop)
+            await self._settle_segments(self.journal.segments())
+
+    async def verify(self, token: str):
+        # คืน (valid, message) หรือ None ถ้าต้องส่งไป verify ที่ Bank
+        parsed = parse_signed_token(self.secret, token)
+        if parsed is None:
+            return False, "Invalid token signature"
+        user_id, _, serial, expires_at = parsed
+
+        now = time.time()
+        if expires_at < now:
+            return False, "Token expired"
+        if self.watermark is None or serial < self.watermark:
+            self.deferred_to_bank += 1
+            return None
+        if not self.spent.mark(serial, expires_at):
+            return False, "Token already used"
+
+        # token ถูก mark แล้วทั้งสองทางด้านล่าง: ถ้าให้ Bank ตัดยอดแทน ใช้ซ้ำที่ Gateway ไม่ได้อีก
+        if self.pending >= self.max_pending:
+            # settle ไม่ทัน (เช่น Bank ล่มนาน): ไม่เพิ่ม journal อีก ให้ Bank verify เอง
+            self.overflow_to_bank += 1
+            return None
+        self.pending += 1
+        future = self.journal.submit([format_record(token, user_id, now)])
+        try:
+            # ตอบผ่านหลัง fsync เท่านั้น: Gateway ดับก่อน settle ก็ยัง settle จาก journal ได้ตอน startup
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.journal_timeout)
+        except (SpendLogError, TimeoutError) as e:
+            # ไม่รู้ว่าลงดิสก์หรือยัง: ให้ Bank ตัดยอด (ถ้าลงแล้ว settle ทีหลังได้ conflict ไม่ได้จ่ายซ้ำ)
+            self.journal_failures += 1
+            if isinstance(e, SpendLogError) and not e.written:
+                self.pending -= 1
+            return None
+
+        self.verified_offline += 1
+        return True, None
+
+    def reserve(self, token: str):
+        # route ที่ราคาหลาย token ให้ Bank ตัดยอดทุกใบในคำขอเดียว (all-or-nothing) ไม่ตัดยอดที่ Gateway
+        # ตรวจลายเซ็น/อายุแบบ verify แล้ว mark token ที่ serial >= watermark ไว้ก่อนส่ง (ใช้ offline ซ้ำไม่ได้)
+        # คืน (False, message) ถ้าไม่ผ่าน / True ถ้า mark แล้ว (Bank ไม่ตัดยอดต้อง release) / None ถ้าไม่ต้อง mark
+        parsed = parse_signed_token(self.secret, token)
+        if parsed is None:
+            return False, "Invalid token signature"
+        _, _, serial, expires_at = parsed
+        if expires_at < time.time():
+            return False, "Token expired"
+        if self.watermark is None or serial < self.watermark:
+            return None
+        if not self.spent.mark(serial, expires_at):
+            return False, "Token already used"
+        self.reserved_for_bank += 1
+        return True
+
+    def release(self, token: str):
+        # Bank ตอบว่าไม่ได้ตัดยอด token ที่ reserve ไว้ (ใบอื่นในคำขอไม่ผ่าน): ใช้ได้อีกครั้ง
+        _, _, serial, _ = parse_signed_token(self.secret, token)
+        self.spent.unmark(serial)
+        self.reserved_for_bank -= 1
+
+    async def _run(self):
+        # segment ที่ค้างจากรอบก่อน (Gateway ดับก่อน settle) ต้องถึง Bank ก่อนขอ watermark:
+        #   serial ของ token พวกนี้ต่ำกว่า watermark ใหม่ จะถูกส่งไป verify ที่ Bank ซึ่งต้องเห็นว่าใช้แล้ว
+        while not await self._settle_segments(self._leftover):
+            await asyncio.sleep(1)
+        await self._fetch_watermark()
+
+        last_prune = time.time()
+        while True:
+            await asyncio.sleep(self.settle_interval)
+            segments = await asyncio.to_thread(self.journal.rotate)
+            if not await self._settle_segments(segments):
+                await asyncio.sleep(1)  # Bank มีปัญหา: รอแล้วค่อยลองใหม่ (segment ยังอยู่ในดิสก์)
+            if time.time() - last_prune > 60:
+                self.spent.prune(time.time())
+                last_prune = time.time()
+
+    async def _fetch_watermark(self):
+        # ลองจนกว่าจะได้ ระหว่างนี้ signed token ทุกใบจะ verify ผ่าน Bank ตามปกติ
+        delay = 0.5
+        while self.watermark is None:
+            try:
+                response = await self.bank.get("/tokens/serial-watermark")
+                if response.status_code == 200:
+                    self.watermark = response.json()["next_serial"]
+                    return
+            except (httpx.HTTPError, ValueError, KeyError):
+                pass
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10)
+
+    async def _settle_segments(self, segments) -> bool:
+        # ส่ง token ใน segment ที่ปิดแล้วไปตัดยอดที่ Bank ทีละ batch แล้วลบไฟล์ คืน False ถ้า Bank มีปัญหา
+        for path in segments:
+            tokens = [token for token, _, _ in await asyncio.to_thread(lambda: list(read_segment(path)))]
+            done = self._settled_upto.get(path, 0)
+            while done < len(tokens):
+                batch = tokens[done:done + self.settle_batch_size]
+                if not await self._settle_batch(batch):
+                    self._settled_upto[path] = done
+                    return False
+                done += len(batch)
+            await asyncio.to_thread(self.journal.remove, path)
+            self._settled_upto.pop(path, None)
+            self.pending = max(0, self.pending - len(tokens))
+        return True
+
+    async def _settle_batch(self, batch) -> bool:
+        try:
+            response = await self.bank.post("/verify/batch", json={"token_ids": batch})
+            response.raise_for_status()
+            results = response.json()["results"]
+        except (httpx.HTTPError, UpstreamUnavailable, ValueError, KeyError):
+            # batch นี้ยังอยู่ใน journal ไว้ลองใหม่รอบหน้า
+            self.settle_failures += 1
+            return False
+
+        for result in results:
+            if result.get("valid"):
+                self.settled += 1
+            else:
+                # token ถูกใช้ผ่านทางอื่นไปแล้ว (double spend) หรือ Bank ไม่รู้จัก
+                self.settle_conflicts += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "watermark": self.watermark,
+            "verified_offline": self.verified_offline,
+            "deferred_to_bank": self.deferred_to_bank,
+            "reserved_for_bank": self.reserved_for_bank,
+            "settle_pending": self.pending,
+            "settle_max_pending": self.max_pending,
+            "overflow_to_bank": self.overflow_to_bank,
+            "journal_failures": self.journal_failures,
+            "journal": self.journal.stats(),
+            "settled": self.settled,
+            "settle_conflicts": self.settle_conflicts,
+            "settle_failures": self.settle_failures,
+            "spent_set": self.spent.stats(),
+        }
@@ -0,0 +1,115 @@
+# Admission control - token bucket ต่อ client IP และต่อหน่วยที่ออก payment token (ผู้ใช้ / book / token)
+# ตรวจใน middleware ก่อนเรียก Bank/Backend: request ที่เกิน limit ได้ 429 ทันทีโดยไม่มี I/O ไปที่ upstream
+# state ของแต่ละ limiter เป็น LRU จำกัดจำนวน key (key ที่ถูก evict แล้วกลับมาใหม่จะเริ่มจาก bucket เต็ม)
+
+import time
+from collections import OrderedDict, namedtuple
+
+# ip_rate/token_rate = request ต่อวินาที, burst = จำนวนที่ยิงติดกันได้ (rate 0 = ไม่จำกัดด้านนั้น)
+RouteLimits = namedtuple("RouteLimits", ["ip_rate", "ip_burst", "token_rate", "token_burst"])
+
+
+def parse_route_limits(spec: str) -> dict:
+    # "path=ip_rate:ip_burst:token_rate:token_burst,path=..." -> {path: RouteLimits}
+    routes = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        path, limits = item.split("=")
+        routes[path.strip()] = RouteLimits(*(float(value) for value in limits.split(":")))
+    return routes
+
+
+def token_limit_key(token: str) -> str:
+    # หน่วยที่ออก token (ดู Bank/token_signing.py) ไม่ใช่ตัวอักษร n ตัวแรกที่อาจชนกันข้ามผู้ใช้/book
+    #   signed v1.<user_id>.<price>.<serial>.<expires_at>.<sig> -> ผู้ใช้, book tb.<book_id>.<slot>.<sig> -> book
+    #   uuid / รูปแบบอื่น -> token นั้นเอง (ไม่มีข้อมูลว่าใครซื้อ)
+    # route ที่ราคาหลาย token (คั่นด้วย comma) ใช้ใบแรก
+    token = token.split(",", 1)[0].strip()
+    parts = token.split(".")
+    if parts[0] == "v1" and len(parts) == 6 and parts[1].isdigit():
+        return "user:" + parts[1]
+    if parts[0] == "tb" and len(parts) == 4 and parts[1].isdigit():
+        return "book:" + parts[1]
+    return token
+
+
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()   # key -> [tokens, updated_at]
+        self.evictions = 0
+
+    def acquire(self, key: str, now: float) -> float:
+        # คืน 0 ถ้าผ่าน ไม่งั้นคืนจำนวนวินาทีที่ต้องรอจนกว่าจะมี token ใหม่
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class AdmissionController:
+    def __init__(self, routes: dict, max_keys: int):
+        self._limiters = {}     # path -> (ip limiter | None, token limiter | None)
+        for path, limits in routes.items():
+            self._limiters[path] = (
+                TokenBucketLimiter(limits.ip_rate, limits.ip_burst, max_keys) if limits.ip_rate > 0 else None,
+                TokenBucketLimiter(limits.token_rate, limits.token_burst, max_keys) if limits.token_rate > 0 else None,
+            )
+        self.routes = routes
+
+        self.admitted = 0
+        self.rejected_ip = 0
+        self.rejected_token = 0
+
+    def check(self, path: str, client_ip: str, token: str = None):
+        # คืน None ถ้ารับ request ได้ ไม่งั้นคืน (เหตุผล, retry_after วินาที)
+        limiters = self._limiters.get(path)
+        if limiters is None:
+            return None
+        ip_limiter, token_limiter = limiters
+        now = time.monotonic()
+
+        if ip_limiter is not None:
+            wait = ip_limiter.acquire(client_ip, now)
+            if wait:
+                self.rejected_ip += 1
+                return "Too many requests from this client", wait
+        if token_limiter is not None and token:
+            # จำกัดตามผู้ใช้/book ที่ออก token: กันการยิงด้วย token ชุดเดียวกันจากหลาย IP ได้ โดยไม่กระทบผู้ใช้อื่น
+            wait = token_limiter.acquire(token_limit_key(token), now)
+            if wait:
+                self.rejected_token += 1
+                return "Too many requests for this payment token", wait
+        self.admitted += 1
+        return None
+
+    def stats(self) -> dict:
+        rejected = self.rejected_ip + self.rejected_token
+        return {
+            "routes": {path: limits._asdict() for path, limits in self.routes.items()},
+            "admitted": self.admitted,
+            "rejected": rejected,
+            "rejected_ip": self.rejected_ip,
+            "rejected_token": self.rejected_token,
+            "rejected_ratio": rejected / (self.admitted + rejected) if self.admitted + rejected else 0.0,
+            "tracked_keys": {path: {"ip": len(ip) if ip else 0, "token": len(token) if token else 0}
+                             for path, (ip, token) in self._limiters.items()},
+            "evictions": sum(limiter.evictions for pair in self._limiters.values() for limiter in pair if limiter),
+        }
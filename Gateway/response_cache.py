@@ -0,0 +1,87 @@
+# Response cache สำหรับ backend route + single-flight (รวม cache miss ที่ key เดียวกันเป็น request เดียว)
+# เก็บเฉพาะผลลัพธ์จาก backend เท่านั้น การจ่ายเงินยังต้อง verify ทุก request เหมือนเดิม
+
+import asyncio
+import time
+from collections import OrderedDict, namedtuple
+
+# headers = [(name, value)] แบบ bytes ตามที่ upstream ส่งมา (ตัด hop-by-hop แล้ว)
+CachedResponse = namedtuple("CachedResponse", ["status_code", "content", "headers"])
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (expires_at, CachedResponse)
+        self._in_flight = {}            # key -> asyncio.Task ที่กำลังดึงจาก backend
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    async def get_or_fetch(self, key: str, ttl: float, fetch) -> CachedResponse:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._remove(key)
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            # มีคนกำลังดึง key นี้อยู่แล้ว: รอผลเดียวกัน ไม่ยิง backend ซ้ำ
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch_and_store(key, ttl, fetch))
+            self._in_flight[key] = task
+        # shield: ถ้า client คนแรกตัดการเชื่อมต่อ คนที่รออยู่ยังได้ผลลัพธ์
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, key: str, ttl: float, fetch) -> CachedResponse:
+        try:
+            response = await fetch()
+            if ttl > 0 and response.status_code == 200:
+                self._store(key, time.monotonic() + ttl, response)
+            return response
+        finally:
+            del self._in_flight[key]
+
+    def _store(self, key: str, expires_at: float, response: CachedResponse):
+        size = len(response.content)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, response)
+        self._bytes += size
+
+        # LRU eviction จนกว่าจะอยู่ในขอบเขตหน่วยความจำ
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, response = self._entries.pop(key)
+        self._bytes -= len(response.content)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            # backend call ที่ประหยัดได้ = hit + coalesced
+            "backend_calls_saved": self.hits + self.coalesced,
+            "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+        }
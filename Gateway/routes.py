@@ -0,0 +1,98 @@
+# Route table ของ Gateway: path prefix -> upstream URL + ราคา (จำนวน token) + timeout + cache
+# request ที่ตรงกับ prefix ถูกส่งต่อไปที่ upstream (ต่อท้ายส่วนของ path ที่เหลือหลัง prefix และ query string)
+# แล้วส่ง response กลับเป็น bytes ตามที่ upstream ส่งมา (status + header เดิม ไม่ parse/serialize ใหม่)
+
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+# price = จำนวน token ต่อ request (0 = ไม่ต้องจ่าย), timeout = read timeout สูงสุด (None = ตาม upstream)
+# cache_ttl = None: stream body ตรงไปหา client ไม่ buffer / ตัวเลข: buffer แล้วเก็บใน response cache (0 = ไม่ cache แต่รวม request ซ้ำ)
+Route = namedtuple("Route", ["prefix", "base_url", "upstream_path", "price", "timeout", "cache_ttl"])
+
+# header ที่ใช้เฉพาะ connection ระหว่างสองฝั่ง ห้ามส่งต่อ (RFC 9110 7.6.1) + header ที่ uvicorn ใส่เอง
+HOP_BY_HOP_HEADERS = frozenset({
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "proxy-connection",
+    "te", "trailer", "trailers", "transfer-encoding", "upgrade", "server", "date",
+})
+
+# header จาก upstream ที่ไม่ส่งต่อ/ไม่เก็บใน cache: Server-Timing ของ Gateway ใส่โดย MetricsMiddleware เท่านั้น
+# (ไม่งั้น client เห็น total สองตัว และ cache hit ได้เวลา burn เก่าของ backend ทั้งที่ backend ไม่ได้ทำงาน)
+UPSTREAM_ONLY_RESPONSE_HEADERS = frozenset({"server-timing"})
+
+
+def parse_routes(spec: str) -> list:
+    # "prefix=URL|price|timeout|cache_ttl,..." (ช่องหลัง URL ว่างได้: price 1, timeout/cache ตาม default)
+    routes = []
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        prefix, target = item.split("=", 1)
+        fields = [field.strip() for field in target.split("|")] + [""] * 3
+        url = urlsplit(fields[0])
+        routes.append(Route(
+            prefix=prefix.strip().rstrip("/") or "/",
+            base_url=f"{url.scheme}://{url.netloc}",
+            upstream_path=url.path.rstrip("/"),
+            price=int(fields[1]) if fields[1] else 1,
+            timeout=float(fields[2]) if fields[2] else None,
+            cache_ttl=float(fields[3]) if fields[3] else None,
+        ))
+    return routes
+
+
+class RouteTable:
+    def __init__(self, routes: list):
+        # prefix ยาวกว่าได้ก่อน (/files/big ก่อน /files)
+        self.routes = sorted(routes, key=lambda route: len(route.prefix), reverse=True)
+
+    def match(self, path: str):
+        # คืน (route, path ที่ upstream) หรือ None; /files ตรงกับ /files และ /files/... แต่ไม่ตรงกับ /filesystem
+        for route in self.routes:
+            if route.prefix == "/":
+                return route, route.upstream_path + path
+            if path == route.prefix or path.startswith(route.prefix + "/"):
+                # /files/ (subpath ว่าง) = /files: ไม่ให้ upstream ตอบ redirect ไป path ที่ไม่มี slash หลังจ่ายเงินไปแล้ว
+                rest = path[len(route.prefix):]
+                return route, route.upstream_path + (rest if rest != "/" else "") or "/"
+        return None
+
+
+def forward_request_headers(raw_headers, client_ip: str, identity: bool) -> list:
+    # header จาก client ที่ส่งต่อให้ upstream (ตัด hop-by-hop, Host, token การจ่ายเงิน)
+    # Accept-Encoding ต้องระบุเสมอ ไม่งั้น httpx ใส่ gzip ให้เอง แล้ว client ที่ไม่ได้ขอจะได้ body ที่บีบอัดไป
+    # identity=True: ขอ body แบบไม่บีบอัดเสมอ (body ที่ cache ไว้ต้องใช้ได้กับทุก client)
+    skip = HOP_BY_HOP_HEADERS | {"host", "content-length", "x-payment-token", "x-forwarded-for"}
+    if identity:
+        skip = skip | {"accept-encoding"}
+    headers = [(name, value) for name, value in raw_headers if name.decode("latin-1").lower() not in skip]
+    if not any(name.lower() == b"accept-encoding" for name, _ in headers):
+        headers.append((b"accept-encoding", b"identity"))
+    headers.append((b"x-forwarded-for", client_ip.encode("latin-1")))
+    return headers
+
+
+def passthrough_response_headers(raw_headers) -> list:
+    # header จาก upstream ที่ส่งกลับให้ client (ชื่อ header เป็นตัวเล็กตามที่ ASGI กำหนด)
+    skip = HOP_BY_HOP_HEADERS | UPSTREAM_ONLY_RESPONSE_HEADERS
+    return [(name.lower(), value) for name, value in raw_headers if name.decode("latin-1").lower() not in skip]
+
+
+def rewrite_location_headers(headers: list, route) -> list:
+    # Location ที่ชี้ไปที่ upstream (absolute หรือ path ใต้ upstream_path) แปลงเป็น path ของ Gateway ใต้ prefix ของ route
+    # Location ที่ชี้ไป host ของ upstream แต่อยู่นอก upstream_path ตัดทิ้ง (ไม่ให้ address ภายในหลุดไปถึง client)
+    prefix = route.prefix.rstrip("/")
+    rewritten = []
+    for name, value in headers:
+        if name == b"location":
+            location = value.decode("latin-1")
+            if location.startswith(route.base_url + "/") or location == route.base_url:
+                location = location[len(route.base_url):] or "/"
+            elif not location.startswith("/") or location.startswith("//"):
+                rewritten.append((name, value))     # ไปที่อื่น ไม่เกี่ยวกับ upstream
+                continue
+            if location != route.upstream_path and not location.startswith(route.upstream_path + "/") \
+                    and not location.startswith(route.upstream_path + "?"):
+                continue
+            value = (prefix + location[len(route.upstream_path):] or "/").encode("latin-1")
+        rewritten.append((name, value))
+    return rewritten
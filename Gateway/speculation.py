@@ -0,0 +1,93 @@
+# Speculative fetch: เริ่มดึงข้อมูลจาก upstream พร้อมกับ verify การจ่ายเงิน แทนที่จะรอ verify เสร็จก่อน
+# latency = max(verify, fetch) แทน verify + fetch ผลลัพธ์จะถูกส่งให้ client ก็ต่อเมื่อจ่ายเงินผ่านแล้วเท่านั้น
+# ถ้า verify ไม่ผ่าน: fetch ที่ยังไม่เสร็จถูก cancel, ที่เสร็จแล้วถูกทิ้ง (discard เช่นปิด stream)
+# เพดาน max_in_flight กัน flood ของ token ปลอมไม่ให้กลายเป็นการขยายโหลดไปที่ upstream (เกินเพดาน = ทำแบบเดิมทีละขั้น)
+
+import asyncio
+import time
+import metrics
+
+SPECULATIVE_FETCHES = metrics.counter("gateway_speculative_fetches_total",
+                                      "Speculative upstream fetches by outcome (used, wasted, skipped)", ("outcome",))
+SPECULATIVE_SAVED = metrics.histogram("gateway_speculative_saved_seconds",
+                                      "Latency saved by overlapping payment verification with the upstream fetch")
+SPECULATIVE_WASTED = metrics.histogram("gateway_speculative_wasted_seconds",
+                                       "Upstream time spent on speculative fetches whose payment failed")
+
+
+class SpeculativeFetcher:
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+
+        self.used = 0
+        self.wasted = 0         # verify ไม่ผ่าน (cancel + discard)
+        self.cancelled = 0      # ในจำนวน wasted: cancel ได้ก่อน upstream ตอบ
+        self.skipped = 0        # เต็มเพดาน ทำแบบไม่ speculate
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    async def run(self, verify, fetch, discard=None):
+        # verify(): raise เมื่อจ่ายเงินไม่ผ่าน / fetch(): ดึงจาก upstream / discard(result): ปล่อยผลที่ไม่ได้ใช้
+        if self.in_flight >= self.max_in_flight:
+            self.skipped += 1
+            SPECULATIVE_FETCHES.inc("skipped")
+            await verify()
+            return await fetch()
+
+        self.in_flight += 1
+        task = asyncio.ensure_future(self._timed(fetch))
+        task.add_done_callback(self._finished)
+        start = time.perf_counter()
+        try:
+            await verify()
+        except BaseException:
+            await self._abandon(task, discard, time.perf_counter() - start)
+            raise
+        verify_seconds = time.perf_counter() - start
+
+        result, fetch_seconds = await task
+        # เวลาที่ซ้อนกันได้ = ส่วนที่สั้นกว่าระหว่าง verify กับ fetch
+        saved = min(verify_seconds, fetch_seconds)
+        self.used += 1
+        self.saved_seconds += saved
+        SPECULATIVE_FETCHES.inc("used")
+        SPECULATIVE_SAVED.observe(saved)
+        return result
+
+    async def _timed(self, fetch):
+        start = time.perf_counter()
+        result = await fetch()
+        return result, time.perf_counter() - start
+
+    def _finished(self, task):
+        self.in_flight -= 1
+
+    async def _abandon(self, task, discard, elapsed: float):
+        self.wasted += 1
+        SPECULATIVE_FETCHES.inc("wasted")
+        if not task.done():
+            self.cancelled += 1
+            task.cancel()
+            wasted_seconds = elapsed
+        elif task.cancelled() or task.exception() is not None:
+            wasted_seconds = elapsed
+        else:
+            result, wasted_seconds = task.result()
+            if discard is not None:
+                await discard(result)
+        self.wasted_seconds += wasted_seconds
+        SPECULATIVE_WASTED.observe(wasted_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "used": self.used,
+            "wasted": self.wasted,
+            "cancelled": self.cancelled,
+            "skipped": self.skipped,
+            "saved_seconds_total": self.saved_seconds,
+            "wasted_seconds_total": self.wasted_seconds,
+            "avg_saved_ms": self.saved_seconds / self.used * 1000 if self.used else 0.0,
+        }
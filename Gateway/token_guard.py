@@ -0,0 +1,78 @@
+# ด่านหน้าของการ verify token: ตัด token ที่ไม่มีทางถูกต้องออกก่อนถึง Bank
+# 1) ตรวจรูปแบบ token ในเครื่อง (uuid4 / signed token / token book ID ตามที่ Bank ออกให้)
+# 2) negative cache: token ที่ Bank ตอบแล้วว่า "ไม่พบ" หรือ "ใช้ไปแล้ว" จำไว้ช่วงหนึ่ง
+#    ส่ง token เดิมซ้ำ (replay) ได้ 402 ทันทีโดยไม่มี network call (จำกัดจำนวน entry และหมดอายุตาม TTL)
+
+import re
+import time
+from collections import OrderedDict
+
+# รูปแบบต้องตรงกับที่ Bank ออก (crud.apply_purchase, Bank/token_signing.py)
+TOKEN_PATTERNS = re.compile(
+    r"[0-9a-f]{8}-[0-9a-f]{4}-4[0-9a-f]{3}-[89ab][0-9a-f]{3}-[0-9a-f]{12}"   # uuid4
+    r"|v1\.\d+\.\d+\.\d+\.\d+\.[A-Za-z0-9_-]{22}"                           # signed token
+    r"|tb\.\d+\.\d+\.[A-Za-z0-9_-]{22}"                                     # token book ID
+)
+
+# คำตอบจาก Bank ที่เป็นที่สิ้นสุดแล้ว (token นี้จะไม่มีวันใช้ได้อีก) จึง cache ได้
+FINAL_REJECTIONS = ("Token not found", "Token already used")
+
+
+def is_well_formed_token(token: str) -> bool:
+    return len(token) <= 128 and TOKEN_PATTERNS.fullmatch(token) is not None
+
+
+class NegativeTokenCache:
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # token -> (expires_at, message)
+
+        self.malformed = 0
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.evictions = 0
+
+    def get(self, token: str):
+        # คืน message ที่ Bank เคยตอบ หรือ None ถ้าไม่มีใน cache
+        entry = self._entries.get(token)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            del self._entries[token]
+        self.misses += 1
+        return None
+
+    def __contains__(self, token: str) -> bool:
+        # ดูเฉย ๆ ไม่นับ hit/miss (ใช้ตัดสินว่าควร speculate หรือไม่ ก่อน verify จริง)
+        entry = self._entries.get(token)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def add(self, token: str, message: str):
+        if message not in FINAL_REJECTIONS:
+            return
+        self._entries.pop(token, None)
+        self._entries[token] = (time.monotonic() + self.ttl, message)
+        self.inserts += 1
+        # ทุก entry มี TTL เท่ากัน ลำดับใน dict จึงเป็นลำดับหมดอายุ ตัดจากหัว = ทิ้ง entry ที่ใกล้หมดอายุที่สุด
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "malformed_rejected": self.malformed,
+            "hits": self.hits,
+            "misses": self.misses,
+            "inserts": self.inserts,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            # Bank call ที่ประหยัดได้ = token รูปแบบผิด + replay ที่เจอใน cache
+            "bank_calls_saved": self.malformed + self.hits,
+        }
@@ -0,0 +1,158 @@
+# Upstream clients - httpx.AsyncClient แบบ keep-alive หนึ่ง pool ต่อหนึ่ง upstream
+# สร้างครั้งเดียวตอน startup แล้วใช้ซ้ำทุก request (ไม่ต้อง handshake ใหม่ทุกครั้ง)
+# แต่ละ upstream มี circuit breaker, read timeout ที่ปรับตาม p99 และเพดาน in-flight ของตัวเอง (circuit_breaker.py)
+
+import time
+import httpx
+from circuit_breaker import AdaptiveTimeout, CircuitBreaker, UpstreamUnavailable
+import metrics
+
+UPSTREAM_REQUESTS = metrics.counter("gateway_upstream_requests_total", "Upstream calls by outcome", ("upstream", "outcome"))
+UPSTREAM_LATENCY = metrics.histogram("gateway_upstream_duration_seconds", "Upstream call latency by outcome", ("upstream", "outcome"))
+
+
+def outcome_of(status_code: int) -> str:
+    return f"{status_code // 100}xx"
+
+
+class Upstream:
+    def __init__(self, name: str, base_url: str, max_connections: int, max_keepalive: int,
+                 keepalive_expiry: float, timeout: float, connect_timeout: float, pool_timeout: float,
+                 max_in_flight: int = 0, breaker: CircuitBreaker = None, adaptive_timeout: AdaptiveTimeout = None):
+        self.name = name
+        self.base_url = base_url
+        self.limits = httpx.Limits(max_connections=max_connections,
+                                   max_keepalive_connections=max_keepalive,
+                                   keepalive_expiry=keepalive_expiry)
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout, pool=pool_timeout)
+        self._client = None
+        self.max_in_flight = max_in_flight      # 0 = ไม่จำกัด
+        self.breaker = breaker
+        self.adaptive_timeout = adaptive_timeout
+
+        # ตัวนับฝั่งเรา (ใช้ได้แม้ httpcore จะเปลี่ยนโครงสร้างภายใน)
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_errors = 0
+        self.rejected_in_flight = 0
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, limits=self.limits, timeout=self.timeout)
+
+    async def aclose(self):
+        # ปิด connection ที่ค้างอยู่ทั้งหมดตอน shutdown
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            raise RuntimeError(f"Upstream '{self.name}' is not started")
+        return self._client
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        return await self._send(method, path, False, kwargs)
+
+    async def stream(self, method: str, path: str, **kwargs) -> httpx.Response:
+        # เหมือน request() แต่คืน response ทันทีที่ได้ header (ยังไม่อ่าน body) ผู้เรียกต้อง await response.aclose() เสมอ
+        # latency / breaker / in-flight นับถึงตอนได้ header
+        return await self._send(method, path, True, kwargs)
+
+    async def _send(self, method: str, path: str, stream: bool, kwargs: dict) -> httpx.Response:
+        # ตอบ fail fast (ไม่มี I/O) เมื่อ breaker เปิดอยู่ หรือมี request ค้างที่ upstream นี้ครบเพดานแล้ว
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            self.rejected_in_flight += 1
+            UPSTREAM_REQUESTS.inc(self.name, "rejected")
+            raise UpstreamUnavailable(self.name, "too many requests in flight", 1.0)
+        if self.breaker is not None:
+            retry_after = self.breaker.allow()
+            if retry_after:
+                UPSTREAM_REQUESTS.inc(self.name, "circuit_open")
+                raise UpstreamUnavailable(self.name, "circuit open", retry_after)
+
+        # read_timeout = เพดาน timeout ของ request นี้ (เช่น timeout ของ route) ใช้ค่าที่ต่ำกว่าระหว่างนี้กับ adaptive timeout
+        read_timeout = kwargs.pop("read_timeout", None)
+        if "timeout" not in kwargs and (self.adaptive_timeout is not None or read_timeout is not None):
+            current = self.adaptive_timeout.current if self.adaptive_timeout is not None else self.timeout.read
+            if read_timeout is not None:
+                current = min(current, read_timeout)
+            kwargs["timeout"] = httpx.Timeout(current, connect=self.timeout.connect, pool=self.timeout.pool)
+
+        self.in_flight += 1
+        self.total_requests += 1
+        start_time = time.perf_counter()
+        try:
+            response = await self.client.send(self.client.build_request(method, path, **kwargs), stream=stream)
+        except httpx.HTTPError as error:
+            self.total_errors += 1
+            elapsed = time.perf_counter() - start_time
+            outcome = "timeout" if isinstance(error, httpx.TimeoutException) else "error"
+            UPSTREAM_REQUESTS.inc(self.name, outcome)
+            UPSTREAM_LATENCY.observe(elapsed, self.name, outcome)
+            if isinstance(error, httpx.ReadTimeout) and self.adaptive_timeout is not None:
+                self.adaptive_timeout.record(elapsed)
+            if self.breaker is not None:
+                self.breaker.record_failure(type(error).__name__)
+            raise
+        finally:
+            self.in_flight -= 1
+
+        elapsed = time.perf_counter() - start_time
+        outcome = outcome_of(response.status_code)
+        UPSTREAM_REQUESTS.inc(self.name, outcome)
+        UPSTREAM_LATENCY.observe(elapsed, self.name, outcome)
+        if self.adaptive_timeout is not None:
+            self.adaptive_timeout.record(elapsed)
+        if self.breaker is not None:
+            # 5xx = upstream มีปัญหา (4xx เป็นคำตอบปกติ เช่น token ไม่ถูกต้อง)
+            if response.status_code >= 500:
+                self.breaker.record_failure(f"HTTP {response.status_code}")
+            else:
+                self.breaker.record_success()
+        return response
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    def pool_stats(self) -> dict:
+        # อ่านสถานะจาก httpcore connection pool (in-use / idle / waiters)
+        in_use = idle = waiters = 0
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        if pool is not None:
+            for connection in list(getattr(pool, "connections", [])):
+                if connection.is_closed():
+                    continue
+                if connection.is_idle():
+                    idle += 1
+                else:
+                    in_use += 1
+            waiters = sum(1 for r in list(getattr(pool, "_requests", [])) if r.is_queued())
+
+        return {
+            "base_url": self.base_url,
+            "started": self._client is not None,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+            "keepalive_expiry": self.limits.keepalive_expiry,
+            "timeout": self.timeout.read,
+            "in_use": in_use,
+            "idle": idle,
+            "waiters": waiters,
+            "in_flight": self.in_flight,
+            "total_requests": self.total_requests,
+            "total_errors": self.total_errors,
+        }
+
+    def breaker_stats(self) -> dict:
+        return {
+            "breaker": self.breaker.stats() if self.breaker is not None else None,
+            "adaptive_timeout": self.adaptive_timeout.stats() if self.adaptive_timeout is not None else None,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "rejected_in_flight": self.rejected_in_flight,
+        }
@@ -0,0 +1,90 @@
+# Micro-batching สำหรับ verify token
+# รวบ verify_payment_token ที่เข้ามาพร้อมๆ กันเป็น batch เล็กๆ แล้วส่ง /verify/batch ครั้งเดียว
+# ส่งเมื่อ batch เต็ม (max_size) หรือครบเวลา window_ms แล้วแต่อย่างไหนถึงก่อน
+
+import asyncio
+import httpx
+from circuit_breaker import UpstreamUnavailable
+from upstream import Upstream
+
+
+class VerifyBatcher:
+    def __init__(self, bank: Upstream, max_size: int, window_ms: float):
+        self.bank = bank
+        self.max_size = max_size
+        self.window = window_ms / 1000
+        self._pending = []      # [(token, future)]
+        self._timer = None
+        self._in_flight = set()
+
+        self.batches_sent = 0
+        self.tokens_sent = 0
+
+    async def verify(self, token: str):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((token, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._send(batch))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, batch):
+        self.batches_sent += 1
+        self.tokens_sent += len(batch)
+        try:
+            response = await self.bank.post("/verify/batch", json={"token_ids": [token for token, _ in batch]})
+            if response.status_code != 200:
+                outcomes = [(False, "Bank Connection Error")] * len(batch)
+            else:
+                outcomes = [(r.get("valid"), r.get("message")) for r in response.json()["results"]]
+        except UpstreamUnavailable as error:
+            # breaker เปิด / Bank รับไม่ไหว: ไม่ใช่คำตอบว่า token ผิด ส่ง error ต่อให้ caller ตอบ 503
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        except httpx.TimeoutException:
+            outcomes = [(False, "Bank Timeout")] * len(batch)
+        except httpx.RequestError:
+            outcomes = [(False, "Bank Unreachable")] * len(batch)
+        except (ValueError, KeyError):
+            outcomes = [(False, "Bank Connection Error")] * len(batch)
+
+        for (_, future), outcome in zip(batch, outcomes):
+            if not future.done():
+                future.set_result(outcome)
+        # กันกรณี Bank ตอบกลับมาไม่ครบ: ไม่ปล่อยให้ request ไหนค้างรอ
+        for _, future in batch:
+            if not future.done():
+                future.set_result((False, "Bank Connection Error"))
+
+    async def aclose(self):
+        # ส่ง batch ที่ค้างอยู่ให้หมดก่อนปิด upstream
+        self._flush()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "max_size": self.max_size,
+            "window_ms": self.window * 1000,
+            "pending": len(self._pending),
+            "batches_in_flight": len(self._in_flight),
+            "batches_sent": self.batches_sent,
+            "tokens_sent": self.tokens_sent,
+            "avg_batch_size": self.tokens_sent / self.batches_sent if self.batches_sent else 0.0,
+        }
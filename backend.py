@@ -1,25 +1,110 @@
-from fastapi import FastAPI
-import time
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from fastapi import FastAPI, Response
+from fastapi.responses import JSONResponse
+import asyncio
 import math
+import os
+import metrics
 
-app = FastAPI(title="Backend Service", version="1.0.0")
+try:
+    import numpy as np
+except ImportError:  # numpy เป็น optional ใช้เฉพาะ BACKEND_BURN_IMPL=numpy
+    np = None
+
+# --- ค่าที่ปรับได้ (ผ่าน environment) ---
+# thread: sync endpoint รันใน threadpool ของ uvicorn (ติด GIL ใช้ได้ core เดียว)
+# process: async endpoint ส่งงาน CPU ไปรันใน process pool ตามจำนวน core
+EXECUTION_MODE = os.getenv("BACKEND_EXECUTION_MODE", "thread")
+BURN_IMPL = os.getenv("BACKEND_BURN_IMPL", "python")   # python | numpy
+PROCESS_WORKERS = int(os.getenv("BACKEND_PROCESS_WORKERS", str(os.cpu_count() or 1)))
+# งานที่รอ + กำลังรันได้สูงสุด เกินนี้ตอบ 503 ทันทีแทนที่จะให้ latency โตไม่จำกัด
+MAX_QUEUE_DEPTH = int(os.getenv("BACKEND_MAX_QUEUE_DEPTH", str(PROCESS_WORKERS * 4)))
+RETRY_AFTER_SECONDS = int(os.getenv("BACKEND_RETRY_AFTER", "1"))
+# ที่อยู่ที่ bind ตอนรันด้วย python backend.py
+HOST = os.getenv("BACKEND_HOST", "143.198.85.26")
+PORT = int(os.getenv("BACKEND_PORT", "8001"))
+# ----------------------------------------
 
 EXPENSIVE_DATA = {"message": "Welcome to Payment Required Project",
                   "secret_code": "Bitcoin Price is up!",
                   "source": "Backend Service"}
 
+# แก้เลขตรงนี้ตามที่ calibrate ได้
+BURN_ITERATIONS = 50000
+
 def burn_cpu_task():
     val = 0
-    # แก้เลขตรงนี้ตามที่ calibrate ได้
-    for i in range(50000): 
+    for i in range(BURN_ITERATIONS):
         val += math.sqrt(i)
     return val
 
-@app.get("/expensive-data")
-def get_data():
-    _ = burn_cpu_task()
-    return EXPENSIVE_DATA
+def burn_cpu_task_numpy():
+    # ผลเท่ากับ burn_cpu_task แต่คำนวณ sqrt ทั้งก้อนแบบ vectorized
+    return float(np.sqrt(np.arange(BURN_ITERATIONS, dtype=np.float64)).sum())
+
+BURN_TASKS = {"python": burn_cpu_task, "numpy": burn_cpu_task_numpy}
+burn = BURN_TASKS[BURN_IMPL]
+
+process_pool = None
+queue_depth = 0
+rejected = 0
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global process_pool
+    if BURN_IMPL == "numpy" and np is None:
+        raise RuntimeError("BACKEND_BURN_IMPL=numpy requires numpy to be installed")
+    if EXECUTION_MODE == "process":
+        process_pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS)
+    lag_monitor = metrics.start_event_loop_lag_monitor("backend")
+    yield
+    metrics.stop_event_loop_lag_monitor(lag_monitor)
+    if process_pool is not None:
+        process_pool.shutdown(wait=True, cancel_futures=True)
+        process_pool = None
+
+app = FastAPI(title="Backend Service", version="1.0.0", lifespan=lifespan)
+
+# latency ต่อ route + header Server-Timing (stage burn = เวลางาน CPU รวมเวลารอใน process pool)
+app.add_middleware(metrics.MetricsMiddleware, service="backend")
+
+if EXECUTION_MODE == "process":
+    @app.get("/expensive-data")
+    async def get_data():
+        global queue_depth, rejected
+        if queue_depth >= MAX_QUEUE_DEPTH:
+            # backpressure: คิวเต็ม ให้ client ลองใหม่ภายหลัง
+            rejected += 1
+            return JSONResponse(status_code=503,
+                                content={"detail": "Backend busy, please retry"},
+                                headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+        queue_depth += 1
+        try:
+            with metrics.stage("burn"):
+                _ = await asyncio.get_running_loop().run_in_executor(process_pool, burn)
+        finally:
+            queue_depth -= 1
+        return EXPENSIVE_DATA
+else:
+    @app.get("/expensive-data")
+    def get_data():
+        with metrics.stage("burn"):
+            _ = burn()
+        return EXPENSIVE_DATA
+
+@app.get("/metrics")
+def read_metrics():
+    # Prometheus text format
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/stats/execution")
+def execution_stats():
+    # ดูโหมดการรันงาน CPU และความลึกของคิว
+    return {"mode": EXECUTION_MODE, "burn_impl": BURN_IMPL,
+            "process_workers": PROCESS_WORKERS if EXECUTION_MODE == "process" else None,
+            "queue_depth": queue_depth, "max_queue_depth": MAX_QUEUE_DEPTH, "rejected": rejected}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="143.198.85.26", port=8001)
+    uvicorn.run(app, host=HOST, port=PORT)
@@ -0,0 +1,114 @@
+# เปรียบเทียบ Bank แบบ sync (main.py) กับ async (main_async.py) ที่ 100 / 500 / 1000 concurrent clients
+# แต่ละโหมดรัน uvicorn แยก process บนฐานข้อมูลใหม่ (temp dir) แล้วยิง /verify/ + GET /users/{id} สลับกัน
+# วิธีรัน: python benchmarks/bench_bank_sync_vs_async.py [วินาทีต่อระดับ]
+
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import deque
+
+import httpx
+
+BANK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Bank")
+CONCURRENCY_LEVELS = [100, 500, 1000]
+DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+PORT = 18700
+TOKENS_PER_PURCHASE = 10_000
+
+
+def start_bank(app_module, workdir):
+    env = dict(os.environ, BANK_MAX_PURCHASE_QUANTITY=str(TOKENS_PER_PURCHASE))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "--app-dir", BANK_DIR, f"{app_module}:app",
+         "--port", str(PORT), "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env)
+
+
+async def wait_ready(client):
+    for _ in range(100):
+        try:
+            await client.get("/users/0")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Bank did not start")
+
+
+async def prepare(client, tokens_needed):
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    user = (await client.post("/users/", json={"username": username, "password": "password123"})).json()
+    await client.post("/topup/", json={"user_id": user["id"], "amount": tokens_needed})
+    tokens = deque()
+    while len(tokens) < tokens_needed:
+        response = await client.post("/purchase/", json={"user_id": user["id"], "quantity": TOKENS_PER_PURCHASE})
+        tokens.extend(response.json()["tokens"])
+    return user["id"], tokens
+
+
+async def run_level(client, concurrency, user_id, tokens):
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + DURATION
+
+    async def worker(worker_id):
+        nonlocal errors
+        i = worker_id
+        while time.perf_counter() < deadline:
+            i += 1
+            start = time.perf_counter()
+            try:
+                if i % 2 == 0 and tokens:
+                    response = await client.post("/verify/", json={"token_id": tokens.popleft()})
+                else:
+                    response = await client.get(f"/users/{user_id}")
+                if response.status_code != 200:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+async def bench_mode(app_module):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        process = start_bank(app_module, workdir)
+        try:
+            limits = httpx.Limits(max_connections=max(CONCURRENCY_LEVELS), max_keepalive_connections=max(CONCURRENCY_LEVELS))
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60) as client:
+                await wait_ready(client)
+                # token พอสำหรับทุกระดับ (ประมาณการจาก ~2000 req/s)
+                user_id, tokens = await prepare(client, int(DURATION * 2000 * len(CONCURRENCY_LEVELS)))
+                for concurrency in CONCURRENCY_LEVELS:
+                    results[concurrency] = await run_level(client, concurrency, user_id, tokens)
+        finally:
+            process.terminate()
+            process.wait()
+    return results
+
+
+def main():
+    print(f"duration per level: {DURATION}s (load generator shares this machine)")
+    print(f"{'mode':<6} {'clients':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for mode, app_module in (("sync", "main"), ("async", "main_async")):
+        for concurrency, r in asyncio.run(bench_mode(app_module)).items():
+            print(f"{mode:<6} {concurrency:>8} {r['rps']:>9.0f} {r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
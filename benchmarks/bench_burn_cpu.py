@@ -0,0 +1,43 @@
+# เปรียบเทียบ CPU ต่อ request ของ burn_cpu_task แบบ Python loop กับแบบ NumPy vectorized
+# วิธีรัน: python benchmarks/bench_burn_cpu.py [จำนวนรอบ]
+
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import backend  # noqa: E402
+
+ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+
+def measure(task):
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.process_time()
+        task()
+        samples.append(time.process_time() - start)
+    return samples
+
+
+def main():
+    impls = {"python": backend.burn_cpu_task}
+    if backend.np is not None:
+        impls["numpy"] = backend.burn_cpu_task_numpy
+    else:
+        print("numpy not installed: skipping vectorized version")
+
+    print(f"BURN_ITERATIONS={backend.BURN_ITERATIONS}, rounds={ROUNDS}")
+    print(f"{'impl':<8} {'mean ms':>10} {'p50 ms':>10} {'p95 ms':>10} {'req/s/core':>12}")
+    for name, task in impls.items():
+        task()  # warm-up
+        samples = sorted(measure(task))
+        mean = statistics.fmean(samples)
+        p95 = samples[int(len(samples) * 0.95) - 1]
+        print(f"{name:<8} {mean * 1000:>10.3f} {statistics.median(samples) * 1000:>10.3f} "
+              f"{p95 * 1000:>10.3f} {1 / mean if mean else float('inf'):>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+# Microbenchmark ของ crud ที่อยู่บน hot path: purchase, verify_and_use_token, update_balance
+# ใช้ database.py ตัวจริง (pragma เดียวกับ Bank) บนฐานข้อมูลใหม่ใน temp dir วัดเวลาต่อ call แล้วสรุป ops/s และ p50/p95/p99
+#
+# วิธีรัน: python benchmarks/bench_crud.py [--iterations 2000] [--output ผล.json] [--baseline ผลครั้งก่อน.json]
+#   --baseline: เทียบ p50 กับผลครั้งก่อน ถ้าช้ากว่าเกิน --threshold (default 20%) จะ exit 1 (ใช้ใน CI จับ regression)
+# ตั้งค่า Bank ผ่าน environment ได้ตามปกติ เช่น BANK_TOKEN_STORAGE=book BANK_USAGE_ROLLUPS=1
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+BANK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Bank")
+sys.path.insert(0, BANK_DIR)
+
+PURCHASE_QUANTITY = 10
+OPERATIONS = ["purchase", "verify_and_use_token", "update_balance"]
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    count = len(ordered)
+    return {
+        "calls": count,
+        "ops_per_sec": count / sum(ordered),
+        "mean_us": sum(ordered) / count * 1e6,
+        "p50_us": ordered[count // 2] * 1e6,
+        "p95_us": ordered[min(count - 1, int(count * 0.95))] * 1e6,
+        "p99_us": ordered[min(count - 1, int(count * 0.99))] * 1e6,
+    }
+
+
+def measure(fn, args_list):
+    durations = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def run(iterations):
+    # database.py ใช้ bank.db ในโฟลเดอร์ปัจจุบัน: ย้ายไป temp dir ก่อน import
+    import crud
+    from database import init_db, sessionLocal
+    from models import User
+
+    init_db()
+    db = sessionLocal()
+    try:
+        user = User(username="bench", hashed_password="-", balance=10 ** 9)
+        db.add(user)
+        db.commit()
+        user_id = user.id
+
+        results = {}
+        tokens = []
+        results["purchase"] = measure(
+            lambda: tokens.extend(crud.purchase(db, user_id=user_id, quantity=PURCHASE_QUANTITY, price_per_token=0.1)["tokens"]),
+            [()] * iterations)
+
+        # token ที่ได้จาก purchase ข้างบน (PURCHASE_QUANTITY ต่อรอบ) พอสำหรับ verify ทุกรอบ
+        results["verify_and_use_token"] = measure(lambda token: crud.verify_and_use_token(db, token),
+                                                  [(token,) for token in tokens[:iterations]])
+
+        results["update_balance"] = measure(
+            lambda amount: crud.update_balance(db, user_id, amount, "topup", "bench"),
+            [(1.0 if i % 2 else -1.0,) for i in range(iterations)])
+    finally:
+        db.close()
+    return {name: summarize(durations) for name, durations in results.items()}
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name in OPERATIONS:
+        before = baseline.get("operations", {}).get(name)
+        if before is None:
+            continue
+        change = results[name]["p50_us"] / before["p50_us"] - 1
+        results[name]["p50_change"] = change
+        if change > threshold:
+            regressions.append(f"{name}: p50 {before['p50_us']:.0f}us -> {results[name]['p50_us']:.0f}us ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="crud microbenchmarks")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="previous --output file to compare p50 against")
+    parser.add_argument("--threshold", type=float, default=0.20, help="allowed p50 slowdown vs baseline (default 0.20)")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            operations = run(args.iterations)
+        finally:
+            os.chdir(cwd)
+
+    import config
+    results = {"iterations": args.iterations, "purchase_quantity": PURCHASE_QUANTITY,
+               "token_storage": config.TOKEN_STORAGE, "usage_rollups": config.USAGE_ROLLUPS_ENABLED,
+               "operations": operations}
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(operations, json.load(f), args.threshold)
+
+    print(f"{'operation':<22} {'ops/s':>8} {'mean us':>9} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9} {'vs baseline':>12}")
+    for name, r in operations.items():
+        change = f"{r['p50_change']:+.0%}" if "p50_change" in r else ""
+        print(f"{name:<22} {r['ops_per_sec']:>8.0f} {r['mean_us']:>9.0f} {r['p50_us']:>9.0f} {r['p95_us']:>9.0f} "
+              f"{r['p99_us']:>9.0f} {change:>12}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if regressions:
+        print("Regressions over threshold:\n  " + "\n  ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
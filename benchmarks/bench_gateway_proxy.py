@@ -0,0 +1,172 @@
+# วัด overhead ต่อ request ของ Gateway reverse proxy (routes.py) เทียบกับยิง upstream ตรง
+# เริ่ม payload server (ตอบ body ขนาดคงที่ 1KB / 256KB / 4MB) + Gateway ที่มี route ราคา 0 สองแบบ
+#   /stream    stream raw bytes ตรงไปหา client (route ปกติที่ไม่มี cache_ttl)
+#   /buffered  อ่าน body ทั้งก้อนก่อนตอบ (cache_ttl 0 = แบบที่ /premium-data ใช้ก่อนมี route table)
+# ทุก request มี query ไม่ซ้ำกัน จึงไม่มีการรวม request หรือ cache hit ปนในผล
+# รายงาน p50/p95 ของ direct / stream / buffered, overhead (p50 ผ่าน Gateway - p50 ตรง) และ RSS สูงสุดของ Gateway
+#
+# วิธีรัน: python benchmarks/bench_gateway_proxy.py [--requests 200] [--concurrency 1] [--output ผล.json]
+#   --concurrency 1 = overhead ต่อ request ล้วน ๆ, เพิ่มเป็น 16-32 เพื่อดู RSS (buffered โตตามจำนวน request x ขนาด body)
+# หมายเหตุ: ไม่ผ่าน payment (price 0) จึงวัดเฉพาะส่วน proxy ไม่รวม verify กับ Bank
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import httpx
+import psutil
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+SIZES = {"1KB": 1024, "256KB": 256 * 1024, "4MB": 4 * 1024 * 1024}
+MODES = ["direct", "buffered", "stream"]
+
+
+async def serve_payload(port):
+    # HTTP/1.1 keep-alive แบบ raw: ไม่ให้ค่าใช้จ่ายของ framework ฝั่ง upstream ปนในผล
+    bodies = {f"/{name}": b"x" * size for name, size in SIZES.items()}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(b" ", 2)[1].decode().split("?")[0]
+                body = bodies.get(path, b"not found")
+                status = "200 OK" if path in bodies else "404 Not Found"
+                writer.write(f"HTTP/1.1 {status}\r\ncontent-type: application/octet-stream\r\n"
+                             f"content-length: {len(body)}\r\n\r\n".encode() + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", port)
+    async with server:
+        await server.serve_forever()
+
+
+class RssSampler:
+    def __init__(self, pid):
+        self.process = psutil.Process(pid)
+        self.peak = 0
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(0.02)
+
+    def reset(self):
+        self.peak = self.process.memory_info().rss
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+async def measure(client, url, requests, concurrency):
+    durations = []
+    remaining = iter(range(requests))
+
+    async def worker():
+        # query ไม่ซ้ำกันทุก request: /buffered จะได้ไม่รวม request ที่ยิงพร้อมกัน (single-flight) จนดูเร็วเกินจริง
+        for i in remaining:
+            start = time.perf_counter()
+            response = await client.get(f"{url}?n={i}")
+            durations.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"{url} returned {response.status_code}")
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    durations.sort()
+    return {"p50_ms": durations[len(durations) // 2] * 1000,
+            "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000}
+
+
+async def wait_ready(client, url):
+    for _ in range(200):
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def run(args, sampler_holder):
+    payload_url = f"http://127.0.0.1:{args.base_port}"
+    gateway_url = f"http://127.0.0.1:{args.base_port + 1}"
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        await wait_ready(client, f"{payload_url}/1KB")
+        await wait_ready(client, f"{gateway_url}/stats/upstreams")
+        sampler = sampler_holder()
+        try:
+            for name in SIZES:
+                results[name] = {}
+                for mode in MODES:
+                    url = f"{payload_url}/{name}" if mode == "direct" else f"{gateway_url}/{mode}/{name}"
+                    await measure(client, url, min(20, args.requests), args.concurrency)    # warm up
+                    sampler.reset()
+                    results[name][mode] = await measure(client, url, args.requests, args.concurrency)
+                    results[name][mode]["gateway_peak_rss_mb"] = sampler.peak / 2 ** 20 if mode != "direct" else None
+                for mode in MODES[1:]:
+                    results[name][mode]["overhead_ms"] = results[name][mode]["p50_ms"] - results[name]["direct"]["p50_ms"]
+        finally:
+            sampler.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gateway reverse proxy overhead benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="requests per size and mode")
+    parser.add_argument("--concurrency", type=int, default=1, help="raise to compare Gateway RSS under load")
+    parser.add_argument("--base-port", type=int, default=18760, help="payload server port; Gateway uses the next one")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--serve-payload", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_payload:
+        asyncio.run(serve_payload(args.serve_payload))
+        return
+
+    payload_url = f"http://127.0.0.1:{args.base_port}"
+    routes = f"/stream={payload_url}|0,/buffered={payload_url}|0||0"
+    processes = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve-payload", str(args.base_port)]),
+        subprocess.Popen([sys.executable, "-m", "uvicorn", "gateway:app", "--host", "127.0.0.1",
+                          "--port", str(args.base_port + 1), "--log-level", "warning", "--no-access-log"],
+                         cwd=os.path.join(ROOT, "Gateway"),
+                         env={**os.environ, "GATEWAY_ROUTES": routes, "RATE_LIMIT_ENABLED": "0"}),
+    ]
+    try:
+        results = asyncio.run(run(args, lambda: RssSampler(processes[1].pid)))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    print(f"{'size':<7} {'mode':<9} {'p50 ms':>8} {'p95 ms':>8} {'overhead ms':>12} {'gateway rss MB':>15}")
+    for name, modes in results.items():
+        for mode, r in modes.items():
+            overhead = f"{r['overhead_ms']:.2f}" if "overhead_ms" in r else ""
+            rss = f"{r['gateway_peak_rss_mb']:.0f}" if r["gateway_peak_rss_mb"] else ""
+            print(f"{name:<7} {mode:<9} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {overhead:>12} {rss:>15}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"requests": args.requests, "concurrency": args.concurrency, "results": results}, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# วัด latency ของการดึงหนึ่งหน้าจาก /users/{user_id}/transaction และ /tokens ที่ความลึกต่างๆ
+# เทียบ skip/limit (OFFSET) กับ keyset cursor บนฐานข้อมูลที่มีธุรกรรมและ token ของผู้ใช้คนเดียวหลายล้านแถว
+# วิธีรัน: python benchmarks/bench_pagination.py [จำนวนแถวต่อตาราง]
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Bank"))
+
+from sqlalchemy import create_engine, event, insert  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+import crud  # noqa: E402
+from models import Base, User, Transaction, Token  # noqa: E402
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+PAGE_SIZE = 50
+ROUNDS = 20
+CHUNK = 50_000
+
+
+def make_session(path):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.close()
+
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def populate(db, user_id):
+    # ธุรกรรมคนละเวลา ส่วน token ออกเป็นชุดละ 100 ใบ created_at เดียวกัน (เหมือน bulk purchase)
+    start = datetime(2024, 1, 1)
+    for offset in range(0, ROWS, CHUNK):
+        db.execute(insert(Transaction), [
+            {"user_id": user_id, "amount": 1, "type": "topup", "timestamp": start + timedelta(seconds=n)}
+            for n in range(offset, min(offset + CHUNK, ROWS))])
+        db.execute(insert(Token), [
+            {"token_id": f"{n:012d}", "user_id": user_id, "price": 0.1, "used": n % 3 == 0,
+             "created_at": start + timedelta(seconds=n // 100)}
+            for n in range(offset, min(offset + CHUNK, ROWS))])
+        db.commit()
+
+
+def timed(fn):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        fn()
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+def tokens_offset(db, user_id, skip):
+    # วิธีเดียวที่ทำได้ก่อนมี cursor: เรียง + OFFSET
+    return (db.query(Token).filter(Token.user_id == user_id, Token.used == False)
+            .order_by(Token.created_at.desc(), Token.token_id.desc()).offset(skip).limit(PAGE_SIZE).all())
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = make_session(os.path.join(tmp, "bench.db"))
+        user = User(username="bench", hashed_password="-", balance=0)
+        db.add(user)
+        db.commit()
+        print(f"populating {ROWS:,} transactions + {ROWS:,} tokens ...")
+        populate(db, user.id)
+
+        depths = [d for d in (0, 10_000, 100_000, 1_000_000, 10_000_000) if d < ROWS * 2 // 3]
+        print(f"{'table':<13} {'depth':>10} {'offset ms':>10} {'cursor ms':>10}")
+        for depth in depths:
+            # cursor ที่ความลึกเดียวกัน (สร้างครั้งเดียว ไม่นับเวลา)
+            previous = crud.get_users_transactions(db, user.id, skip=max(depth - 1, 0), limit=1)
+            cursor = crud.transactions_next_cursor(previous, 1) if depth else None
+            offset_ms = timed(lambda: crud.get_users_transactions(db, user.id, skip=depth, limit=PAGE_SIZE))
+            cursor_ms = timed(lambda: crud.get_users_transactions_page(db, user.id, limit=PAGE_SIZE, cursor=cursor))
+            print(f"{'transactions':<13} {depth:>10,} {offset_ms:>10.2f} {cursor_ms:>10.2f}")
+
+        for depth in depths:
+            previous = tokens_offset(db, user.id, max(depth - 1, 0))[:1]
+            cursor = crud.encode_cursor("r", previous[0].created_at.isoformat(), previous[0].token_id) if depth else None
+            offset_ms = timed(lambda: tokens_offset(db, user.id, depth))
+            cursor_ms = timed(lambda: crud.get_user_tokens_page(db, user.id, unused_only=True, limit=PAGE_SIZE, cursor=cursor))
+            print(f"{'tokens':<13} {depth:>10,} {offset_ms:>10.2f} {cursor_ms:>10.2f}")
+            db.expunge_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# วัดความเร็วการสร้าง token (tokens/s) ของ crud.purchase แบบ ORM ทีละแถว เทียบกับ bulk insert
+# วิธีรัน: python benchmarks/bench_purchase.py
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Bank"))
+
+from sqlalchemy import create_engine, event  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+import crud  # noqa: E402
+from models import Base, User  # noqa: E402
+
+QUANTITIES = [100, 1_000, 10_000]
+ROUNDS = 5
+
+
+def make_session(path):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+
+def run(db, user_id, quantity):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        crud.purchase(db, user_id=user_id, quantity=quantity, price_per_token=0.1)
+    return quantity * ROUNDS / (time.perf_counter() - start)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = make_session(os.path.join(tmp, "bench.db"))
+        user = User(username="bench", hashed_password="-", balance=10 ** 9)
+        db.add(user)
+        db.commit()
+
+        print(f"{'quantity':>9} {'orm tokens/s':>14} {'bulk tokens/s':>14} {'speedup':>8}")
+        for quantity in QUANTITIES:
+            crud.BULK_MINT_THRESHOLD = quantity + 1      # บังคับใช้ ORM ทีละแถว
+            orm_rate = run(db, user.id, quantity)
+            crud.BULK_MINT_THRESHOLD = 0                 # บังคับใช้ bulk insert
+            bulk_rate = run(db, user.id, quantity)
+            print(f"{quantity:>9} {orm_rate:>14.0f} {bulk_rate:>14.0f} {bulk_rate / orm_rate:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
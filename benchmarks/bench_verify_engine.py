@@ -0,0 +1,148 @@
+# เทียบ throughput ของการ verify token: crud.verify_and_use_token (SQLite ทุกครั้ง) กับ token_index.py (index ใน memory + spend log)
+# ใช้ database.py ตัวจริงบนฐานข้อมูลใหม่ใน temp dir ซื้อ token ไว้ก่อน แล้ว verify token ไม่ซ้ำกันด้วย 1 thread และหลาย thread
+#   (แต่ละ thread ใช้ session ของตัวเอง เหมือน request ใน threadpool ของ main.py)
+# รายงาน ops/s และ p50/p99 ต่อ thread, batch เฉลี่ยต่อ fsync, เวลา replay log ลง Tokens และหน่วยความจำของ index ต่อ token
+#
+# วิธีรัน: python benchmarks/bench_verify_engine.py [--tokens 20000] [--threads 1,8,32] [--output ผล.json]
+# หมายเหตุ: spend log fsync ทุก batch ส่วน SQLite ใช้ synchronous=NORMAL (ไม่ fsync ตอน commit) ผลบนดิสก์จริงจึงขึ้นกับ fsync latency
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "Bank"), ROOT]
+
+
+def summarize(durations, elapsed):
+    ordered = sorted(durations)
+    count = len(ordered)
+    return {
+        "calls": count,
+        "ops_per_sec": count / elapsed,
+        "p50_us": ordered[count // 2] * 1e6,
+        "p99_us": ordered[min(count - 1, int(count * 0.99))] * 1e6,
+    }
+
+
+def measure(verify_factory, tokens, threads):
+    # แบ่ง token เท่า ๆ กันให้แต่ละ thread / verify_factory() คืนฟังก์ชัน verify ของ thread นั้น (พร้อม session ของตัวเอง)
+    durations = []
+    chunks = [tokens[i::threads] for i in range(threads)]
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(chunk):
+        verify, close = verify_factory()
+        local = []
+        barrier.wait()
+        for token in chunk:
+            start = time.perf_counter()
+            result = verify(token)
+            local.append(time.perf_counter() - start)
+            if not result["valid"]:
+                raise RuntimeError(f"{token}: {result}")
+        close()
+        durations.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    return summarize(durations, time.perf_counter() - start)
+
+
+def run(token_count, thread_counts):
+    # database.py ใช้ bank.db ในโฟลเดอร์ปัจจุบัน: ย้ายไป temp dir ก่อน import
+    import crud
+    from database import init_db, sessionLocal
+    from spend_log import SpendLog
+    from token_index import TokenIndex
+
+    init_db()
+    rounds = 1 + len(thread_counts)
+    db = sessionLocal()
+    try:
+        user = crud.create_user_with_hash(db, "bench", "-", 10 ** 9)
+        tokens = [token for _ in range(2 * rounds) for token in crud.purchase(db, user.id, token_count, 0.1)["tokens"]]
+    finally:
+        db.close()
+    batches = [tokens[i * token_count:(i + 1) * token_count] for i in range(2 * rounds)]
+
+    def crud_verify():
+        session = sessionLocal()
+        return (lambda token: crud.verify_and_use_token(session, token)), session.close
+
+    results = {"crud": {}, "token_index": {}}
+    for threads in thread_counts:
+        results["crud"][threads] = measure(crud_verify, batches.pop(), threads)
+
+    # index ของ token ทั้งหมดที่ยังไม่ถูกใช้ (วัดหน่วยความจำตอนโหลด)
+    index = TokenIndex(sessionLocal, SpendLog("spend.log", max_batch=512, max_wait_ms=0), replay_interval=3600, replay_batch_size=1000)
+    tracemalloc.start()
+    index.start()
+    index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    loaded = index.stats()["tokens"]
+
+    def index_verify():
+        return (lambda token: index.spend([token])[0]), (lambda: None)
+
+    for threads in thread_counts:
+        records, batches_before = index.log.records, index.log.batches
+        results["token_index"][threads] = measure(index_verify, batches.pop(), threads)
+        results["token_index"][threads]["records_per_fsync"] = (index.log.records - records) / (index.log.batches - batches_before)
+
+    # replay ทุกอย่างที่ค้าง (ปกติทำทีละรอบใน thread แยก)
+    pending = index.stats()["pending"]
+    start = time.perf_counter()
+    index.stop()
+    replay = {"records": pending, "seconds": time.perf_counter() - start}
+    replay["records_per_sec"] = pending / replay["seconds"]
+    return {"engines": results, "replay": replay, "index": {"tokens": loaded, "bytes_per_token": index_bytes / loaded,
+                                                           "load_seconds": index.load_seconds}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="verify throughput: crud vs in-memory token index")
+    parser.add_argument("--tokens", type=int, default=20000, help="tokens verified per engine and thread count")
+    parser.add_argument("--threads", default="1,8,32", help="comma-separated thread counts")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+    thread_counts = [int(value) for value in args.threads.split(",")]
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            results = run(args.tokens, thread_counts)
+        finally:
+            os.chdir(cwd)
+
+    print(f"{'engine':<12} {'threads':>7} {'ops/s':>8} {'p50 us':>8} {'p99 us':>9} {'per fsync':>10}")
+    for engine, by_threads in results["engines"].items():
+        for threads, r in by_threads.items():
+            per_fsync = f"{r['records_per_fsync']:.1f}" if "records_per_fsync" in r else ""
+            print(f"{engine:<12} {threads:>7} {r['ops_per_sec']:>8.0f} {r['p50_us']:>8.0f} {r['p99_us']:>9.0f} {per_fsync:>10}")
+    for threads in thread_counts:
+        speedup = results["engines"]["token_index"][threads]["ops_per_sec"] / results["engines"]["crud"][threads]["ops_per_sec"]
+        print(f"speedup at {threads} threads: {speedup:.1f}x")
+    index, replay = results["index"], results["replay"]
+    print(f"index: {index['tokens']} tokens loaded in {index['load_seconds']:.2f}s, {index['bytes_per_token']:.0f} bytes/token")
+    print(f"replay: {replay['records']} spends into Tokens in {replay['seconds']:.2f}s ({replay['records_per_sec']:.0f}/s)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"tokens": args.tokens, **results}, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
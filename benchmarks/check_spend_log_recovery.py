@@ -0,0 +1,183 @@
+# ตรวจว่า token_index.py + spend_log.py ยังเป็น at-most-once เมื่อ Bank ดับกลางคัน (SIGKILL)
+# ซื้อ token ไว้ชุดหนึ่ง แล้ววนหลายรอบ: process ลูก verify token แบบสุ่ม (มีซ้ำ) หลาย thread พิมพ์ token ที่ได้ valid
+#   ออกมาทันที -> ฆ่าทิ้งด้วย SIGKILL ที่เวลาสุ่ม (ระหว่าง fsync / replay / กลาง batch) บางรอบต่อท้ายบรรทัดที่เขียนไม่จบ
+#   ให้ segment ล่าสุดเหมือนเครื่องดับกลาง write -> รอบถัดไปเริ่มใหม่จาก log ที่ค้าง
+# สุดท้ายเริ่มอีกครั้งแล้วปิดปกติ (replay ทั้งหมด) แล้วตรวจ:
+#   1) ไม่มี token ไหนได้ valid เกินหนึ่งครั้งตลอดทุกรอบ
+#   2) token ที่เคยได้ valid ทุกใบเป็น used ในตาราง Tokens
+#   3) tokens_used ใน UsageRollups เท่ากับจำนวน token ที่ used (replay ซ้ำไม่นับซ้ำ)
+#   4) ไม่มี segment ค้าง
+#
+# วิธีรัน: python benchmarks/check_spend_log_recovery.py [--rounds 10] [--tokens 50000] [--threads 8] [--max-run 0.5]
+# exit 1 ถ้าข้อใดไม่ผ่าน
+
+import argparse
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+BANK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Bank")
+
+
+def setup(count):
+    import crud
+    from database import init_db, sessionLocal
+
+    init_db()
+    db = sessionLocal()
+    try:
+        user = crud.create_user_with_hash(db, "recovery", "-", count)
+        tokens = crud.purchase(db, user.id, count, 0.1)["tokens"]
+    finally:
+        db.close()
+    with open("tokens.txt", "w") as f:
+        f.write("\n".join(tokens))
+
+
+def open_index(replay_interval):
+    from database import sessionLocal
+    from spend_log import SpendLog
+    from token_index import TokenIndex
+
+    return TokenIndex(sessionLocal, SpendLog("spend.log", max_batch=64, max_wait_ms=0),
+                      replay_interval=replay_interval, replay_batch_size=100)
+
+
+def spend(threads):
+    # ทำงานจนถูกฆ่า: พิมพ์ token ทุกใบที่ได้ valid (หลัง fsync แล้วเท่านั้น)
+    with open("tokens.txt") as f:
+        tokens = f.read().split()
+    index = open_index(replay_interval=0.02)
+    index.start()
+    print("ready", flush=True)
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        while True:
+            batch = [rng.choice(tokens) for _ in range(rng.choice((1, 1, 1, 5, 20)))]
+            for result in index.spend(batch):
+                if result is not None and result["valid"]:
+                    with lock:
+                        sys.stdout.write(f"valid {result['token_id']}\n")
+                        sys.stdout.flush()
+
+    for seed in range(threads):
+        threading.Thread(target=worker, args=(seed,), daemon=True).start()
+    threading.Event().wait()
+
+
+def check():
+    # เริ่มใหม่ (replay ของที่ค้าง) แล้วปิดปกติ จากนั้นอ่านสถานะจริงใน SQLite
+    import crud
+    from database import sessionLocal
+    from models import Token
+    from sqlalchemy import select
+
+    index = open_index(replay_interval=0.5)
+    index.start()
+    loaded = index.stats()["tokens"]
+    index.stop()
+    db = sessionLocal()
+    try:
+        used = db.execute(select(Token.token_id).where(Token.used == True)).scalars().all()
+        user_id = db.execute(select(Token.user_id).limit(1)).scalar_one()
+        tokens_used = crud.get_usage(db, user_id, hours=0, days=0)["total"]["tokens_used"]
+    finally:
+        db.close()
+    print(json.dumps({"used": used, "tokens_used": tokens_used, "loaded": loaded,
+                      "segments": len(index.log.segments())}))
+
+
+def child(mode, workdir, *args):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", mode, *map(str, args)],
+                            cwd=workdir, stdout=subprocess.PIPE, text=True,
+                            env={**os.environ, "PYTHONPATH": os.pathsep.join([os.path.abspath(BANK_DIR), os.path.dirname(os.path.abspath(BANK_DIR))]), "BANK_TOKEN_ARCHIVE": "0", "BANK_USAGE_ROLLUPS": "1"})
+
+
+def tear_last_segment(workdir):
+    # จำลองเครื่องดับกลาง write: บรรทัดครึ่งเดียวท้าย segment ล่าสุด (ไม่มี newline / crc ไม่ตรง)
+    segments = sorted(name for name in os.listdir(workdir) if name.startswith("spend.log.") and name[10:].isdigit())
+    if segments:
+        with open(os.path.join(workdir, segments[-1]), "ab") as f:
+            f.write(b"00000000-0000-4000-8000-000000000000 1 17000")
+        return True
+    return False
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="spend-log-recovery-")
+    rng = random.Random(args.seed)
+    process = child("setup", workdir, args.tokens)
+    process.wait()
+    with open(os.path.join(workdir, "tokens.txt")) as f:
+        total = len(f.read().split())
+
+    acknowledged = Counter()
+    torn = 0
+    for round_number in range(args.rounds):
+        process = child("spend", workdir, args.threads)
+        assert process.stdout.readline().strip() == "ready"
+        # อ่าน stdout ตลอดเวลาใน thread แยก (pipe ไม่เต็มจนลูกหยุดรอ) แล้วฆ่าที่เวลาสุ่ม
+        lines = []
+        reader = threading.Thread(target=lambda: lines.extend(process.stdout), daemon=True)
+        reader.start()
+        time.sleep(rng.uniform(0.01, args.max_run))
+        process.send_signal(signal.SIGKILL)
+        process.wait()
+        reader.join()
+        spent = [line.split()[1] for line in lines if line.startswith("valid ")]
+        acknowledged.update(spent)
+        if rng.random() < 0.5 and tear_last_segment(workdir):
+            torn += 1
+        print(f"round {round_number + 1}: killed after {len(spent)} valid spends, total acknowledged {len(acknowledged)}")
+
+    process = child("check", workdir)
+    state = json.loads(process.stdout.read())
+    process.wait()
+
+    used = set(state["used"])
+    twice = [token for token, count in acknowledged.items() if count > 1]
+    missing = [token for token in acknowledged if token not in used]
+    checks = {
+        "no token acknowledged twice": not twice,
+        "every acknowledged token is used in Tokens": not missing,
+        "usage tokens_used matches used tokens": state["tokens_used"] == len(used),
+        "no spend log segments left": state["segments"] == 0,
+    }
+    print(f"\ntokens {total}, acknowledged {len(acknowledged)}, used in Tokens {len(used)} "
+          f"(consumed by a crash before the reply: {len(used) - len(acknowledged)}), torn tails {torn}")
+    for name, ok in checks.items():
+        print(f"{'PASS' if ok else 'FAIL'}  {name}")
+    if twice:
+        print("acknowledged twice:", twice[:5])
+    if missing:
+        print("acknowledged but unused:", missing[:5])
+    return all(checks.values())
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        mode, args = sys.argv[2], sys.argv[3:]
+        {"setup": lambda: setup(int(args[0])), "spend": lambda: spend(int(args[0])), "check": check}[mode]()
+        return
+
+    parser = argparse.ArgumentParser(description="Crash recovery check for the in-memory token index and spend log")
+    parser.add_argument("--rounds", type=int, default=10, help="number of SIGKILLed runs")
+    parser.add_argument("--tokens", type=int, default=50000, help="tokens bought before the first run")
+    parser.add_argument("--max-run", type=float, default=0.5, help="each run is killed after a random 0.01..max-run seconds")
+    parser.add_argument("--threads", type=int, default=8, help="verifying threads in each run")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    sys.exit(0 if run(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# Load test แบบ bot.py: ยิง /premium-data ด้วย token ปลอม / token ที่ใช้ไปแล้วซ้ำๆ ปนกับ token จริงส่วนน้อย
+# รัน Bank + Backend + Gateway ของตัวเอง (temp dir) สองรอบ: ปิด token guard กับเปิด token guard
+# แล้วเทียบจำนวน token ที่ Gateway ต้องส่งไปถาม Bank ต่อ 1,000 request
+# วิธีรัน: python benchmarks/load_token_replay.py [จำนวน request ต่อรอบ]
+
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+CONCURRENCY = 100
+BANK_PORT, BACKEND_PORT, GATEWAY_PORT = 18710, 18711, 18712
+
+# สัดส่วน traffic: token จริงที่ยังไม่ใช้ / replay token ที่ใช้แล้ว / uuid ปลอมจากชุดเล็กๆ ที่ bot วนใช้ / string มั่ว
+MIX = [("fresh", 0.10), ("replay", 0.40), ("fake_uuid", 0.25), ("garbage", 0.25)]
+FAKE_UUIDS = [str(uuid.uuid4()) for _ in range(500)]
+
+
+def start(args, cwd, env):
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", *args, "--log-level", "warning", "--no-access-log",
+                             "--timeout-keep-alive", "60"],
+                            cwd=cwd, env=dict(os.environ, **env))
+
+
+async def wait_ready(client, url):
+    for _ in range(100):
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def buy_tokens(client, count):
+    bank = f"http://127.0.0.1:{BANK_PORT}"
+    user = (await client.post(f"{bank}/users/", json={"username": f"load_{uuid.uuid4().hex[:8]}", "password": "password123"})).json()
+    await client.post(f"{bank}/topup/", json={"user_id": user["id"], "amount": count})
+    tokens = []
+    while len(tokens) < count:
+        response = await client.post(f"{bank}/purchase/", json={"user_id": user["id"], "quantity": min(10_000, count - len(tokens))})
+        tokens.extend(response.json()["tokens"])
+    return tokens
+
+
+async def run_traffic(client, fresh_tokens):
+    gateway = f"http://127.0.0.1:{GATEWAY_PORT}"
+    used = fresh_tokens[:100]
+    fresh = fresh_tokens[100:]
+    kinds = random.choices([kind for kind, _ in MIX], weights=[weight for _, weight in MIX], k=REQUESTS)
+    statuses = Counter()
+
+    def next_token(kind):
+        if kind == "fresh" and fresh:
+            token = fresh.pop()
+            used.append(token)
+            return token
+        if kind == "fake_uuid":
+            return random.choice(FAKE_UUIDS)
+        if kind == "garbage":
+            return uuid.uuid4().hex[:random.randint(4, 40)] + "'; DROP TABLE"
+        return random.choice(used)
+
+    async def worker(worker_id):
+        for i in range(worker_id, REQUESTS, CONCURRENCY):
+            try:
+                response = await client.get(f"{gateway}/premium-data", headers={"X-Payment-Token": next_token(kinds[i])})
+                statuses[response.status_code] += 1
+            except httpx.HTTPError:
+                statuses["error"] += 1
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(CONCURRENCY)))
+    return statuses, time.perf_counter() - start_time
+
+
+async def run_round(guard_enabled):
+    flag = "1" if guard_enabled else "0"
+    with tempfile.TemporaryDirectory() as workdir:
+        processes = [
+            start(["--app-dir", os.path.join(ROOT, "Bank"), "main:app", "--port", str(BANK_PORT)], workdir,
+                  {"BANK_MAX_PURCHASE_QUANTITY": "10000"}),
+            start(["backend:app", "--port", str(BACKEND_PORT)], ROOT, {}),
+            start(["gateway:app", "--port", str(GATEWAY_PORT)], os.path.join(ROOT, "Gateway"),
+                  {"BANK_API_URL": f"http://127.0.0.1:{BANK_PORT}", "BACKEND_API_URL": f"http://127.0.0.1:{BACKEND_PORT}",
+                   "RATE_LIMIT_ENABLED": "0", "TOKEN_PREVALIDATE": flag, "NEGATIVE_CACHE_ENABLED": flag}),
+        ]
+        try:
+            limits = httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+            async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+                await wait_ready(client, f"http://127.0.0.1:{BANK_PORT}/users/0")
+                await wait_ready(client, f"http://127.0.0.1:{GATEWAY_PORT}/")
+                tokens = await buy_tokens(client, int(REQUESTS * 0.12) + 100)
+                statuses, elapsed = await run_traffic(client, tokens)
+                verify = (await client.get(f"http://127.0.0.1:{GATEWAY_PORT}/stats/verify-batch")).json()
+                guard = (await client.get(f"http://127.0.0.1:{GATEWAY_PORT}/stats/token-guard")).json()
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+    return statuses, elapsed, verify, guard
+
+
+def main():
+    print(f"{REQUESTS:,} requests per round, {CONCURRENCY} concurrent, mix: "
+          + ", ".join(f"{kind} {weight:.0%}" for kind, weight in MIX))
+    print(f"{'token guard':<12} {'req/s':>8} {'200':>7} {'402':>7} {'errors':>7} {'bank tokens':>12} {'per 1k req':>11} "
+          f"{'bank batches':>13} {'cache hit':>10} {'malformed':>10}")
+    for guard_enabled in (False, True):
+        statuses, elapsed, verify, guard = asyncio.run(run_round(guard_enabled))
+        print(f"{'on' if guard_enabled else 'off':<12} {REQUESTS / elapsed:>8.0f} {statuses[200]:>7} {statuses[402]:>7} {statuses['error']:>7} "
+              f"{verify['tokens_sent']:>12} {verify['tokens_sent'] * 1000 / REQUESTS:>11.0f} {verify['batches_sent']:>13} "
+              f"{guard['hit_ratio']:>10.1%} {guard['malformed_rejected']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# Load generator แบบ open loop (อัตราคงที่) สำหรับ flow ของ SmartClient: สมัคร -> เติมเงิน -> ซื้อ token -> จ่ายที่ Gateway
+#
+# ต่างจาก Locust (closed loop: user รอคำตอบก่อนส่งครั้งถัดไป) ตรงที่ request ที่ i มีเวลาที่ "ควรส่ง" = start + i / rate
+# เสมอ ไม่ว่า Gateway จะตอบช้าแค่ไหน latency วัดจากเวลาที่ควรส่ง (ไม่ใช่เวลาที่ส่งได้จริง)
+# ช่วงที่ Gateway ช้า request จึงต่อคิวและ latency ที่รายงานจะสูงตามจริง (ไม่เกิด coordinated omission)
+#
+# - token pool เป็น deque: งานเบื้องหลังซื้อ token เพิ่มจาก Bank ล่วงหน้าเมื่อเหลือต่ำกว่า --low-water
+#   (ใช้หลายบัญชีวนกันซื้อ เติมเงินเองเมื่อยอดไม่พอ) request ไม่ต้องรอการซื้อ
+# - ฝั่ง Bank (สมัคร/เติมเงิน/ซื้อ) ใช้ httpx ส่วน /premium-data ที่ต้องยิงหลายหมื่นครั้งต่อวินาทีใช้ HTTP/1.1 client
+#   ขนาดเล็กบน asyncio stream (keep-alive, request bytes สร้างเอง) เพราะ overhead ต่อ request ของ httpx
+#   ทำให้ได้ราวสองสามพัน req/s ต่อ core เท่านั้น
+#
+# วิธีรัน:
+#   python benchmarks/open_loop_load.py --rate 2000 --duration 30 --gateway http://127.0.0.1:8080 --bank http://127.0.0.1:8000
+#   --unpaid: ไม่แนบ token (วัดเพดานของ generator/Gateway โดยไม่ต้องซื้อ token)
+# ต้องตั้ง BANK_MAX_PURCHASE_QUANTITY ของ Bank ให้ไม่น้อยกว่า --purchase-quantity
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import Counter, deque
+from urllib.parse import urlsplit
+
+import httpx
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class TokenPool:
+    def __init__(self, bank_url, accounts, purchase_quantity, low_water, buyers):
+        self.bank_url = bank_url
+        self.account_count = accounts
+        self.purchase_quantity = purchase_quantity
+        self.low_water = low_water
+        self.buyers = buyers
+        self.tokens = deque()
+        self._accounts = deque()    # (user_id, headers)
+        self._client = None
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+
+        self.bought = 0
+        self.purchases = 0
+        self.purchase_errors = 0
+        self.purchase_latencies = []
+        self.starved = 0
+
+    async def start(self, initial_tokens):
+        self._client = httpx.AsyncClient(base_url=self.bank_url, timeout=30)
+        await asyncio.gather(*(self._register() for _ in range(self.account_count)))
+        # เติม pool รอบแรกก่อนเริ่มยิง
+        while len(self.tokens) < initial_tokens:
+            await asyncio.gather(*(self._buy() for _ in range(self.buyers)))
+        self._tasks = [asyncio.ensure_future(self._refill()) for _ in range(self.buyers)]
+
+    async def _register(self):
+        username = f"load_{uuid.uuid4().hex[:12]}"
+        response = await self._client.post("/users/", json={"username": username, "password": "password123"})
+        response.raise_for_status()
+        user_id = response.json()["id"]
+        # login เพื่อได้ API key (ใช้ได้ทั้งตอน Bank บังคับและไม่บังคับ BANK_REQUIRE_API_KEY)
+        response = await self._client.post("/login/", json={"username": username, "password": "password123"})
+        response.raise_for_status()
+        self._accounts.append((user_id, {"X-API-Key": response.json()["api_key"]}))
+
+    async def _buy(self):
+        user_id, headers = self._accounts[0]
+        self._accounts.rotate(-1)
+        purchase = {"user_id": user_id, "quantity": self.purchase_quantity}
+        start = time.perf_counter()
+        response = await self._client.post("/purchase/", json=purchase, headers=headers)
+        if response.status_code == 400 and "balance" in response.text.lower():
+            await self._client.post("/topup/", json={"user_id": user_id, "amount": self.purchase_quantity * 10},
+                                    headers=headers)
+            response = await self._client.post("/purchase/", json=purchase, headers=headers)
+        self.purchase_latencies.append(time.perf_counter() - start)
+        self.purchases += 1
+        if response.status_code != 200:
+            self.purchase_errors += 1
+            return
+        tokens = response.json()["tokens"]
+        self.tokens.extend(tokens)
+        self.bought += len(tokens)
+
+    async def _refill(self):
+        while True:
+            if len(self.tokens) >= self.low_water:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                await self._buy()
+            except httpx.HTTPError:
+                self.purchase_errors += 1
+                await asyncio.sleep(0.1)
+
+    def take(self):
+        if len(self.tokens) < self.low_water:
+            self._wakeup.set()
+        if not self.tokens:
+            self.starved += 1
+            return None
+        return self.tokens.popleft()
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+
+
+class RawHttpConnection:
+    # HTTP/1.1 keep-alive แบบน้อยที่สุด: ส่ง request ที่สร้างเป็น bytes ไว้แล้ว อ่าน status + body (content-length หรือ chunked)
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def request(self, payload: bytes) -> int:
+        if self._writer is None:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            self._writer.write(payload)
+            head = await self._reader.readuntil(b"\r\n\r\n")
+            status = int(head[9:12])
+            lower = head.lower()
+            keep_alive = b"connection: close" not in lower
+            index = lower.find(b"content-length:")
+            if index >= 0:
+                length = int(lower[index + 15:lower.index(b"\r\n", index)])
+                await self._reader.readexactly(length)
+            elif b"transfer-encoding: chunked" in lower:
+                while True:
+                    size = int((await self._reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                    await self._reader.readexactly(size + 2)
+                    if size == 0:
+                        break
+            if not keep_alive:
+                self.close()
+            return status
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            self.close()
+            raise
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+
+class OpenLoopRunner:
+    def __init__(self, gateway_url, path, rate, duration, warmup, connections, pool):
+        parts = urlsplit(gateway_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = path
+        self.rate = rate
+        self.duration = duration
+        self.warmup = warmup
+        self.connections = connections
+        self.pool = pool
+        self._queue = deque()       # (ลำดับ, เวลาที่ควรส่ง)
+        self._ready = asyncio.Event()
+        self._done = False
+
+        self.latencies = []         # วินาที นับจากเวลาที่ควรส่ง
+        self.service_times = []     # วินาที นับจากเวลาที่ส่งจริง
+        self.send_delays = []       # ส่งจริงช้ากว่าเวลาที่ควรส่งเท่าไร (คิวรอ connection ว่าง / generator ไม่ทัน)
+        self.statuses = Counter()
+        self.max_backlog = 0
+        self.scheduled = 0
+
+    def _payload(self, token):
+        token_header = f"X-Payment-Token: {token}\r\n" if token is not None else ""
+        return f"GET {self.path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n{token_header}\r\n".encode()
+
+    async def _schedule(self, start):
+        # ทุกรอบ: ใส่ request ทั้งหมดที่ถึงเวลาแล้วลงคิว (เวลาที่ควรส่งคำนวณจากลำดับ ไม่ใช่จากเวลาปัจจุบัน)
+        total = int(self.rate * (self.warmup + self.duration))
+        while self.scheduled < total:
+            due = min(total, int((time.perf_counter() - start) * self.rate) + 1)
+            while self.scheduled < due:
+                self._queue.append((self.scheduled, start + self.scheduled / self.rate))
+                self.scheduled += 1
+            self.max_backlog = max(self.max_backlog, len(self._queue))
+            self._ready.set()
+            await asyncio.sleep(max(0.0, start + self.scheduled / self.rate - time.perf_counter()))
+        self._done = True
+        self._ready.set()
+
+    async def _worker(self, warmup_end):
+        connection = RawHttpConnection(self.host, self.port)
+        while True:
+            if not self._queue:
+                if self._done:
+                    break
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            index, intended = self._queue.popleft()
+            token = None
+            if self.pool is not None:
+                token = self.pool.take()
+                if token is None:
+                    self._record(intended, intended, warmup_end, "no_token")
+                    continue
+            sent = time.perf_counter()
+            try:
+                status = await connection.request(self._payload(token))
+            except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                status = "error"
+            self._record(intended, sent, warmup_end, status)
+        connection.close()
+
+    def _record(self, intended, sent, warmup_end, status):
+        if intended < warmup_end:
+            return
+        now = time.perf_counter()
+        self.statuses[status] += 1
+        self.latencies.append(now - intended)
+        self.service_times.append(now - sent)
+        self.send_delays.append(sent - intended)
+
+    async def run(self):
+        start = time.perf_counter() + 0.05
+        workers = [asyncio.ensure_future(self._worker(start + self.warmup)) for _ in range(self.connections)]
+        await self._schedule(start)
+        await asyncio.gather(*workers)
+        return time.perf_counter() - start - self.warmup
+
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        service_times = sorted(self.service_times)
+        send_delays = sorted(self.send_delays)
+
+        def ms(ordered, fraction):
+            value = percentile(ordered, fraction)
+            return None if value is None else value * 1000
+
+        completed = len(latencies)
+        ok = self.statuses.get(200, 0)
+        return {
+            "target_rps": self.rate,
+            "achieved_rps": completed / elapsed if elapsed > 0 else 0.0,
+            "duration": self.duration,
+            "completed": completed,
+            "success_rate": ok / completed if completed else 0.0,
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items(), key=str)},
+            "latency_ms": {name: ms(latencies, fraction) for name, fraction in
+                           (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("p999", 0.999), ("max", 1.0))},
+            "service_time_ms": {name: ms(service_times, fraction) for name, fraction in (("p50", 0.5), ("p99", 0.99))},
+            "send_delay_ms": {name: ms(send_delays, fraction) for name, fraction in (("p50", 0.5), ("p99", 0.99))},
+            "max_backlog": self.max_backlog,
+            "connections": self.connections,
+        }
+
+
+async def main_async(args):
+    pool = None
+    if not args.unpaid:
+        pool = TokenPool(args.bank, args.accounts, args.purchase_quantity, args.low_water, args.buyers)
+        print(f"Preparing {args.accounts} accounts and {args.initial_tokens} tokens at {args.bank} ...")
+        await pool.start(args.initial_tokens)
+    try:
+        runner = OpenLoopRunner(args.gateway, args.path, args.rate, args.duration, args.warmup, args.connections, pool)
+        print(f"Sending {args.rate:.0f} req/s to {args.gateway}{args.path} for {args.duration:.0f}s "
+              f"(+{args.warmup:.0f}s warmup) over {args.connections} connections")
+        elapsed = await runner.run()
+        result = runner.report(elapsed)
+    finally:
+        if pool is not None:
+            await pool.aclose()
+
+    if pool is not None:
+        purchase_latencies = sorted(pool.purchase_latencies)
+        result["token_pool"] = {
+            "bought": pool.bought, "purchases": pool.purchases, "purchase_errors": pool.purchase_errors,
+            "starved_requests": pool.starved, "left": len(pool.tokens),
+            "purchase_p50_ms": (percentile(purchase_latencies, 0.5) or 0) * 1000,
+            "purchase_p99_ms": (percentile(purchase_latencies, 0.99) or 0) * 1000,
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop (fixed arrival rate) load generator for the SmartClient flow")
+    parser.add_argument("--gateway", default=os.getenv("GATEWAY_API_URL", "http://127.0.0.1:8080"))
+    parser.add_argument("--bank", default=os.getenv("BANK_API_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--path", default="/premium-data")
+    parser.add_argument("--rate", type=float, default=1000, help="requests per second (arrival rate)")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds sent but not recorded")
+    parser.add_argument("--connections", type=int, default=256, help="keep-alive connections to the Gateway")
+    parser.add_argument("--unpaid", action="store_true", help="send requests without a payment token")
+    parser.add_argument("--accounts", type=int, default=4, help="Bank accounts buying tokens")
+    parser.add_argument("--purchase-quantity", type=int, default=100, help="tokens per /purchase/ (<= BANK_MAX_PURCHASE_QUANTITY)")
+    parser.add_argument("--initial-tokens", type=int, default=None, help="tokens to buy before starting (default 2s of traffic)")
+    parser.add_argument("--low-water", type=int, default=None, help="buy more when the pool drops below this (default 1s of traffic)")
+    parser.add_argument("--buyers", type=int, default=4, help="concurrent background purchases")
+    parser.add_argument("--output", help="write the result as JSON")
+    args = parser.parse_args()
+    if args.initial_tokens is None:
+        args.initial_tokens = int(args.rate * 2)
+    if args.low_water is None:
+        args.low_water = int(args.rate)
+
+    result = asyncio.run(main_async(args))
+    latency = result["latency_ms"]
+    print(f"achieved {result['achieved_rps']:.0f} req/s of {result['target_rps']:.0f}, "
+          f"success {result['success_rate']:.1%}, statuses {result['statuses']}")
+    print("latency from intended send time (ms): " + ", ".join(f"{k} {v:.1f}" for k, v in latency.items() if v is not None))
+    print("service time (ms): " + ", ".join(f"{k} {v:.1f}" for k, v in result["service_time_ms"].items() if v is not None)
+          + f" | send delay p99 {result['send_delay_ms']['p99'] or 0:.1f} ms, max backlog {result['max_backlog']}")
+    if "token_pool" in result:
+        print(f"token pool: {result['token_pool']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
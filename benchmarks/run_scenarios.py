@@ -0,0 +1,238 @@
+# เปรียบเทียบ Scenario A กับ Scenario B บน localhost แบบทำซ้ำได้
+# แต่ละ scenario เริ่ม Bank + Backend + Gateway ใหม่ (ฐานข้อมูลใหม่ใน temp dir) แล้วยิงตามเวลาที่กำหนด
+#   direct-backend     bot ยิง Backend ตรง (/expensive-data) = Scenario A (bot.py SCENARIO=direct)
+#   gateway-flood      bot ยิง Gateway โดยไม่มี token (/premium-data) = Scenario B (bot.py SCENARIO=gateway)
+#   paid-smart-client  client ที่ซื้อ token จาก Bank แล้วจ่ายผ่าน Gateway (smart_client.py)
+# ผลลัพธ์ (throughput, p50/p95/p99, error rate, status ที่ได้) เขียนเป็น JSON ที่ --output
+#
+# วิธีรัน: python benchmarks/run_scenarios.py [--duration 30] [--concurrency 50] [--scenario gateway-flood ...]
+# ค่าตั้งของ service ส่งผ่าน environment ตามปกติ และถูกบันทึกไว้ในไฟล์ผลด้วย เช่น
+#   BACKEND_EXECUTION_MODE=process VERIFY_BATCH_ENABLED=0 python benchmarks/run_scenarios.py
+# หมายเหตุ: load generator รันบนเครื่องเดียวกับ service (แย่ง CPU กัน) เทียบผลเฉพาะที่รันบนเครื่องเดียวกัน
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+
+import httpx
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+SCENARIOS = ["direct-backend", "gateway-flood", "paid-smart-client"]
+# status ที่ถือว่าถูกต้องของแต่ละ scenario (gateway-flood: Gateway ต้องปฏิเสธ bot ด้วย 402 หรือ 429)
+EXPECTED_STATUSES = {"direct-backend": {200}, "gateway-flood": {402, 429}, "paid-smart-client": {200}}
+# environment ที่ service อ่าน บันทึกไว้ในผลเพื่อให้รู้ว่ารันด้วยค่าอะไร
+SETTING_PREFIXES = ("BANK_", "BACKEND_", "GATEWAY_", "VERIFY_", "RATE_LIMIT_", "CACHE_", "RESPONSE_CACHE_", "NEGATIVE_CACHE_",
+                    "TOKEN_", "PAYMENT_", "BREAKER_", "CIRCUIT_", "ADAPTIVE_", "SETTLE_", "SPENT_", "METRICS_", "ARGON2_", "HASH_")
+
+# smart_client.py: เติมเงินแล้วซื้อ token ล่วงหน้า ซื้อเพิ่มเมื่อเหลือน้อย
+TOKENS_PER_PURCHASE = 500
+REFILL_THRESHOLD = 10
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}     # endpoint -> [วินาที]
+        self.statuses = {}      # endpoint -> Counter
+
+    def record(self, endpoint, status, seconds):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        self.statuses.setdefault(endpoint, Counter())[status] += 1
+
+    def summary(self, endpoint, elapsed, expected):
+        latencies = sorted(self.latencies.get(endpoint, []))
+        statuses = self.statuses.get(endpoint, Counter())
+        count = len(latencies)
+        errors = sum(n for status, n in statuses.items() if status not in expected)
+
+        def percentile(fraction):
+            return latencies[min(count - 1, int(count * fraction))] * 1000 if count else None
+
+        return {
+            "requests": count,
+            "throughput_rps": count / elapsed if elapsed else 0.0,
+            "latency_ms": {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99),
+                           "max": latencies[-1] * 1000 if count else None},
+            "error_rate": errors / count if count else 0.0,
+            "statuses": {str(status): n for status, n in sorted(statuses.items(), key=str)},
+        }
+
+
+class Services:
+    def __init__(self, base_port, workdir):
+        self.bank_url = f"http://127.0.0.1:{base_port}"
+        self.backend_url = f"http://127.0.0.1:{base_port + 1}"
+        self.gateway_url = f"http://127.0.0.1:{base_port + 2}"
+        self.base_port = base_port
+        self.workdir = workdir
+        self.processes = []
+
+    def _start(self, args, cwd, env):
+        command = [sys.executable, "-m", "uvicorn", *args, "--host", "127.0.0.1",
+                   "--log-level", "warning", "--no-access-log", "--timeout-keep-alive", "60"]
+        # ค่าจาก environment ของผู้รันมาก่อน ค่าที่ harness ต้องใช้ (URL) ทับทีหลัง
+        self.processes.append(subprocess.Popen(command, cwd=cwd, env={"BANK_MAX_PURCHASE_QUANTITY": "10000", **os.environ, **env}))
+
+    def start(self):
+        self._start(["--app-dir", os.path.join(ROOT, "Bank"), f"{os.getenv('BENCH_BANK_APP', 'main')}:app",
+                     "--port", str(self.base_port)], self.workdir, {})
+        self._start(["backend:app", "--port", str(self.base_port + 1)], ROOT, {})
+        self._start(["gateway:app", "--port", str(self.base_port + 2)], os.path.join(ROOT, "Gateway"),
+                    {"BANK_API_URL": self.bank_url, "BACKEND_API_URL": self.backend_url})
+
+    async def wait_ready(self, client):
+        for url in (f"{self.bank_url}/users/0", f"{self.backend_url}/stats/execution", f"{self.gateway_url}/"):
+            for _ in range(200):
+                try:
+                    await client.get(url)
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+            else:
+                raise RuntimeError(f"{url} did not start")
+
+    def stop(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+
+
+async def timed(recorder, endpoint, request):
+    start = time.perf_counter()
+    try:
+        response = await request
+        status = response.status_code
+    except httpx.HTTPError:
+        response, status = None, "error"
+    recorder.record(endpoint, status, time.perf_counter() - start)
+    return response
+
+
+class PaidClient:
+    def __init__(self, client, services, recorder):
+        self.client = client
+        self.services = services
+        self.recorder = recorder
+        self.user_id = None
+        self.tokens = []
+
+    async def prepare(self):
+        bank = self.services.bank_url
+        response = await self.client.post(f"{bank}/users/", json={"username": f"bench_{uuid.uuid4().hex[:12]}",
+                                                                   "password": "password123"})
+        self.user_id = response.json()["id"]
+        await self.buy()
+
+    async def buy(self):
+        bank = self.services.bank_url
+        purchase = {"user_id": self.user_id, "quantity": TOKENS_PER_PURCHASE}
+        response = await timed(self.recorder, "purchase", self.client.post(f"{bank}/purchase/", json=purchase))
+        if response is not None and response.status_code == 400 and "balance" in response.text.lower():
+            await timed(self.recorder, "topup", self.client.post(f"{bank}/topup/", json={"user_id": self.user_id, "amount": 1000}))
+            response = await timed(self.recorder, "purchase", self.client.post(f"{bank}/purchase/", json=purchase))
+        if response is not None and response.status_code == 200:
+            self.tokens.extend(response.json()["tokens"])
+
+    async def run(self, deadline):
+        gateway = self.services.gateway_url
+        while time.perf_counter() < deadline:
+            if len(self.tokens) < REFILL_THRESHOLD:
+                await self.buy()
+                if not self.tokens:
+                    continue
+            await timed(self.recorder, "premium-data",
+                        self.client.get(f"{gateway}/premium-data", headers={"X-Payment-Token": self.tokens.pop()}))
+
+
+async def run_scenario(name, args):
+    recorder = Recorder()
+    with tempfile.TemporaryDirectory() as workdir:
+        services = Services(args.base_port, workdir)
+        services.start()
+        try:
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+                await services.wait_ready(client)
+
+                if name == "paid-smart-client":
+                    paid = [PaidClient(client, services, recorder) for _ in range(args.concurrency)]
+                    # สมัคร + ซื้อ token รอบแรกก่อนเริ่มจับเวลา (hash รหัสผ่านใช้เวลานาน)
+                    await asyncio.gather(*(paid_client.prepare() for paid_client in paid))
+                    start = time.perf_counter()
+                    await asyncio.gather(*(paid_client.run(start + args.duration) for paid_client in paid))
+                    primary = "premium-data"
+                else:
+                    url, primary = ((f"{services.backend_url}/expensive-data", "expensive-data") if name == "direct-backend"
+                                    else (f"{services.gateway_url}/premium-data", "premium-data"))
+
+                    async def bot(deadline):
+                        while time.perf_counter() < deadline:
+                            await timed(recorder, primary, client.get(url))
+
+                    start = time.perf_counter()
+                    await asyncio.gather(*(bot(start + args.duration) for _ in range(args.concurrency)))
+                elapsed = time.perf_counter() - start
+        finally:
+            services.stop()
+
+    result = recorder.summary(primary, elapsed, EXPECTED_STATUSES[name])
+    result["endpoint"] = primary
+    result["other_endpoints"] = {endpoint: recorder.summary(endpoint, elapsed, {200})
+                                 for endpoint in recorder.latencies if endpoint != primary}
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scenario A vs B benchmark on localhost")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run (default: all)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per scenario")
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent clients")
+    parser.add_argument("--timeout", type=float, default=30.0, help="client timeout in seconds")
+    parser.add_argument("--base-port", type=int, default=18720, help="Bank port; Backend and Gateway use the next two")
+    parser.add_argument("--output", help="results file (default benchmarks/results/scenarios_<date>_<time>.json)")
+    args = parser.parse_args()
+
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "duration": args.duration,
+        "concurrency": args.concurrency,
+        "settings": {key: value for key, value in sorted(os.environ.items()) if key.startswith(SETTING_PREFIXES)},
+        "scenarios": {},
+    }
+    print(f"{'scenario':<18} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}  statuses")
+    for name in args.scenario or SCENARIOS:
+        result = results["scenarios"][name] = asyncio.run(run_scenario(name, args))
+        latency = result["latency_ms"]
+        print(f"{name:<18} {result['throughput_rps']:>8.0f} {latency['p50'] or 0:>8.1f} {latency['p95'] or 0:>8.1f} "
+              f"{latency['p99'] or 0:>8.1f} {result['error_rate']:>7.1%}  {result['statuses']}")
+
+    output = args.output or os.path.join(RESULTS_DIR, f"scenarios_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,15 @@
 from locust import HttpUser, task, between
+import os
 
-# Scenario A (Baseline): ชี้ตรงไปที่ Backend โดยไม่ผ่าน Gateway
-# TARGET_URL = "http://143.198.85.26:8001"
+BACKEND_API_URL = os.getenv("BACKEND_API_URL", "http://143.198.85.26:8001")
+GATEWAY_API_URL = os.getenv("GATEWAY_API_URL", "http://188.166.214.193:8080")
 
+# เลือก scenario ผ่าน environment (SCENARIO=direct หรือ gateway) แทนการ comment สลับบรรทัด
+# Scenario A (Baseline): ชี้ตรงไปที่ Backend โดยไม่ผ่าน Gateway
 # Scenario B (With Gateway): ชี้ผ่าน Gateway
-TARGET_URL = "http://188.166.214.193:8080"
+SCENARIO = os.getenv("SCENARIO", "gateway")
+TARGET_URL = BACKEND_API_URL if SCENARIO == "direct" else GATEWAY_API_URL
+PATH = "/expensive-data" if SCENARIO == "direct" else "/premium-data"
 
 class AttackerBot(HttpUser):
     wait_time = between(0.5, 1.5)
@@ -12,4 +17,4 @@ class AttackerBot(HttpUser):
 
     @task
     def flood_attack(self):
-        self.client.get("/premium-data")
\ No newline at end of file
+        self.client.get(PATH)
\ No newline at end of file
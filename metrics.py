@@ -0,0 +1,264 @@
+# Metrics กลางที่ Gateway, Bank และ Backend ใช้ร่วมกัน (ไม่ต้องพึ่ง prometheus_client)
+# - Counter / Gauge / Histogram เก็บใน dict ตาม label ในหน่วยความจำของ process มี lock ต่อ metric:
+#   Bank เรียกจากหลาย thread (threadpool ของ route แบบ sync, group commit writer, spend log writer, token compactor ฯลฯ)
+#   การบวกค่า/เพิ่ม label ใหม่ต้องไม่หาย และ render() อ่าน snapshot ภายใต้ lock (dict ที่ถูกเพิ่ม key ระหว่าง iterate = RuntimeError)
+# - render() แปลงเป็น Prometheus text format สำหรับ endpoint /metrics
+# - stage(): จับเวลาแต่ละช่วงของ request (เช่น verify, backend, db) ไว้ใน contextvar
+#   แล้ว MetricsMiddleware ใส่เป็น header Server-Timing ให้เห็นว่าเวลาหมดไปกับช่วงไหน
+# - event loop lag: task เบื้องหลัง sleep ทีละ LOOP_LAG_INTERVAL แล้ววัดว่าตื่นช้ากว่ากำหนดเท่าไร
+#   (lag สูง = มีงาน sync/CPU บล็อก event loop อยู่) monitor.py อ่านค่านี้จาก /metrics
+#
+# หมายเหตุ: uvicorn --workers N จะมีตัวเลขแยกกันต่อ worker (scrape แต่ละ process หรือรันทีละ worker)
+#
+# วิธีใช้จาก service ที่รันจากโฟลเดอร์ของตัวเอง (Bank/, Gateway/): เพิ่มโฟลเดอร์แม่ใน sys.path ก่อน import metrics
+
+import asyncio
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# วินาที: ครอบตั้งแต่ verify ใน cache (< 1ms) ถึง backend ที่ timeout (10s)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.1"))    # วินาที (0 = ไม่วัด)
+
+_stages = ContextVar("metrics_stages", default=None)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}   # label values -> จำนวน
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in sorted(values):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            values = list(self._values.items())
+        for labelvalues, value in sorted(values):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labelvalues)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [นับต่อ bucket (ไม่สะสม) ..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        # เก็บเฉพาะ bucket ที่ค่าตกลงไป (O(log n)) แล้วค่อยสะสมตอน render
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labelvalues, list(series)) for labelvalues, series in self._series.items()]
+        for labelvalues, series in sorted(snapshot):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                labels = format_labels(self.labelnames + ("le",), labelvalues + (str(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        # module ถูก import ซ้ำได้ (เช่น main กับ main_async) ใช้ตัวเดิมถ้าชื่อซ้ำ
+        # (SpendLog สร้าง histogram ตอนสร้าง instance ซึ่งอาจตรงกับ render จาก thread อื่น)
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help_text: str, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def gauge(name: str, help_text: str, labelnames=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, help_text, labelnames))
+
+
+def histogram(name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests by route and status", ("service", "method", "route", "status"))
+HTTP_LATENCY = histogram("http_request_duration_seconds", "HTTP request latency by route", ("service", "method", "route"))
+STAGE_LATENCY = histogram("request_stage_duration_seconds", "Time spent in each stage of a request", ("service", "stage"))
+LOOP_LAG = histogram("event_loop_lag_seconds", "How late the event loop woke up from a timed sleep", ("service",),
+                     buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+LOOP_LAG_LAST = gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample", ("service",))
+
+
+def add_stage(name: str, seconds: float):
+    # บวกเวลาเข้า stage ของ request ปัจจุบัน (นอก request เช่น background task จะไม่มี context ก็ข้ามไป)
+    stages = _stages.get()
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_stage(name, time.perf_counter() - start)
+
+
+def server_timing(stages: dict, total: float) -> str:
+    parts = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in stages.items()]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    # ASGI middleware ตรงๆ (ไม่ใช้ @app.middleware("http") ที่สร้าง task + stream เพิ่มทุก request)
+    # ใช้กับ app.add_middleware(metrics.MetricsMiddleware, service="gateway")
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stages = {}
+        token = _stages.set(stages)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                # stage ที่เสร็จก่อนเริ่มส่ง response (handler ทำงานเสร็จแล้ว) + เวลารวมถึงตอนนี้
+                status_code = message["status"]
+                timing = server_timing(stages, time.perf_counter() - start).encode("latin-1")
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing)]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _stages.reset(token)
+            elapsed = time.perf_counter() - start
+            # ใช้ path template ของ route (/users/{user_id}) ไม่ใช่ path จริง กันจำนวน label โตไม่จำกัด
+            # (router ใส่ route ลงใน scope เดียวกันนี้ตอน match)
+            route_path = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUESTS.inc(self.service, scope["method"], route_path, str(status_code))
+            HTTP_LATENCY.observe(elapsed, self.service, scope["method"], route_path)
+            for name, seconds in stages.items():
+                STAGE_LATENCY.observe(seconds, self.service, name)
+
+
+async def measure_event_loop_lag(service: str, interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG.observe(lag, service)
+        LOOP_LAG_LAST.set(lag, service)
+
+
+def start_event_loop_lag_monitor(service: str):
+    # เรียกใน lifespan ตอน startup แล้ว cancel() task ที่ได้ตอน shutdown
+    if LOOP_LAG_INTERVAL <= 0:
+        return None
+    return asyncio.ensure_future(measure_event_loop_lag(service, LOOP_LAG_INTERVAL))
+
+
+def stop_event_loop_lag_monitor(task):
+    if task is not None:
+        task.cancel()
+
+
+def observe_sqlalchemy_commits(session_class, commit_histogram: Histogram, *labelvalues):
+    # จับเวลา COMMIT ของทุก Session (รวม AsyncSession ที่ห่อ Session ไว้ และ group commit writer)
+    # commit ของ group commit writer อยู่ใน thread ของ writer จึงนับใน histogram แต่ไม่อยู่ใน Server-Timing ของ request
+    from sqlalchemy import event
+
+    def before_commit(session):
+        session.info["metrics_commit_started"] = time.perf_counter()
+
+    def after_commit(session):
+        started = session.info.pop("metrics_commit_started", None)
+        if started is not None:
+            elapsed = time.perf_counter() - started
+            commit_histogram.observe(elapsed, *labelvalues)
+            add_stage("db_commit", elapsed)
+
+    event.listen(session_class, "before_commit", before_commit)
+    event.listen(session_class, "after_commit", after_commit)
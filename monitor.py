@@ -1,55 +1,258 @@
-import psutil
-import time
+# วัดการใช้ทรัพยากรแยกตาม service (Gateway / Bank / Backend) ระหว่างรัน load test
+# - เลือก process ด้วย PID หรือข้อความใน command line (รวม process ลูก เช่น process pool ของ hash/backend)
+# - เก็บ CPU %, RSS, จำนวน thread, จำนวน file descriptor ต่อ service ทุก --interval วินาที (ต่ำกว่า 1 วินาทีได้)
+# - event loop lag อ่านจาก /metrics ของแต่ละ service (metrics.py) เป็นค่าเฉลี่ยช่วงระหว่าง sample กับค่าล่าสุด
+# - จบแล้วสรุป mean / p95 / max ต่อ service (พิมพ์ + เขียน <output>_summary.json)
+#
+# ตัวอย่าง:
+#   python monitor.py --match gateway=gateway:app --match bank=main:app --match backend=backend:app \
+#       --lag gateway=http://127.0.0.1:8080 --lag bank=http://127.0.0.1:8000 --lag backend=http://127.0.0.1:8001 \
+#       --interval 0.5 --output run1.csv
+#   python monitor.py --pid bank=12345 --duration 60
+#
+# เทียบกับ Locust: คอลัมน์ timestamp เป็น unix time เหมือน Timestamp ใน <prefix>_stats_history.csv ของ locust --csv
+# สรุปใหม่เฉพาะช่วงที่ load test วิ่งอยู่ได้ด้วย
+#   python monitor.py --summarize run1.csv --start <unix time> --end <unix time>
+
+import argparse
 import csv
+import json
+import os
+import re
+import time
 from datetime import datetime
 
-DURATION = 30 * 60   # 30 นาที
-INTERVAL = 1        # วัดทุก 1 วินาที
-
-with open("locust_smart_client.csv", "w", newline="") as f:
-    writer = csv.writer(f)
-    writer.writerow([
-        "timestamp",
-        "cpu_percent",
-        "ram_used_mb",
-        "ram_available_mb",
-        "ram_percent"
-    ])
-
-    print("📊 Start monitoring CPU & RAM (Ctrl+C to stop)\n")
-
-    try:
-        start = time.time()
-        while time.time() - start < DURATION:
-            timestamp = datetime.now().strftime("%H:%M:%S")
-
-            cpu = psutil.cpu_percent(interval=None)
-            ram = psutil.virtual_memory()
-            ram_used = ram.used / (1024 * 1024)
-            ram_available = ram.available / (1024 * 1024)
-
-            # ---- write CSV ----
-            writer.writerow([
-                datetime.now().isoformat(),
-                cpu,
-                round(ram_used, 2),
-                round(ram_available, 2),
-                ram.percent
-            ])
-            f.flush()
-
-            # ---- print terminal ----
-            print(
-                f"[{timestamp}] "
-                f"CPU: {cpu:5.1f}% | "
-                f"RAM: {ram.percent:5.1f}% "
-                f"({ram_used:7.1f} / {ram_available:7.1f} MB)"
-            )
-
-            time.sleep(INTERVAL)
-
-    except KeyboardInterrupt:
-        print("\n🛑 Monitoring stopped by user")
-
-    finally:
-        print("✅ Metrics saved to metrics_cpu_ram.csv")
+import httpx
+import psutil
+
+FIELDS = ["timestamp", "time", "service", "processes", "cpu_percent", "rss_mb", "threads", "open_fds",
+          "loop_lag_ms", "loop_lag_last_ms"]
+SUMMARY_FIELDS = ["cpu_percent", "rss_mb", "threads", "open_fds", "loop_lag_ms"]
+LAG_LINE = re.compile(r'^event_loop_lag_(seconds_sum|seconds_count|last_seconds)\{service="[^"]*"\} (\S+)$', re.M)
+RESOLVE_INTERVAL = 5    # วินาที: หา process ใหม่ถ้า service ยังไม่เจอหรือ restart ไป
+
+
+def parse_pairs(values, convert=str):
+    # ["bank=main:app", ...] -> {"bank": "main:app"}
+    pairs = {}
+    for value in values or []:
+        name, _, target = value.partition("=")
+        if not target:
+            raise SystemExit(f"expected name=value, got {value!r}")
+        pairs[name] = convert(target)
+    return pairs
+
+
+class ServiceProcesses:
+    def __init__(self, name, pid=None, match=None):
+        self.name = name
+        self.pid = pid
+        self.match = match
+        self._roots = []
+        self._processes = {}    # pid -> psutil.Process (เก็บไว้ให้ cpu_percent คำนวณต่อจากครั้งก่อนได้)
+        self._resolved_at = 0.0
+
+    def _resolve(self):
+        self._resolved_at = time.monotonic()
+        if self.pid is not None:
+            try:
+                self._roots = [psutil.Process(self.pid)]
+            except psutil.NoSuchProcess:
+                self._roots = []
+            return
+        own_pid = os.getpid()
+        matched = {}
+        for process in psutil.process_iter(["pid", "ppid", "cmdline"]):
+            cmdline = " ".join(process.info["cmdline"] or [])
+            if process.info["pid"] != own_pid and self.match in cmdline and "monitor.py" not in cmdline:
+                matched[process.info["pid"]] = process
+        # process ลูกที่ fork มามี command line เดียวกับแม่ เก็บเฉพาะตัวบนสุด แล้วนับลูกผ่าน children()
+        self._roots = [p for pid, p in matched.items() if p.info["ppid"] not in matched]
+
+    def sample(self):
+        if not self._roots or time.monotonic() - self._resolved_at > RESOLVE_INTERVAL:
+            self._resolve()
+        current = {}
+        for root in self._roots:
+            try:
+                for process in [root, *root.children(recursive=True)]:
+                    current[process.pid] = self._processes.get(process.pid, process)
+            except psutil.NoSuchProcess:
+                continue
+
+        row = {"processes": 0, "cpu_percent": 0.0, "rss_mb": 0.0, "threads": 0, "open_fds": 0}
+        for pid, process in current.items():
+            try:
+                with process.oneshot():
+                    cpu = process.cpu_percent(None)
+                    rss = process.memory_info().rss
+                    threads = process.num_threads()
+                    fds = process.num_fds() if hasattr(process, "num_fds") else process.num_handles()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            row["processes"] += 1
+            row["cpu_percent"] += cpu
+            row["rss_mb"] += rss / (1024 * 1024)
+            row["threads"] += threads
+            row["open_fds"] += fds
+        self._processes = current
+        return row
+
+
+class LoopLagReader:
+    def __init__(self, client, base_url):
+        self.client = client
+        self.url = base_url.rstrip("/") + "/metrics"
+        self._previous = None
+
+    def sample(self):
+        # ค่าเฉลี่ย lag ระหว่าง sample = ส่วนต่างของ sum / ส่วนต่างของ count ใน histogram
+        try:
+            text = self.client.get(self.url).text
+        except httpx.HTTPError:
+            return {"loop_lag_ms": None, "loop_lag_last_ms": None}
+        values = {kind: float(value) for kind, value in LAG_LINE.findall(text)}
+        if "seconds_count" not in values:
+            return {"loop_lag_ms": None, "loop_lag_last_ms": None}
+
+        mean_ms = None
+        current = (values["seconds_sum"], values["seconds_count"])
+        if self._previous is not None and current[1] > self._previous[1]:
+            mean_ms = (current[0] - self._previous[0]) / (current[1] - self._previous[1]) * 1000
+        self._previous = current
+        return {"loop_lag_ms": mean_ms, "loop_lag_last_ms": values.get("last_seconds", 0.0) * 1000}
+
+
+def sample_system():
+    ram = psutil.virtual_memory()
+    return {"processes": None, "cpu_percent": psutil.cpu_percent(None), "rss_mb": ram.used / (1024 * 1024),
+            "threads": None, "open_fds": None, "loop_lag_ms": None, "loop_lag_last_ms": None}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(rows, start=None, end=None):
+    by_service = {}
+    timestamps = []
+    for row in rows:
+        timestamp = float(row["timestamp"])
+        if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+            continue
+        timestamps.append(timestamp)
+        service = by_service.setdefault(row["service"], {field: [] for field in SUMMARY_FIELDS})
+        for field in SUMMARY_FIELDS:
+            if row[field] not in (None, ""):
+                service[field].append(float(row[field]))
+
+    summary = {"start": min(timestamps, default=None), "end": max(timestamps, default=None), "services": {}}
+    for name, fields in by_service.items():
+        summary["services"][name] = {
+            field: {"mean": sum(values) / len(values), "p95": percentile(values, 0.95), "max": max(values),
+                    "samples": len(values)}
+            for field, values in fields.items() if values
+        }
+    return summary
+
+
+def print_summary(summary):
+    if summary["start"] is None:
+        print("No samples in range")
+        return
+    print(f"\nSummary {datetime.fromtimestamp(summary['start']):%H:%M:%S} - {datetime.fromtimestamp(summary['end']):%H:%M:%S} "
+          f"(unix {summary['start']:.0f} - {summary['end']:.0f})")
+    print(f"{'service':<10} {'metric':<12} {'mean':>10} {'p95':>10} {'max':>10}")
+    for name, fields in summary["services"].items():
+        for field, stats in fields.items():
+            print(f"{name:<10} {field:<12} {stats['mean']:>10.1f} {stats['p95']:>10.1f} {stats['max']:>10.1f}")
+
+
+def format_row(timestamp, service, values):
+    row = {"timestamp": f"{timestamp:.3f}", "time": datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds"),
+           "service": service}
+    for field in FIELDS[3:]:
+        value = values.get(field)
+        row[field] = "" if value is None else (round(value, 2) if isinstance(value, float) else value)
+    return row
+
+
+def monitor(args):
+    services = [ServiceProcesses(name, pid=pid) for name, pid in parse_pairs(args.pid, int).items()]
+    services += [ServiceProcesses(name, match=match) for name, match in parse_pairs(args.match).items()]
+    client = httpx.Client(timeout=max(args.interval, 0.5))
+    lag_readers = {name: LoopLagReader(client, url) for name, url in parse_pairs(args.lag).items()}
+    output = args.output or f"monitor_{datetime.now():%Y%m%d_%H%M%S}.csv"
+    summary_path = os.path.splitext(output)[0] + "_summary.json"
+
+    rows = []
+    # ครั้งแรกของ cpu_percent(None) ยังไม่มีช่วงให้เทียบ (ได้ 0) ให้ prime ไว้ก่อน
+    psutil.cpu_percent(None)
+    for service in services:
+        service.sample()
+
+    print(f"📊 Monitoring {', '.join(s.name for s in services) or 'system only'} every {args.interval}s (Ctrl+C to stop)\n")
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        start = time.monotonic()
+        next_sample = start + args.interval
+        try:
+            while time.monotonic() - start < args.duration:
+                time.sleep(max(0.0, next_sample - time.monotonic()))
+                next_sample += args.interval
+                timestamp = time.time()
+
+                samples = {"system": sample_system()}
+                for service in services:
+                    values = service.sample()
+                    values.update(lag_readers[service.name].sample() if service.name in lag_readers else {})
+                    samples[service.name] = values
+                for name, reader in lag_readers.items():
+                    if name not in samples:
+                        samples[name] = reader.sample()
+
+                line = []
+                for name, values in samples.items():
+                    row = format_row(timestamp, name, values)
+                    writer.writerow(row)
+                    rows.append(row)
+                    lag = f" lag {values['loop_lag_ms']:.1f}ms" if values.get("loop_lag_ms") is not None else ""
+                    line.append(f"{name} {values.get('cpu_percent') or 0:5.1f}% {values.get('rss_mb') or 0:7.1f}MB{lag}")
+                f.flush()
+                print(f"[{datetime.fromtimestamp(timestamp):%H:%M:%S.%f}"[:-3] + "] " + " | ".join(line))
+        except KeyboardInterrupt:
+            print("\n🛑 Monitoring stopped by user")
+        finally:
+            client.close()
+
+    summary = summarize(rows)
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    print_summary(summary)
+    print(f"✅ Samples saved to {output}, summary saved to {summary_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-service CPU / memory / event loop lag monitor")
+    parser.add_argument("--pid", action="append", metavar="NAME=PID", help="follow a process (and its children) by PID")
+    parser.add_argument("--match", action="append", metavar="NAME=TEXT", help="follow processes whose command line contains TEXT")
+    parser.add_argument("--lag", action="append", metavar="NAME=URL", help="service base URL to read event loop lag from /metrics")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between samples (default 1)")
+    parser.add_argument("--duration", type=float, default=30 * 60, help="seconds to run (default 30 minutes)")
+    parser.add_argument("--output", help="CSV file (default monitor_<date>_<time>.csv)")
+    parser.add_argument("--summarize", metavar="CSV", help="only summarize an existing CSV")
+    parser.add_argument("--start", type=float, help="with --summarize: first unix timestamp to include")
+    parser.add_argument("--end", type=float, help="with --summarize: last unix timestamp to include")
+    args = parser.parse_args()
+
+    if args.summarize:
+        with open(args.summarize, newline="") as f:
+            print_summary(summarize(csv.DictReader(f), args.start, args.end))
+        return
+    monitor(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 from locust import HttpUser, task, between
+import os
 import uuid
+from collections import deque
 
-BANK_API_URL = "http://143.198.85.26:8000"
-GATEWAY_API_URL = "http://188.166.214.193:8080"
+BANK_API_URL = os.getenv("BANK_API_URL", "http://143.198.85.26:8000")
+GATEWAY_API_URL = os.getenv("GATEWAY_API_URL", "http://188.166.214.193:8080")
 
 # ---- ค่าที่ปรับได้ ----
 INITIAL_TOPUP = 50.0      # เติมเงินตอน start (เท่าเดิมตามรูปเล่ม)
@@ -18,7 +20,7 @@ class SmartClient(HttpUser):
 
     def on_start(self):
         self.user_id = None
-        self.tokens = []
+        self.tokens = deque()   # pop จากหัวด้วย popleft() (list.pop(0) ต้องเลื่อนทั้ง list)
         self.prepare_bank_account()
 
     def prepare_bank_account(self):
@@ -114,12 +116,12 @@ class SmartClient(HttpUser):
             if response.status_code == 200:
                 response.success()
                 # [แก้ไข #4] pop หลัง success เท่านั้น ไม่ pop ก่อนรู้ผล
-                self.tokens.pop(0)
+                self.tokens.popleft()
 
             elif response.status_code == 402:
                 response.failure("402 Payment Required")
                 # [แก้ไข #4] pop token ที่ invalid ออก
-                self.tokens.pop(0)
+                self.tokens.popleft()
                 self.buy_token()
 
                 if self.tokens:
@@ -132,7 +134,7 @@ class SmartClient(HttpUser):
                     ) as retry_response:
                         if retry_response.status_code == 200:
                             retry_response.success()
-                            self.tokens.pop(0)
+                            self.tokens.popleft()
                         else:
                             retry_response.failure(
                                 f"Retry Failed: {retry_response.text}"
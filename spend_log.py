@@ -0,0 +1,203 @@
+# Append-only log ของการใช้ token: บันทึกลงดิสก์ก่อนตอบ valid แล้วค่อยเอาไปใช้ทีหลัง
+#   Bank (token_index.py) replay ลงตาราง Tokens / Gateway (offline_tokens.py) settle กับ Bank ผ่าน /verify/batch
+# หนึ่งบรรทัดต่อ token: "<token_id> <user_id> <used_at (unix time)> <crc32>\n" (crc ใช้ตัดบรรทัดที่เขียนไม่จบตอนเครื่องดับ)
+#
+# writer thread เดียวรวมคำขอที่รออยู่เป็น batch แล้ว write + fsync ครั้งเดียวต่อ batch (แบบเดียวกับ GroupCommitWriter)
+# caller ได้ผลก็ต่อเมื่อ fsync เสร็จแล้ว: token ที่ตอบ valid ไปแล้วอยู่ในดิสก์เสมอ แม้ process/เครื่องดับ
+#
+# ไฟล์แบ่งเป็น segment (spend.log.000001, spend.log.000002, ...) writer เขียน segment ล่าสุดเท่านั้น
+# rotate() ปิด segment ปัจจุบันให้ replay ได้ replay เสร็จแล้วลบทิ้ง (segment ที่ค้างจากรอบก่อน = ต้อง replay ตอน startup)
+# ไฟล์ .lock กันสอง process (Bank หรือ Gateway worker) ใช้ log เดียวกัน (state ใน memory แยกกัน = token เดียวใช้ได้สองครั้ง)
+
+import glob
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:     # Windows: ไม่มี flock (ต้องระวังเองว่ารันแค่ process เดียว)
+    fcntl = None
+
+
+class SpendLogError(Exception):
+    # written=False: ไม่มี byte ใดของคำขอนี้ลงไฟล์ (write ล้มก่อนถึง) token คืนเข้า index ได้
+    # written=True: อาจอยู่ในไฟล์แล้ว (write ได้บางส่วน / fsync ล้ม) replay ตอน startup อาจ mark used
+    def __init__(self, cause: Exception, written: bool):
+        super().__init__(f"spend log write failed: {cause!r}")
+        self.written = written
+
+
+def format_record(token_id: str, user_id: int, used_at: float) -> bytes:
+    body = f"{token_id} {user_id} {used_at:.6f}".encode()
+    return body + b" %08x\n" % zlib.crc32(body)
+
+
+def read_segment(path: str):
+    # คืน (token_id, user_id, used_at) ทีละบรรทัด หยุดที่บรรทัดแรกที่ไม่สมบูรณ์ (เขียนค้างตอนเครื่องดับ ยังไม่เคยตอบ valid)
+    with open(path, "rb") as f:
+        for line in f:
+            body, _, crc = line.rstrip(b"\n").rpartition(b" ")
+            if not line.endswith(b"\n") or crc != b"%08x" % zlib.crc32(body):
+                return
+            token_id, user_id, used_at = body.decode().split(" ")
+            yield token_id, int(user_id), float(used_at)
+
+
+class SpendLog:
+    def __init__(self, path: str, max_batch: int, max_wait_ms: float, service: str = "bank"):
+        self.path = os.path.abspath(path)
+        self._fsync_latency = metrics.histogram(f'{service}_spend_log_fsync_seconds', 'Write + fsync of one spend log batch')
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._file = None
+        self._file_lock = threading.Lock()     # writer thread กับ rotate()
+        self._lock_file = None
+        self._segment = 0
+
+        self.batches = 0
+        self.records = 0
+        self.last_fsync_ms = 0.0
+
+    def segments(self) -> list:
+        # segment ที่มีอยู่บนดิสก์ เรียงจากเก่าไปใหม่
+        return sorted(path for path in glob.glob(glob.escape(self.path) + ".*") if path.rpartition(".")[2].isdigit())
+
+    def acquire(self):
+        # เรียกก่อนอ่าน/replay segment ที่ค้างอยู่: ถ้า process อื่นยังใช้ log นี้อยู่ให้ล้มตั้งแต่ startup
+        if self._lock_file is None:
+            self._lock_file = open(self.path + ".lock", "w")
+            if fcntl is not None:
+                try:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    self._lock_file.close()
+                    self._lock_file = None
+                    raise RuntimeError(f"{self.path} is in use by another process")
+
+    def start(self):
+        if self._thread is None:
+            self.acquire()
+            existing = self.segments()
+            self._segment = int(existing[-1].rpartition(".")[2]) if existing else 0
+            self._open_segment()
+            self._thread = threading.Thread(target=self._run, name="spend-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # เขียนงานที่ค้างในคิวให้หมดก่อนแล้วค่อยหยุด
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            self._file.close()
+            self._file = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def submit(self, records: list) -> Future:
+        # records: บรรทัดจาก format_record / ผลเป็น None เมื่อ fsync แล้ว ไม่งั้น SpendLogError
+        future = Future()
+        self._queue.put((future, records))
+        return future
+
+    def rotate(self) -> list:
+        # ปิด segment ปัจจุบัน (ถ้ามีข้อมูล) แล้วคืน segment ที่ปิดแล้วทั้งหมด (พร้อม replay)
+        with self._file_lock:
+            if self._file is not None and self._file.tell() > 0:
+                self._file.close()
+                self._open_segment()
+            current = self._file.name if self._file is not None else None
+        return [path for path in self.segments() if path != current]
+
+    def remove(self, path: str):
+        os.remove(path)
+
+    def _open_segment(self):
+        self._segment += 1
+        # ไม่ buffer: write() คืนจำนวน byte ที่ลงไฟล์จริง (รู้ได้ว่าคำขอไหนยังไม่ลงไฟล์เลยตอน error)
+        self._file = open(f"{self.path}.{self._segment:06d}", "ab", buffering=0)
+        # fsync directory: ชื่อไฟล์ใหม่ต้องอยู่บนดิสก์ก่อนข้อมูลในไฟล์จะนับว่า durable
+        if hasattr(os, "O_DIRECTORY"):
+            fd = os.open(os.path.dirname(self.path), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+
+            # ไม่รอ (max_wait 0) batch ก็เกิดเองจากคำขอที่เข้ามาระหว่าง fsync รอบก่อน
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._write_batch(batch)
+            if stopping:
+                return
+
+    def _write_batch(self, batch):
+        data = b"".join(record for _, records in batch for record in records)
+        written = 0
+        try:
+            with self._file_lock:
+                start = time.perf_counter()
+                view = memoryview(data)
+                while written < len(data):
+                    written += self._file.write(view[written:])
+                os.fsync(self._file.fileno())
+                elapsed = time.perf_counter() - start
+        except Exception as e:
+            # ท้ายไฟล์อาจมีบรรทัดที่เขียนไม่จบ: เริ่ม segment ใหม่ ไม่ให้บรรทัดหลังจากนี้ต่อท้ายแล้วถูกตัดทิ้งตอน replay
+            with self._file_lock:
+                try:
+                    self._file.close()
+                    self._open_segment()
+                except OSError:
+                    pass
+            # fsync ล้ม = ไม่รู้ว่าอะไรลงดิสก์แล้วบ้าง / write ล้ม = คำขอที่เริ่มหลังจาก byte สุดท้ายที่เขียนได้ยังไม่ลงไฟล์แน่นอน
+            offset = 0
+            for future, records in batch:
+                landed = written == len(data) or offset < written
+                future.set_exception(SpendLogError(e, written=landed))
+                offset += sum(len(record) for record in records)
+            return
+        self.last_fsync_ms = elapsed * 1000
+        self._fsync_latency.observe(elapsed)
+        self.batches += 1
+        self.records += sum(len(records) for _, records in batch)
+        for future, _ in batch:
+            future.set_result(None)
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None,
+            "queue_depth": self._queue.qsize(),
+            "batches": self.batches,
+            "records": self.records,
+            "avg_batch_records": self.records / self.batches if self.batches else 0.0,
+            "last_fsync_ms": self.last_fsync_ms,
+            "segments": len(self.segments()),
+        }
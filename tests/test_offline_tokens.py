@@ -0,0 +1,219 @@
+# Gateway/offline_tokens.py: ตรวจ signed token ที่ Gateway โดยไม่ถาม Bank ต้องไม่ยอมรับ token ปลอม/หมดอายุ/ใช้ซ้ำ
+# token ที่ตอบผ่านไปแล้วต้องถึง Bank เสมอ (settle ล้มแล้วลองใหม่, Gateway ดับก่อน settle)
+# วิธีรัน: python -m pytest -q tests
+
+import asyncio
+import os
+import sys
+import time
+from decimal import Decimal
+
+import httpx
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "Gateway"), ROOT]
+
+from offline_tokens import OfflineTokenVerifier
+from spend_log import SpendLog
+
+sys.path.insert(0, os.path.join(ROOT, "Bank"))
+from token_signing import make_signed_token
+
+SECRET = "test-secret"
+WATERMARK = 100
+
+
+def signed(serial: int, expires_in: int = 3600, user_id: int = 7) -> str:
+    return make_signed_token(SECRET, user_id, Decimal("0.10"), serial, int(time.time()) + expires_in)
+
+
+class FakeBank:
+    # แทน Upstream ของ Bank: จำ token ที่ settle แล้ว และจำลอง Bank ล่มได้
+    def __init__(self):
+        self.calls = []
+        self.settled = []
+        self.failures = 0   # จำนวน /verify/batch ถัดไปที่จะล้ม
+
+    async def get(self, path):
+        self.calls.append(path)
+        return httpx.Response(200, json={"next_serial": WATERMARK}, request=httpx.Request("GET", path))
+
+    async def post(self, path, json):
+        self.calls.append(path)
+        if self.failures:
+            self.failures -= 1
+            raise httpx.ConnectError("bank is down")
+        results = [{"valid": token not in self.settled} for token in json["token_ids"]]
+        self.settled.extend(json["token_ids"])
+        return httpx.Response(200, json={"results": results}, request=httpx.Request("POST", path))
+
+
+def make_verifier(bank, journal_path, max_pending=1000):
+    return OfflineTokenVerifier(bank, secret=SECRET, block_size=64, settle_batch_size=2, settle_interval_ms=10,
+                                journal=SpendLog(journal_path, max_batch=64, max_wait_ms=0, service="gateway"),
+                                journal_timeout=5, max_pending=max_pending)
+
+
+async def started(bank, journal_path, **kwargs):
+    verifier = make_verifier(bank, journal_path, **kwargs)
+    await verifier.start()
+    for _ in range(500):
+        if verifier.watermark is not None:
+            return verifier
+        await asyncio.sleep(0.01)
+    raise AssertionError("watermark was never fetched")
+
+
+async def crash(verifier):
+    # เหมือน Gateway ถูก SIGKILL: หยุด task และปล่อย lock โดยไม่ settle
+    for task in verifier._tasks:
+        task.cancel()
+    await asyncio.gather(*verifier._tasks, return_exceptions=True)
+    verifier.journal.stop()
+
+
+async def wait_for(condition):
+    for _ in range(500):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition was never met")
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "settle.log")
+
+
+def test_rejects_forged_and_bit_flipped_signatures(journal_path):
+    async def run():
+        verifier = await started(FakeBank(), journal_path)
+        token = signed(WATERMARK)
+        payload, _, signature = token.rpartition(".")
+        flipped = payload + "." + ("A" if signature[0] != "A" else "B") + signature[1:]
+        forged_serial = token.replace(f".{WATERMARK}.", f".{WATERMARK + 1}.")
+        other_secret = make_signed_token("other", 7, Decimal("0.10"), WATERMARK, int(time.time()) + 3600)
+        for bad in (flipped, forged_serial, other_secret, payload, "v1.garbage"):
+            assert await verifier.verify(bad) == (False, "Invalid token signature")
+        assert verifier.verified_offline == 0
+        await verifier.aclose()
+
+    asyncio.run(run())
+
+
+def test_rejects_expired_token(journal_path):
+    async def run():
+        verifier = await started(FakeBank(), journal_path)
+        assert await verifier.verify(signed(WATERMARK, expires_in=-1)) == (False, "Token expired")
+        await verifier.aclose()
+
+    asyncio.run(run())
+
+
+def test_double_spend_in_one_process(journal_path):
+    async def run():
+        bank = FakeBank()
+        verifier = await started(bank, journal_path)
+        token = signed(WATERMARK + 5)
+        assert await verifier.verify(token) == (True, None)
+        assert await verifier.verify(token) == (False, "Token already used")
+        await verifier.aclose()
+        assert bank.settled == [token]
+
+    asyncio.run(run())
+
+
+def test_serial_below_watermark_is_deferred_to_bank(journal_path):
+    async def run():
+        bank = FakeBank()
+        verifier = await started(bank, journal_path)
+        assert await verifier.verify(signed(WATERMARK - 1)) is None
+        assert verifier.deferred_to_bank == 1
+        await verifier.aclose()
+        assert bank.settled == []
+
+    asyncio.run(run())
+
+
+def test_settle_retries_after_http_error(journal_path):
+    async def run():
+        bank = FakeBank()
+        bank.failures = 2
+        verifier = await started(bank, journal_path)
+        tokens = [signed(WATERMARK + serial) for serial in range(3)]
+        for token in tokens:
+            assert await verifier.verify(token) == (True, None)
+
+        await wait_for(lambda: verifier.settled == 3)
+        assert verifier.settle_failures == 2
+        assert verifier.settle_conflicts == 0
+        assert sorted(bank.settled) == sorted(tokens)
+        assert verifier.stats()["settle_pending"] == 0
+        await verifier.aclose()
+        assert verifier.journal.segments() == []
+
+    asyncio.run(run())
+
+
+def test_unsettled_spends_survive_a_crash(journal_path):
+    async def run():
+        bank = FakeBank()
+        bank.failures = 10 ** 6     # Bank ล่มตลอดช่วงแรก: settle ไม่ได้เลย
+        verifier = await started(bank, journal_path)
+        token = signed(WATERMARK + 1)
+        assert await verifier.verify(token) == (True, None)
+        await crash(verifier)
+        assert bank.settled == []
+
+        # เริ่มใหม่: segment ที่ค้างต้องถึง Bank ก่อนขอ watermark (token นี้ต่ำกว่า watermark ใหม่ -> ถาม Bank)
+        bank.failures = 1
+        bank.calls.clear()
+        verifier = await started(bank, journal_path)
+        assert bank.settled == [token]
+        assert bank.calls.index("/verify/batch") < bank.calls.index("/tokens/serial-watermark")
+        await verifier.aclose()
+
+    asyncio.run(run())
+
+
+def test_full_settle_backlog_falls_back_to_bank(journal_path):
+    async def run():
+        bank = FakeBank()
+        bank.failures = 10 ** 6
+        verifier = await started(bank, journal_path, max_pending=1)
+        first, second = signed(WATERMARK), signed(WATERMARK + 1)
+        assert await verifier.verify(first) == (True, None)
+        assert await verifier.verify(second) is None
+        # ส่งไปให้ Bank ตัดยอดแล้วใช้ซ้ำที่ Gateway ไม่ได้
+        assert await verifier.verify(second) == (False, "Token already used")
+        assert verifier.overflow_to_bank == 1
+        await crash(verifier)
+
+    asyncio.run(run())
+
+
+def test_second_process_cannot_share_the_journal(journal_path):
+    async def run():
+        verifier = await started(FakeBank(), journal_path)
+        with pytest.raises(RuntimeError):
+            await make_verifier(FakeBank(), journal_path).start()
+        await verifier.aclose()
+
+    asyncio.run(run())
+
+
+def test_reserved_token_is_usable_again_only_after_release(journal_path):
+    async def run():
+        verifier = await started(FakeBank(), journal_path)
+        charged, refunded = signed(WATERMARK), signed(WATERMARK + 1)
+        assert verifier.reserve(charged) is True and verifier.reserve(refunded) is True
+        assert verifier.reserve(signed(WATERMARK - 1)) is None
+        assert verifier.reserve(charged) == (False, "Token already used")
+        # Bank ตอบว่าไม่ได้ตัดยอด (ใบอื่นในคำขอไม่ผ่าน)
+        verifier.release(refunded)
+        assert await verifier.verify(charged) == (False, "Token already used")
+        assert await verifier.verify(refunded) == (True, None)
+        await verifier.aclose()
+
+    asyncio.run(run())
@@ -0,0 +1,227 @@
+# token_index.py + spend_log.py: token ที่ตอบ valid ไปแล้วต้องไม่ได้ valid อีกครั้ง ไม่ว่า Bank จะดับกลางคัน
+# ท้าย segment จะขาด/เสีย หรือ write/fsync ของ spend log จะล้ม
+# คำขอแบบ atomic (route ที่ราคาหลาย token) ตัดยอดทุกใบหรือไม่ตัดเลย ทั้งทาง index และ crud
+# วิธีรัน: python -m pytest -q tests
+
+import os
+import sys
+import threading
+
+import pytest
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.orm import Session, sessionmaker
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path[:0] = [os.path.join(ROOT, "Bank"), ROOT]
+
+import crud
+import spend_log
+from models import Base, Token
+from spend_log import SpendLog
+from token_index import SpendUnavailable, TokenIndex, token_key
+
+
+@pytest.fixture
+def bank(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'bank.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = factory()
+    try:
+        user = crud.create_user_with_hash(db, "spender", "-", 1000)
+        tokens = crud.purchase(db, user.id, 20, 0.1)["tokens"]
+    finally:
+        db.close()
+    yield factory, tokens, str(tmp_path / "spend.log")
+    engine.dispose()
+
+
+def open_index(factory, log_path):
+    index = TokenIndex(factory, SpendLog(log_path, max_batch=64, max_wait_ms=0), replay_interval=3600, replay_batch_size=5)
+    index.start()
+    return index
+
+
+def crash(index):
+    # เหมือน process ถูก SIGKILL: หยุด thread และปล่อย lock โดยไม่ replay segment ที่ค้าง
+    event.remove(Session, "after_commit", index._after_commit)
+    event.remove(Session, "after_transaction_end", index._after_transaction_end)
+    index._stop.set()
+    index._thread.join()
+    index.log.stop()
+
+
+def verify(index, factory, token_ids, atomic=False):
+    # เหมือน /verify/batch: index ก่อน token ที่ index ไม่รู้จักใช้ crud
+    results = index.spend(token_ids, timeout=5, atomic=atomic)
+    unknown = [token_id for token_id, result in zip(token_ids, results) if result is None]
+    if unknown:
+        db = factory()
+        try:
+            fallback = iter(crud.verify_and_use_tokens(db, unknown, atomic))
+        finally:
+            db.close()
+        results = [result if result is not None else next(fallback) for result in results]
+    return results
+
+
+def valid(results) -> list:
+    return [result["token_id"] for result in results if result["valid"]]
+
+
+def used_tokens(factory) -> set:
+    db = factory()
+    try:
+        return set(db.execute(select(Token.token_id).where(Token.used == True)).scalars())
+    finally:
+        db.close()
+
+
+def test_restart_after_torn_and_corrupt_tail_never_spends_twice(bank):
+    factory, tokens, log_path = bank
+    index = open_index(factory, log_path)
+    acknowledged = valid(verify(index, factory, tokens[:8]))
+    assert acknowledged == tokens[:8]
+    crash(index)
+
+    # ท้าย segment: บรรทัดที่ crc ไม่ตรง (token ที่ไม่เคยตอบ valid) ตามด้วยบรรทัดที่เขียนไม่จบ
+    segment = index.log.segments()[-1]
+    with open(segment, "ab") as f:
+        f.write(spend_log.format_record(tokens[8], 1, 0.0)[:-5] + b"beef\n")
+        f.write(spend_log.format_record(tokens[9], 1, 0.0)[:20])
+
+    index = open_index(factory, log_path)
+    assert index.log.segments() == [index.log._file.name]
+    assert set(acknowledged) <= used_tokens(factory)
+    assert tokens[8] not in used_tokens(factory) and tokens[9] not in used_tokens(factory)
+
+    results = verify(index, factory, tokens)
+    assert valid(results) == tokens[8:]
+    assert all(result["message"] == 'Token already used' for result in results[:8])
+    index.stop()
+
+    index = open_index(factory, log_path)
+    assert valid(verify(index, factory, tokens)) == []
+    assert used_tokens(factory) == set(tokens)
+    index.stop()
+
+
+def test_fsync_failure_keeps_tokens_claimed(bank, monkeypatch):
+    factory, tokens, log_path = bank
+    index = open_index(factory, log_path)
+    real_fsync = os.fsync
+    calls = []
+
+    def failing_fsync(fd):
+        # ครั้งแรกที่ fsync segment ล้ม (write ลง page cache ไปแล้ว)
+        if not calls and not os.path.isdir(f"/proc/self/fd/{fd}"):
+            calls.append(fd)
+            raise OSError(5, "Input/output error")
+        return real_fsync(fd)
+
+    monkeypatch.setattr(spend_log.os, "fsync", failing_fsync)
+    with pytest.raises(SpendUnavailable):
+        index.spend([tokens[0]], timeout=5)
+    monkeypatch.setattr(spend_log.os, "fsync", real_fsync)
+
+    # record อาจอยู่ในดิสก์แล้ว: ห้ามคืน token เข้า index
+    assert verify(index, factory, [tokens[0]])[0]["message"] == 'Token already used'
+    assert index.stats()["released"] == 0
+    crash(index)
+
+    # record ลงไฟล์แล้ว (แค่ fsync ล้ม) replay ตอน startup mark used: ยังไม่เคยได้ valid ก็ยังใช้ไม่ได้
+    index = open_index(factory, log_path)
+    assert tokens[0] in used_tokens(factory)
+    assert valid(verify(index, factory, tokens)) == tokens[1:]
+    index.stop()
+
+
+class FailingFile:
+    # segment ที่ write ล้มก่อนมี byte ใดลงไฟล์ (เช่น ENOSPC)
+    def __init__(self, file):
+        self.file = file
+        self.name = file.name
+
+    def write(self, data):
+        raise OSError(28, "No space left on device")
+
+    def tell(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def test_write_failure_before_any_bytes_releases_tokens(bank):
+    factory, tokens, log_path = bank
+    index = open_index(factory, log_path)
+    index.log._file = FailingFile(index.log._file)
+    with pytest.raises(SpendUnavailable):
+        index.spend(tokens[:3], timeout=5)
+
+    # ไม่มี byte ใดลงไฟล์: token กลับเข้า index และใช้ได้ครั้งเดียว
+    assert index.stats()["released"] == 3
+    assert valid(verify(index, factory, tokens[:3])) == tokens[:3]
+    assert valid(verify(index, factory, tokens[:3])) == []
+    index.stop()
+    assert set(tokens[:3]) == used_tokens(factory)
+
+
+def test_fsync_timeout_answers_unavailable_and_keeps_tokens_claimed(bank, monkeypatch):
+    factory, tokens, log_path = bank
+    index = open_index(factory, log_path)
+    real_fsync = os.fsync
+    release = threading.Event()
+
+    def slow_fsync(fd):
+        release.wait()
+        return real_fsync(fd)
+
+    monkeypatch.setattr(spend_log.os, "fsync", slow_fsync)
+    with pytest.raises(SpendUnavailable):
+        index.spend([tokens[0]], timeout=0.05)
+    assert verify(index, factory, [tokens[0]])[0]["message"] == 'Token already used'
+    release.set()
+    monkeypatch.setattr(spend_log.os, "fsync", real_fsync)
+
+    index.stop()
+    assert index.stats()["released"] == 0
+    assert tokens[0] in used_tokens(factory)
+
+
+def test_atomic_crud_spends_all_or_nothing(bank):
+    factory, tokens, _ = bank
+    db = factory()
+    try:
+        assert valid(crud.verify_and_use_tokens(db, tokens[:1])) == tokens[:1]
+        results = crud.verify_and_use_tokens(db, [tokens[1], tokens[0], "missing"], atomic=True)
+        assert [result["message"] for result in results] == [crud.NOT_CHARGED, 'Token already used', 'Token not found']
+        assert valid(crud.verify_and_use_tokens(db, [tokens[2], tokens[2]], atomic=True)) == []
+        assert used_tokens(factory) == {tokens[0]}
+
+        assert valid(crud.verify_and_use_tokens(db, tokens[1:3], atomic=True)) == tokens[1:3]
+        assert used_tokens(factory) == set(tokens[:3])
+    finally:
+        db.close()
+
+
+def test_atomic_index_claims_every_token_or_none(bank):
+    factory, tokens, log_path = bank
+    index = open_index(factory, log_path)
+    assert valid(verify(index, factory, tokens[:1])) == tokens[:1]
+
+    # ใบที่อยู่ใน pending: ไม่ claim ใบอื่น
+    results = verify(index, factory, [tokens[1], tokens[0]], atomic=True)
+    assert [result["message"] for result in results] == [crud.NOT_CHARGED, 'Token already used']
+    # ใบที่ index ไม่รู้จัก: ทั้งคำขอไปที่ crud ใบที่ index ถืออยู่ไม่ถูกตัดยอดและยังใช้ได้ครั้งเดียว
+    results = verify(index, factory, [tokens[2], "missing"], atomic=True)
+    assert [result["message"] for result in results] == [crud.NOT_CHARGED, 'Token not found']
+    assert valid(verify(index, factory, tokens[1:4], atomic=True)) == tokens[1:4]
+    assert valid(verify(index, factory, tokens[2:3])) == []
+
+    # ใบที่ index ไม่รู้จักแต่ใช้ได้ (เช่น token แบบ book): crud ตัดยอดทั้งคู่ index ต้องไม่ตอบ valid ซ้ำ
+    del index._tokens[token_key(tokens[5])]
+    assert valid(verify(index, factory, tokens[4:6], atomic=True)) == tokens[4:6]
+    assert valid(verify(index, factory, tokens[4:6])) == []
+    index.stop()
+    assert used_tokens(factory) == set(tokens[:6])